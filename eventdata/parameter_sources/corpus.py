@@ -0,0 +1,222 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""
+Pre-generated bulk corpora for the ``elasticlogs_corpus`` parameter source.
+
+A corpus is a directory that contains:
+
+* ``corpus.json``: Metadata about the corpus and the parameters it has been generated with.
+* ``part-<n>.ndjson`` (or ``part-<n>.ndjson.gz``): The bulk request bodies (action-and-metadata line followed by the
+  document) of one generator partition, written back to back. Compressed corpora contain one gzip member per bulk
+  request so each bulk can be decompressed on its own while the file is still a valid gzip file.
+* ``part-<n>.offsets``: A native ``Q`` array with the byte offsets of all bulk requests in the corresponding part file
+  (including the end offset of the last one) followed by the number of documents of each bulk request.
+
+Partitions are generated in parallel, each with its own random streams derived from the seed (see ``randomstream``)
+and a simulated clock that advances by a fixed interval per bulk request. Thus the same arguments always produce the
+same corpus.
+
+A corpus is generated with ``python3 -m eventdata.parameter_sources.corpus``. Run it with ``--help`` for all options.
+"""
+
+import argparse
+import array
+import copy
+import datetime
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import types
+
+logger = logging.getLogger("track.eventdata")
+
+FORMAT_VERSION = 1
+METADATA_FILE = "corpus.json"
+# absolute starting point so a corpus does not depend on the time it has been generated
+DEFAULT_STARTING_POINT = "2020-01-01 00:00:00"
+
+
+class SimulatedClock:
+    """
+    Replaces ``datetime.datetime.utcnow`` for offline generation. Every call advances the clock by a fixed interval.
+    """
+    def __init__(self, start, interval):
+        self._now = start
+        self._interval = interval
+
+    def __call__(self):
+        now = self._now
+        self._now += self._interval
+        return now
+
+
+def part_file_name(partition_index, compressed):
+    return "part-{:04d}.ndjson{}".format(partition_index, ".gz" if compressed else "")
+
+
+def offsets_file_name(partition_index):
+    return "part-{:04d}.offsets".format(partition_index)
+
+
+def load_metadata(corpus_dir):
+    with open(os.path.join(corpus_dir, METADATA_FILE), "rt") as f:
+        metadata = json.load(f)
+    if metadata.get("format_version") != FORMAT_VERSION:
+        raise ValueError("Corpus [{}] has format version [{}] but [{}] is required.".format(
+            corpus_dir, metadata.get("format_version"), FORMAT_VERSION))
+    return metadata
+
+
+def load_offsets(corpus_dir, part):
+    """
+    :return: A tuple (offsets, documents) with the byte offsets of all bulk requests in the part file (plus the end
+             offset of the last one) and the number of documents in each bulk request.
+    """
+    offsets = array.array("Q")
+    with open(os.path.join(corpus_dir, part["offsets"]), "rb") as f:
+        offsets.fromfile(f, 2 * part["bulks"] + 1)
+    return offsets[:part["bulks"] + 1], offsets[part["bulks"] + 1:]
+
+
+def generate_partition(corpus_dir, params, partition_index, total_partitions, bulks, compress):
+    # imported lazily so reading a corpus does not load the generator data sets
+    from eventdata.parameter_sources.elasticlogs_bulk_source import ElasticlogsBulkSource
+
+    source = ElasticlogsBulkSource(types.SimpleNamespace(indices=[]), params)
+    client_source = source.partition(partition_index, total_partitions)
+    offsets = array.array("Q", [0])
+    documents = array.array("Q")
+    part = part_file_name(partition_index, compress)
+    with open(os.path.join(corpus_dir, part), "wb") as f:
+        for _ in range(bulks):
+            try:
+                bulk = client_source.params()
+            except StopIteration:
+                break
+            body = bulk["body"]
+            if compress:
+                # a fixed modification time keeps the output reproducible
+                body = gzip.compress(body, mtime=0)
+            f.write(body)
+            offsets.append(offsets[-1] + len(body))
+            documents.append(bulk["bulk-size"])
+    with open(os.path.join(corpus_dir, offsets_file_name(partition_index)), "wb") as f:
+        offsets.tofile(f)
+        documents.tofile(f)
+    return {
+        "name": part,
+        "offsets": offsets_file_name(partition_index),
+        "bulks": len(documents),
+        "documents": sum(documents)
+    }
+
+
+def _generate_partition(args):
+    return generate_partition(*args)
+
+
+def generate(corpus_dir, params, documents, partitions, workers=None, compress=False, bulk_interval=1.0):
+    """
+    Generates a corpus.
+
+    :param corpus_dir: The directory to write the corpus to. It is created if it does not exist.
+    :param params: Parameters for ``ElasticlogsBulkSource`` (e.g. ``index``, ``bulk-size`` or ``seed``).
+    :param documents: The total number of documents to generate. It is rounded up to full bulk requests per partition.
+    :param partitions: The number of partitions. Each partition uses its own random streams.
+    :param workers: The number of worker processes. Defaults to the number of partitions. 1 generates inline.
+    :param compress: Whether to gzip-compress each bulk request.
+    :param bulk_interval: Simulated time in seconds between two bulk requests of a partition.
+    :return: The corpus metadata.
+    """
+    params = copy.deepcopy(params)
+    params.setdefault("seed", "eventdata")
+    params.setdefault("starting_point", DEFAULT_STARTING_POINT)
+    params["bulk_body_format"] = "bytes"
+    bulk_size = int(params["bulk-size"])
+    generation_params = dict(params)
+    # each partition gets its own copy of the clock as `ElasticlogsBulkSource#partition()` deep-copies the parameters
+    generation_params["__utc_now"] = SimulatedClock(datetime.datetime(year=2020, month=1, day=1),
+                                                    datetime.timedelta(seconds=bulk_interval))
+
+    bulks_per_partition = -(-documents // (bulk_size * partitions))
+    os.makedirs(corpus_dir, exist_ok=True)
+    tasks = [(corpus_dir, generation_params, i, partitions, bulks_per_partition, compress) for i in range(partitions)]
+    workers = workers or partitions
+    if workers == 1:
+        parts = [_generate_partition(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(processes=min(workers, partitions)) as pool:
+            parts = pool.map(_generate_partition, tasks)
+
+    metadata = {
+        "format_version": FORMAT_VERSION,
+        "compressed": compress,
+        "bulk_interval": bulk_interval,
+        "params": params,
+        "documents": sum(part["documents"] for part in parts),
+        "parts": parts
+    }
+    with open(os.path.join(corpus_dir, METADATA_FILE), "wt") as f:
+        json.dump(metadata, f, indent=2, sort_keys=True)
+    return metadata
+
+
+def parse_param(value):
+    key, sep, raw_value = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError("Expected key=value but got [{}]".format(value))
+    try:
+        return key, json.loads(raw_value)
+    except ValueError:
+        return key, raw_value
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python3 -m eventdata.parameter_sources.corpus",
+                                     description="Pre-generates a bulk corpus for the elasticlogs_corpus parameter source.")
+    parser.add_argument("--output-dir", required=True, help="Directory to write the corpus to.")
+    parser.add_argument("--documents", type=int, required=True, help="Total number of documents to generate.")
+    parser.add_argument("--bulk-size", type=int, default=1000, help="Documents per bulk request (default: 1000).")
+    parser.add_argument("--index", default="elasticlogs", help="Index name or pattern (default: elasticlogs).")
+    parser.add_argument("--seed", default="eventdata", help="Seed for the random streams (default: eventdata).")
+    parser.add_argument("--partitions", type=int, default=os.cpu_count(),
+                        help="Number of partitions, each with its own random streams (default: number of cores).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (default: number of partitions).")
+    parser.add_argument("--compress", action="store_true", help="Compress each bulk request with gzip.")
+    parser.add_argument("--bulk-interval", type=float, default=1.0,
+                        help="Simulated time in seconds between two bulk requests of a partition (default: 1.0).")
+    parser.add_argument("--param", type=parse_param, action="append", default=[], metavar="KEY=VALUE",
+                        help="Additional parameter for the elasticlogs_bulk parameter source, e.g. "
+                             "record_raw_event_size=true. May be repeated.")
+    args = parser.parse_args(args)
+
+    params = dict(args.param)
+    params["index"] = args.index
+    params["bulk-size"] = args.bulk_size
+    params["seed"] = args.seed
+    metadata = generate(args.output_dir, params, args.documents, args.partitions, workers=args.workers,
+                        compress=args.compress, bulk_interval=args.bulk_interval)
+    print("Generated [{}] documents in [{}] parts in [{}].".format(metadata["documents"], len(metadata["parts"]),
+                                                                 args.output_dir))
+
+
+if __name__ == "__main__":
+    main()
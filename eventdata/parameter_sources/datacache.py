@@ -0,0 +1,484 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""
+Binary cache for the data sets in ``eventdata/parameter_sources/data``.
+
+Parsing the gzipped JSON data sets (and building the alias tables for the weighted ones) is expensive and happens in
+every worker process. This module compiles each data set once into a binary file that can be memory-mapped:
+
+* Numeric columns are stored as fixed-width arrays (``q`` for integers, ``d`` for floats).
+* String columns are stored as ``I`` indices into a deduplicated string table.
+* Weighted data sets additionally store their alias table (see ``WeightedArray``).
+
+Cache files are mapped read-only so their pages are shared between all worker processes on a load driver. The first
+process that finds a data set missing compiles it while holding a lock, all other processes wait and then attach to the
+result.
+
+Cache files are keyed by the SHA-256 hash of their source file and contain a format version, so a changed data set
+or an incompatible format results in a cache miss and the cache file is rebuilt transparently.
+
+The cache can be populated upfront with ``python3 -m eventdata.parameter_sources.datacache``.
+"""
+
+import array
+import collections.abc
+import contextlib
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("track.eventdata")
+
+MAGIC = b"EDLC"
+FORMAT_VERSION = 2
+# magic, format version, length of the JSON header
+PREAMBLE = struct.Struct("<4sII")
+ALIGNMENT = 8
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+DEFAULT_CACHE_DIR = os.path.join(DATA_DIR, "cache")
+
+_shared_strings = False
+
+
+def use_shared_strings(enabled):
+    """
+    Determines how string tables are loaded from the cache for all subsequently loaded data sets in this process.
+
+    :param enabled: If ``True``, strings are decoded from the shared memory-mapped cache file on every access. This
+                    keeps the resident memory of a load driver flat regardless of the number of worker processes at the
+                    expense of generator throughput. If ``False`` (default), strings are decoded once into the private
+                    memory of each process whereas all numeric columns are still shared.
+    """
+    global _shared_strings
+    _shared_strings = enabled
+
+
+class StringTable:
+    """
+    A read-only sequence of strings backed by a memory-mapped string table.
+
+    Strings are decoded on access. The underlying pages are shared between all processes that map the same cache file
+    so the memory usage of a load driver does not grow with the number of worker processes.
+    """
+    def __init__(self, mm, base, offsets):
+        self._mm = mm
+        self._base = base
+        self._offsets = offsets
+        self._len = len(offsets) - 1
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, idx):
+        base = self._base
+        offsets = self._offsets
+        # slicing the mmap directly is considerably faster than slicing a memoryview
+        return self._mm[base + offsets[idx]:base + offsets[idx + 1]].decode("utf-8")
+
+    def __iter__(self):
+        return (self[idx] for idx in range(self._len))
+
+
+class LookupTable(collections.abc.Mapping):
+    """
+    A read-only mapping from decimal string keys to strings backed by memory-mapped arrays.
+    """
+    def __init__(self, slots, strings):
+        self._slots = slots
+        self._strings = strings
+
+    def __getitem__(self, key):
+        try:
+            idx = int(key)
+            slot = self._slots[idx] if idx >= 0 else -1
+        except (ValueError, IndexError):
+            raise KeyError(key)
+        if slot < 0:
+            raise KeyError(key)
+        return self._strings[slot]
+
+    def __iter__(self):
+        return (str(idx) for idx, slot in enumerate(self._slots) if slot >= 0)
+
+    def __len__(self):
+        return len(self._strings)
+
+
+class ColumnarRows:
+    """
+    A read-only sequence of rows that are backed by (memory-mapped) columns.
+
+    Rows are returned as tuples with the same structure as in the JSON source, i.e. nested lists in the source
+    (like ``[lat, lon]``) are returned as nested tuples.
+    """
+    def __init__(self, columns, shape, strings):
+        self._columns = columns
+        self._strings = strings
+        self._len = len(columns[0]) if columns else 0
+        self._getter = self.__compile(shape)
+
+    def column(self, idx):
+        """
+        :param idx: Index of a (flattened) column.
+        :return: The raw column. String columns contain indices into ``strings``.
+        """
+        return self._columns[idx]
+
+    @property
+    def strings(self):
+        return self._strings
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, idx):
+        return self._getter(idx)
+
+    def __compile(self, shape):
+        # Generate a single function that assembles a row, e.g. ``lambda idx: (s[c0[idx]], (c1[idx], c2[idx]))``. This
+        # is on the hot code path and avoids one function call per column.
+        namespace = {"s": self._strings}
+
+        def expr(spec):
+            if _is_leaf(spec):
+                col, kind = spec
+                namespace["c%d" % col] = self._columns[col]
+                return "s[c%d[idx]]" % col if kind == "s" else "c%d[idx]" % col
+            return "(%s,)" % ", ".join(expr(s) for s in spec)
+
+        return eval("lambda idx: %s" % expr(shape), namespace)
+
+
+def _is_leaf(spec):
+    return len(spec) == 2 and isinstance(spec[0], int) and isinstance(spec[1], str)
+
+
+def source_hash(json_file):
+    h = hashlib.sha256()
+    with open(json_file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_file_name(json_file, cache_dir=None, digest=None):
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    digest = digest or source_hash(json_file)
+    name = os.path.basename(json_file)
+    if name.endswith(".json.gz"):
+        name = name[:-len(".json.gz")]
+    return os.path.join(cache_dir, "{}-{}.v{}.bin".format(name, digest[:16], FORMAT_VERSION))
+
+
+def load_lookup(json_file, cache_dir=None):
+    """
+    Loads a lookup table (a JSON object mapping string keys to string values).
+
+    :param json_file: Path to the gzipped JSON source file.
+    :param cache_dir: Directory for cache files. Defaults to ``DEFAULT_CACHE_DIR``.
+    :return: A mapping with the contents of the lookup table.
+    """
+    def compile_lookup():
+        with gzip.open(json_file, "rt") as data_file:
+            lookup = json.load(data_file)
+        if all(k.isdigit() and str(int(k)) == k for k in lookup.keys()):
+            # keys are (almost) dense integers in practice so we can resolve them with an array
+            slots = array.array("q", [-1] * (max((int(k) for k in lookup.keys()), default=-1) + 1))
+            for value_id, k in enumerate(lookup.keys()):
+                slots[int(k)] = value_id
+            return lookup, ({"dense": True}, list(lookup.values()), [slots])
+        else:
+            return lookup, ({"dense": False}, list(lookup.keys()) + list(lookup.values()), [])
+
+    def from_cache(header, strings, arrays):
+        if header["dense"] and _shared_strings:
+            return LookupTable(arrays[0], strings)
+        elif header["dense"]:
+            slots = arrays[0]
+            return {str(idx): strings[slot] for idx, slot in enumerate(slots) if slot >= 0}
+        else:
+            half = len(strings) // 2
+            return {strings[i]: strings[half + i] for i in range(half)}
+
+    return _load_or_compile(json_file, cache_dir, "lookup", compile_lookup, from_cache)
+
+
+def load_weighted(json_file, build_alias_table, cache_dir=None):
+    """
+    Loads a weighted data set (a JSON list of ``[weight, row]`` pairs).
+
+    :param json_file: Path to the gzipped JSON source file.
+    :param build_alias_table: A function that takes a list of weights and returns a tuple of arrays
+                              ``(probabilities, aliases)``. It is only called on a cache miss.
+    :param cache_dir: Directory for cache files. Defaults to ``DEFAULT_CACHE_DIR``.
+    :return: A tuple ``(rows, probabilities, aliases)``.
+    """
+    def compile_weighted():
+        with gzip.open(json_file, "rt") as data_file:
+            item_list = json.load(data_file)
+        rows = [c for _, c in item_list]
+        probabilities, aliases = build_alias_table([w for w, _ in item_list])
+
+        shape, columns, strings = _to_columns(rows)
+        if shape is None:
+            logger.warning("Data set [%s] has an irregular structure and will not be cached.", json_file)
+            return (rows, probabilities, aliases), None
+        return (rows, probabilities, aliases), ({"shape": shape}, strings, [probabilities, aliases] + columns)
+
+    def from_cache(header, strings, arrays):
+        return ColumnarRows(arrays[2:], header["shape"], strings), arrays[0], arrays[1]
+
+    return _load_or_compile(json_file, cache_dir, "weighted", compile_weighted, from_cache)
+
+
+def _load_or_compile(json_file, cache_dir, kind, compile_fn, from_cache):
+    cached = _load(json_file, cache_dir, kind)
+    if cached is None:
+        # The first process compiles the data set, all others wait and attach to the result afterwards.
+        with _compile_lock(cache_dir):
+            cached = _load(json_file, cache_dir, kind)
+            if cached is None:
+                value, cacheable = compile_fn()
+                if cacheable:
+                    header, strings, arrays = cacheable
+                    _store(json_file, cache_dir, kind, header, strings, arrays)
+                return value
+    return from_cache(*cached)
+
+
+@contextlib.contextmanager
+def _compile_lock(cache_dir):
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        lock_file = open(os.path.join(cache_dir, ".lock"), "a")
+    except OSError:
+        # we cannot write to the cache anyway
+        yield
+        return
+    with lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # the lock is released when the file is closed
+        yield
+
+
+def _to_columns(rows):
+    """
+    Converts rows to columns. Returns ``(None, None, None)`` if the rows do not share a common structure.
+    """
+    if not rows:
+        return None, None, None
+
+    def spec_of(value, next_col):
+        if isinstance(value, list):
+            specs = []
+            for v in value:
+                s, next_col = spec_of(v, next_col)
+                specs.append(s)
+            return specs, next_col
+        elif isinstance(value, str):
+            return [next_col, "s"], next_col + 1
+        elif isinstance(value, float):
+            return [next_col, "d"], next_col + 1
+        elif isinstance(value, int) and not isinstance(value, bool):
+            return [next_col, "q"], next_col + 1
+        else:
+            raise TypeError(value)
+
+    def flatten(value, out):
+        if isinstance(value, list):
+            for v in value:
+                flatten(v, out)
+        else:
+            out.append(value)
+
+    try:
+        shape, col_count = spec_of(rows[0], 0)
+    except TypeError:
+        return None, None, None
+
+    kinds = [None] * col_count
+
+    def collect_kinds(spec):
+        if _is_leaf(spec):
+            kinds[spec[0]] = spec[1]
+        else:
+            for s in spec:
+                collect_kinds(s)
+
+    collect_kinds(shape)
+
+    string_ids = {}
+    strings = []
+    columns = [array.array("I" if k == "s" else k) for k in kinds]
+    for row in rows:
+        values = []
+        flatten(row, values)
+        if len(values) != col_count:
+            return None, None, None
+        for col, kind, value in zip(columns, kinds, values):
+            if kind == "s":
+                if not isinstance(value, str):
+                    return None, None, None
+                sid = string_ids.get(value)
+                if sid is None:
+                    sid = len(strings)
+                    string_ids[value] = sid
+                    strings.append(value)
+                col.append(sid)
+            elif kind == "d":
+                if not isinstance(value, (int, float)):
+                    return None, None, None
+                col.append(float(value))
+            else:
+                if not isinstance(value, int) or isinstance(value, bool):
+                    return None, None, None
+                col.append(value)
+    return shape, columns, strings
+
+
+def _store(json_file, cache_dir, kind, header, strings, arrays):
+    try:
+        digest = source_hash(json_file)
+        file_name = cache_file_name(json_file, cache_dir, digest)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = array.array("Q", [0])
+        for e in encoded:
+            offsets.append(offsets[-1] + len(e))
+        sections = [offsets] + list(arrays)
+
+        header = dict(header)
+        header["kind"] = kind
+        header["source_hash"] = digest
+        header["string_count"] = len(strings)
+        header["arrays"] = [{"typecode": a.typecode, "length": len(a)} for a in sections]
+        raw_header = json.dumps(header).encode("utf-8")
+
+        # write to a temporary file and move it into place atomically as several processes may attempt this concurrently
+        fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(file_name), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(raw_header)))
+                f.write(raw_header)
+                for a in sections:
+                    _pad(f)
+                    a.tofile(f)
+                _pad(f)
+                f.write(b"".join(encoded))
+            os.replace(tmp_name, file_name)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+    except OSError as e:
+        logger.warning("Could not write data cache for [%s]: %s", json_file, e)
+
+
+def _pad(f):
+    remainder = f.tell() % ALIGNMENT
+    if remainder:
+        f.write(b"\0" * (ALIGNMENT - remainder))
+
+
+def _load(json_file, cache_dir, kind):
+    try:
+        file_name = cache_file_name(json_file, cache_dir)
+        if not os.path.isfile(file_name):
+            return None
+        with open(file_name, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return _parse(mm, kind)
+    except OSError as e:
+        logger.warning("Could not read data cache for [%s]: %s", json_file, e)
+        return None
+    except (struct.error, ValueError, LookupError, TypeError) as e:
+        # e.g. an empty or truncated file; treat it as a cache miss so it gets rebuilt
+        logger.warning("Discarding corrupt data cache [%s] for [%s]: %s", file_name, json_file, e)
+        try:
+            os.unlink(file_name)
+        except OSError:
+            pass
+        return None
+
+
+def _parse(mm, kind):
+    magic, version, header_len = PREAMBLE.unpack_from(mm, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+    pos = PREAMBLE.size
+    header = json.loads(mm[pos:pos + header_len].decode("utf-8"))
+    if header["kind"] != kind:
+        return None
+    pos += header_len
+
+    buf = memoryview(mm)
+    arrays = []
+    for spec in header["arrays"]:
+        pos = _align(pos)
+        nbytes = spec["length"] * array.array(spec["typecode"]).itemsize
+        if pos + nbytes > len(mm):
+            raise ValueError("file is truncated")
+        arrays.append(buf[pos:pos + nbytes].cast(spec["typecode"]))
+        pos += nbytes
+    pos = _align(pos)
+
+    offsets = arrays[0]
+    if pos + offsets[-1] > len(mm):
+        raise ValueError("file is truncated")
+    strings = StringTable(mm, pos, offsets)
+    if not _shared_strings:
+        strings = list(strings)
+    return header, strings, arrays[1:]
+
+
+def _align(pos):
+    return (pos + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def compile_all(cache_dir=None):
+    """
+    Compiles all data sets in ``DATA_DIR`` into the cache.
+    """
+    from eventdata.parameter_sources.weightedarray import WeightedArray
+
+    for json_file in sorted(glob.glob(os.path.join(DATA_DIR, "*.json.gz"))):
+        with gzip.open(json_file, "rt") as data_file:
+            is_weighted = isinstance(json.load(data_file), list)
+        if is_weighted:
+            WeightedArray(json_file, cache_dir=cache_dir)
+        else:
+            load_lookup(json_file, cache_dir=cache_dir)
+        print("Compiled [{}] to [{}]".format(json_file, cache_file_name(json_file, cache_dir)))
+
+
+if __name__ == "__main__":
+    compile_all()
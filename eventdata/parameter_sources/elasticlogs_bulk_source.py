@@ -17,12 +17,44 @@
 
 
 import copy
+import functools
+import itertools
 import logging
-import random
-from eventdata.parameter_sources.randomevent import RandomEvent
+from eventdata.parameter_sources import datacache, iddistributions, producer, randomstream
+from eventdata.parameter_sources.randomevent import RandomEvent, convert_to_bytes
+from eventdata.utils import globals as gs
 
 logger = logging.getLogger("track.eventdata")
 
+OP_TYPE_INDEX = "index"
+# data streams only accept `create` operations
+OP_TYPE_CREATE = "create"
+# operations that can be mixed with `op_type_weights` and the operation type of their action-and-metadata line
+OP_TYPES = {
+    "index": "index",
+    "create": "create",
+    "update": "update",
+    "upsert": "update",
+    "delete": "delete"
+}
+# operations that target an existing document
+TARGETED_OP_TYPES = ["update", "upsert", "delete"]
+# partial document of an `update` operation; it refreshes the timestamp of the document
+UPDATE_DOC_TEMPLATE = '{"doc": {"@timestamp": "%s"}}'
+# source of a scripted upsert; the event is inserted if the document does not exist
+SCRIPTED_UPSERT_TEMPLATE = '{"scripted_upsert": true, "script": {"source": "ctx._source.update_count = ' \
+                           '(ctx._source.update_count == null ? 0 : ctx._source.update_count) + 1", "lang": "painless"}, ' \
+                           '"upsert": %s}'
+# number of attempts to draw an existing document for targeted operations before falling back to `index`
+MAX_TARGET_ATTEMPTS = 10
+# action-and-metadata lines start with this prefix (followed by the index name), formatted with the operation type
+ACTION_LINE_PREFIX = '{"%s": {"_index": "'
+# a conservative guess of the size of an event (including its action-and-metadata line) for `bulk-size-bytes`
+INITIAL_AVERAGE_EVENT_SIZE = 500
+EVENT_PREFIX = '{"@timestamp": "'
+# length of an ISO 8601 timestamp with milliseconds as generated by `TimestampStructGenerator`
+TIMESTAMP_LENGTH = len("2017-01-01T00:00:00.000Z")
+
 
 class ElasticlogsBulkSource:
     """
@@ -50,6 +82,9 @@ class ElasticlogsBulkSource:
                                     point of '2016-12-20 20:12:32' and an acceleration factor of 2.0, events will be
                                     generated in timestamp sequence covering a 2-hour window, '2017-02-20 20:12:32'
                                     to '2017-02-20 22:12:32' (approximately).
+        "data_stream"              -    If set, `index` is the name of a data stream and documents are added with `create`
+                                        operations which data streams require. It cannot be combined with updates
+                                        (`id_seq_probability` or `op_type_weights`). Must be True/False. Default is False.
         "id_type"                  -    Type of document id to use for generated documents. Defaults to `auto`.
                                             auto         - Do not explicitly set id and let Elasticsearch assign automatically.
                                             seq          - Assign sequentialy incrementing integer ids to each document.
@@ -57,6 +92,75 @@ class ElasticlogsBulkSource:
                                             Applied only when `id_type` is seq.
                                             Defaults to 0.0 which brings no updates. Must be in range [0.0, 1.0].
         "id_seq_low_id_bias"       -    If set, favor low ids with a very high bias. Must be True/False. Default is False.
+        "id_seq_distribution"      -    The distribution of the ids that are targeted by updates. Applied only when `id_type` is seq.
+                                            uniform      - All documents are updated with the same probability.
+                                            low_id_bias  - Favor low ids with a very high bias (same as `id_seq_low_id_bias`).
+                                            zipf         - Favor recent documents with a Zipf distribution over recency. The
+                                                           exponent is set with `id_seq_zipf_exponent` (default 1.0).
+                                            window       - Update the most recent `id_seq_window_size` documents uniformly
+                                                           (default 10000).
+                                            hot_set      - Send the share `id_seq_hot_set_probability` (default 0.9) of
+                                                           updates to the `id_seq_hot_set_size` oldest documents (default
+                                                           1000) and the rest uniformly to all documents.
+                                        Defaults to `uniform` unless `id_seq_low_id_bias` is set.
+        "raw_message"              -    If set, events only contain the raw nginx access log line as `message` instead of fields
+                                        that Filebeat has parsed already. This is intended to be combined with an ingest pipeline
+                                        (see `pipeline`) that parses the event. Must be True/False. Default is False.
+        "pipeline"                 -    Optional name of the ingest pipeline that processes the documents of each bulk request.
+        "fragment_cache_size"      -    Number of pre-rendered JSON fragments that are cached per data set and process. Hit rates are
+                                        logged regularly. Defaults to 50000. A value of 0 disables caching.
+        "seed"                     -    Optional seed. Each client derives its own independent random streams from the seed and its
+                                        client id which makes generated data reproducible for a given number of clients.
+        "shared_lookups"           -    If set, strings of the generator data sets are decoded on each access from the memory-mapped
+                                        data cache that is shared by all processes instead of a private copy per process. This
+                                        trades generator throughput for lower memory usage. Must be True/False. Default is False.
+        "shared_daily_volume"      -    If set, all clients share one budget for `daily_logging_volume` and move to the next day
+                                        together instead of each client moving on when it has generated its share. All clients
+                                        must run on the same load driver. Must be True/False. Default is False.
+        "bulk-size-bytes"          -    If set, bulk requests are filled with events until their size reaches this target instead of
+                                        using a fixed number of events. Supports the units kB, MB and GB (e.g. '5MB'). If
+                                        `bulk-size` is also set, it limits the number of events per bulk request. Sizes are
+                                        determined from the lengths of the generated lines, so non-ASCII characters count once.
+                                        The actual size is reported as `bulk-size-bytes` in the parameters of each bulk request.
+        "bulk-size-target-millis"  -    If set, the number of events per bulk request is adapted between `min-bulk-size` and
+                                        `max-bulk-size` so that Elasticsearch takes this many milliseconds to process a bulk
+                                        request. Starting with `bulk-size`, it is increased by `bulk-size-increment` after
+                                        each bulk request that was faster than the target and multiplied with
+                                        `bulk-size-decrease-factor` after each bulk request that was slower (AIMD). Requires
+                                        the operation type `adaptive_bulk` which reports the service time back.
+        "min-bulk-size"            -    Lower bound for adaptive bulk sizing. Defaults to 100.
+        "max-bulk-size"            -    Upper bound for adaptive bulk sizing. Defaults to 10000.
+        "bulk-size-increment"      -    Additive increase for adaptive bulk sizing. Defaults to 100.
+        "bulk-size-decrease-factor"-    Multiplicative decrease for adaptive bulk sizing. Defaults to 0.5.
+        "op_type_weights"          -    Optional dict of weights for the operations in a bulk request. Supported operations are
+                                        `index` and `create` (which add a new document), `update` (a partial update of the
+                                        timestamp), `upsert` (a scripted upsert that counts updates) and `delete`. Except for
+                                        `index` and `create`, operations require `id_type` seq and target a document of this
+                                        client (drawn like updates via `id_seq_distribution`). Updates and deletes only target
+                                        existing documents whereas upserts may also insert documents that do not exist (any
+                                        more). Defaults to `index` only.
+        "timestamp_spread_millis"  -    Number of milliseconds across which the timestamps of the events in a bulk request are
+                                        spread evenly. Must be in range [0, 1000]. Defaults to 0 which assigns (almost) the
+                                        same timestamp to all events in a bulk request.
+        "bulk_body_format"         -    Type of the generated bulk request body. Defaults to `string`.
+                                            string       - The body is a `str` that is encoded by the client before sending.
+                                            bytes        - The body is assembled from pre-encoded lines into a reused buffer
+                                                           and returned as UTF-8 encoded `bytes`.
+        "replay_ring_size"         -    If set to a positive number, each client generates this number of distinct bulk requests
+                                        when it is created and then sends them round-robin. Before each request, only the
+                                        timestamp (up to seconds) and the index name are overwritten in place. This mode trades
+                                        data variety for generator throughput and always produces `bytes` bodies. It cannot be
+                                        combined with `id_type` seq or `daily_logging_volume`. Defaults to 0 (disabled).
+        "producer"                 -    Where bulk requests are generated. Defaults to `none`.
+                                            none         - Synchronously when the bulk request is requested.
+                                            thread       - Ahead of demand in a background thread per client.
+                                            process      - Ahead of demand in a background process per client.
+                                        Timestamps are determined when a bulk request is generated, not when it is sent.
+                                        Queue depth and stalls are logged regularly (see `BulkProducer`).
+        "producer_queue_size"      -    Maximum number of bulk requests a producer generates ahead of demand. Defaults to 10.
+        "producer_timeout"         -    Maximum time in seconds to wait for the producer when no bulk request is ready. Waiting
+                                        blocks the event loop of the Rally worker, i.e. also other clients in the same
+                                        process. Defaults to 60.
     """
     def __init__(self, track, params, **kwargs):
         self.infinite = False
@@ -68,22 +172,101 @@ class ElasticlogsBulkSource:
         if "random_event" in kwargs:
             self._randomevent = kwargs["random_event"]
         else:
+            # data sets are loaded once per process (see `ebs.global_lookups`) so this needs to be set before the first
+            # RandomEvent is created.
+            datacache.use_shared_strings(str(params.get("shared_lookups", False)).lower() == "true")
             self._randomevent = RandomEvent(params)
 
-        self._bulk_size = params["bulk-size"]
+        if "bulk-size-bytes" in params:
+            self._bulk_size_bytes = convert_to_bytes(str(params["bulk-size-bytes"]))
+            # optional upper limit for the number of documents
+            self._bulk_size = params.get("bulk-size")
+        else:
+            if "bulk-size" not in params and "bulk-size-target-millis" in params:
+                raise AssertionError("The parameter [bulk-size-target-millis] requires [bulk-size] as the initial bulk size")
+            self._bulk_size_bytes = None
+            self._bulk_size = params["bulk-size"]
+        # running estimate of the average size of a document including its action-and-metadata line
+        self._average_event_size = INITIAL_AVERAGE_EVENT_SIZE
+
+        if "bulk-size-target-millis" in params:
+            if "bulk-size-bytes" in params:
+                raise AssertionError("The parameters [bulk-size-target-millis] and [bulk-size-bytes] are mutually exclusive")
+            self._target_took = float(params["bulk-size-target-millis"])
+            self._min_bulk_size = int(params.get("min-bulk-size", 100))
+            self._max_bulk_size = int(params.get("max-bulk-size", 10000))
+            self._bulk_size_increment = int(params.get("bulk-size-increment", 100))
+            self._bulk_size_decrease_factor = float(params.get("bulk-size-decrease-factor", 0.5))
+            if not 0 < self._min_bulk_size <= self._max_bulk_size:
+                raise AssertionError("[min-bulk-size] must be positive and must not exceed [max-bulk-size]")
+            if not 0.0 < self._bulk_size_decrease_factor < 1.0:
+                raise AssertionError("[bulk-size-decrease-factor] must be in range (0.0, 1.0)")
+            self._bulk_size = min(max(int(self._bulk_size), self._min_bulk_size), self._max_bulk_size)
+            self._feedback_key = "elasticlogs_bulk-{}-{}".format(params.get("client_id"), id(self))
+        else:
+            self._target_took = None
         self.seq_id = 0
+        self._random = randomstream.partition_random(params.get("seed"), params.get("client_id"), "id")
 
         self._id_type = params.get("id_type", "auto")
         if self._id_type not in ["auto", "seq"]:
             raise AssertionError("The value [{}] is invalid for the parameter [id_type]".format(self._id_type))
+        self._data_stream = str(params.get("data_stream", False)).lower() == "true"
+        self._op_type = OP_TYPE_CREATE if self._data_stream else OP_TYPE_INDEX
+
+        self._body_format = params.get("bulk_body_format", "string")
+        if self._body_format not in ["string", "bytes"]:
+            raise AssertionError("The value [{}] is invalid for the parameter [bulk_body_format]".format(self._body_format))
+        # reused across bulk requests to avoid growing a new buffer for each of them
+        self._body_buffer = bytearray()
+        # action-and-metadata lines per operation type and index (see `#__action_line_parts()`)
+        self._action_lines = {}
+        self._encoded_action_lines = {}
+
+        if "op_type_weights" in params:
+            if self._data_stream:
+                raise AssertionError("The parameter [op_type_weights] cannot be combined with [data_stream]")
+            op_type_weights = params["op_type_weights"]
+            unknown = set(op_type_weights.keys()) - set(OP_TYPES.keys())
+            if unknown:
+                raise AssertionError("Unknown operations {} in [op_type_weights]. Supported operations are {}".format(
+                    sorted(unknown), list(OP_TYPES.keys())))
+            if self._id_type != "seq" and any(op_type_weights.get(op_type, 0) > 0 for op_type in TARGETED_OP_TYPES):
+                raise AssertionError("The operations {} in [op_type_weights] require [id_type] seq".format(
+                    TARGETED_OP_TYPES))
+            self._op_types = list(op_type_weights.keys())
+            self._op_type_cum_weights = list(itertools.accumulate(float(w) for w in op_type_weights.values()))
+            # documents of this client that currently exist
+            self._live_ids = LiveIds()
+        else:
+            self._op_types = None
+
+        self._replay_ring_size = int(params.get("replay_ring_size", 0))
+        if self._op_types and self._replay_ring_size > 0:
+            raise AssertionError("The parameter [replay_ring_size] cannot be combined with [op_type_weights]")
+        if self._target_took is not None and (self._replay_ring_size > 0 or params.get("producer", "none") != "none"):
+            raise AssertionError("The parameter [bulk-size-target-millis] cannot be combined with [replay_ring_size] or "
+                                 "[producer]")
+        if self._replay_ring_size > 0 and (self._id_type != "auto" or "daily_logging_volume" in params):
+            raise AssertionError("The parameter [replay_ring_size] requires [id_type] auto and no [daily_logging_volume]")
+        if self._replay_ring_size > 0 and str(params.get("raw_message", False)).lower() == "true":
+            # the timestamp within the raw event would not be updated on replay
+            raise AssertionError("The parameter [replay_ring_size] cannot be combined with [raw_message]")
+        self._replay_ring = []
+        self._replay_ring_position = 0
+
+        self._producer_mode = params.get("producer", "none")
+        if self._producer_mode not in producer.PRODUCER_MODES:
+            raise AssertionError("The value [{}] is invalid for the parameter [producer]".format(self._producer_mode))
+        self._producer = None
 
         if self._id_type == "seq":
             self._id_seq_probability = float(params.get("id_seq_probability", 0.0))
-            self._low_id_bias = str(params.get('id_seq_low_id_bias', False)).lower() == "true"
-            if self._low_id_bias:
-                logger.info("Will use low id bias for updates")
-            else:
-                logger.info("Will use uniform distribution for updates")
+            if self._data_stream and self._id_seq_probability > 0.0:
+                # `create` operations for existing ids are rejected by Elasticsearch with a version conflict
+                raise AssertionError("The parameter [id_seq_probability] cannot be combined with [data_stream]")
+            self._id_distribution = iddistributions.create(params)
+            logger.info("Will use [%s] distribution for updates", type(self._id_distribution).__name__)
 
         self._default_index = False
         if "index" not in params.keys():
@@ -99,13 +282,28 @@ class ElasticlogsBulkSource:
             logger.debug("[bulk] Index pattern specified in parameters ({}) will be used".format(params["index"]))
 
     def partition(self, partition_index, total_partitions):
-        if self._params.get("id_type") != "seq":
-            seed = partition_index * self._params["seed"] if "seed" in self._params else None
-            random.seed(seed)
+        # each partition derives its own random streams from `seed` and `client_id`
         new_params = copy.deepcopy(self.orig_args[1])
         new_params["client_id"] = partition_index
         new_params["client_count"] = total_partitions
-        return ElasticlogsBulkSource(self.orig_args[0], new_params, **self.orig_args[2])
+        if self._producer_mode != "none":
+            # the consumer only hands out what the producer generates so it does not need its own RandomEvent
+            partition = ElasticlogsBulkSource(self.orig_args[0], new_params, **dict(self.orig_args[2], random_event=None))
+            # the actual work is done by a partition of the same parameter source in the background. The factory must
+            # be picklable to start a producer process with the spawn or forkserver start method.
+            producer_params = copy.deepcopy(self.orig_args[1])
+            producer_params["producer"] = "none"
+            partition._producer = producer.BulkProducer(
+                functools.partial(create_partition, self.orig_args[0], producer_params, self.orig_args[2],
+                                  partition_index, total_partitions),
+                self._producer_mode,
+                int(new_params.get("producer_queue_size", producer.DEFAULT_QUEUE_SIZE)),
+                float(new_params.get("producer_timeout", producer.DEFAULT_TIMEOUT)))
+            return partition
+        partition = ElasticlogsBulkSource(self.orig_args[0], new_params, **self.orig_args[2])
+        if partition._replay_ring_size > 0:
+            partition.__build_replay_ring()
+        return partition
 
     @property
     def percent_completed(self):
@@ -113,36 +311,264 @@ class ElasticlogsBulkSource:
         #
         # * the `time-period` or `iteration` property specified on the corresponding task
         # * `#params()` raising `StopIteration` when `RandomEvent` is exhausted
+        if self._producer:
+            return self._producer.percent_completed
         return self._randomevent.percent_completed
 
+    @property
+    def producer_stats(self):
+        """
+        :return: The statistics of the background producer (see `BulkProducer#stats`) or None if there is none.
+        """
+        return self._producer.stats if self._producer else None
+
     def params(self):
+        if self._producer:
+            response = self._producer.get()
+            if self._producer.bulks % 1000 == 0:
+                logger.info("Bulk producer statistics for client [%s]: %s", self._params["client_id"], self.producer_stats)
+            return response
+        if self._replay_ring:
+            return self.__replay_params()
+        if self._target_took is not None:
+            self.__adapt_bulk_size()
+        # raises StopIteration if the generator is exhausted. Otherwise we get at least one event which we need to return
+        # (otherwise we'd lose the last bulk request).
+        events = self.__generate_events()
+        if self._op_types:
+            lines = self.__mixed_lines(events)
+            if self._body_format == "bytes":
+                body = self.__bytes_body(events, lines)
+            else:
+                body = "\n".join(lines)
+        elif self._body_format == "bytes":
+            body = self.__bytes_body(events)
+        else:
+            body = self.__string_body(events)
+
+        response = {
+            "body": body,
+            "action-metadata-present": True,
+            # the bulk body contains the action-and-metadata line and the actual document for each event
+            "bulk-size": len(events),
+            "bulk-size-bytes": len(body) if isinstance(body, bytes) else len(body.encode("utf-8")),
+            "unit": "docs"
+        }
+
+        if self._target_took is not None:
+            response["feedback-key"] = self._feedback_key
+
+        if "pipeline" in self._params.keys():
+            response["pipeline"] = self._params["pipeline"]
+
+        return response
+
+    def __adapt_bulk_size(self):
+        took = gs.global_bulk_took.pop(self._feedback_key, None)
+        if took is None:
+            # no response yet
+            return
+        if took > self._target_took:
+            self._bulk_size = max(int(self._bulk_size * self._bulk_size_decrease_factor), self._min_bulk_size)
+        else:
+            self._bulk_size = min(self._bulk_size + self._bulk_size_increment, self._max_bulk_size)
+
+    def __generate_events(self):
+        if self._bulk_size_bytes is None:
+            return self._randomevent.generate_bulk(self._bulk_size)
+        # leave enough headroom so we usually stop at the byte target rather than at the document limit
+        max_events = int(2 * self._bulk_size_bytes / self._average_event_size) + 1
+        if self._bulk_size is not None:
+            max_events = min(max_events, self._bulk_size)
+        line_overhead = self.__action_line_overhead()
+        events = self._randomevent.generate_bulk(max_events, max_bytes=self._bulk_size_bytes,
+                                                 line_overhead=line_overhead)
+        # the bulk request can end before the byte target (document limit or exhausted generator) so we need to base
+        # the estimate on the size that has actually been generated (the same measure as in `generate_bulk()`)
+        generated_bytes = sum(len(evt) + len(idx) for evt, idx, _ in events) + len(events) * line_overhead
+        self._average_event_size = max(generated_bytes // len(events), 1)
+        return events
+
+    def __action_line_overhead(self):
+        # the size of an action-and-metadata line without the index name plus two line breaks
+        if self._id_type == "auto":
+            return len('{"%s": {"_index": ""}}' % self._op_type) + 2
+        else:
+            return len('{"%s": {"_index": "", "_id": "%012d-%d"}}' % (self._op_type, self.seq_id, self._params["client_id"])) + 2
+
+    def __string_body(self, events):
         # Build bulk array
         bulk_array = []
-        self._randomevent.start_bulk(self._bulk_size)
-        for x in range(0, self._bulk_size):
-            try:
-                evt, idx, typ = self._randomevent.generate_event()
-            except StopIteration:
-                if len(bulk_array) > 0:
-                    # return any remaining items if there are any (otherwise we'd lose the last bulk request)
-                    break
+        append = bulk_array.append
+        last_idx = None
+        if self._id_type == "seq":
+            for (evt, idx, typ), doc_id in zip(events, self.__seq_ids(len(events))):
+                # consecutive events usually share their index so we only look up the action line for each group
+                if idx != last_idx:
+                    prefix, suffix = self.__action_line_parts(self._op_type, idx)
+                    last_idx = idx
+                append("%s%012d%s" % (prefix, doc_id, suffix))
+                append(evt)
+        else:
+            for evt, idx, typ in events:
+                if idx != last_idx:
+                    prefix, suffix = self.__action_line_parts(self._op_type, idx)
+                    last_idx = idx
+                append(prefix)
+                append(evt)
+        return "\n".join(bulk_array)
+
+    def __bytes_body(self, events, lines=None):
+        # Encoding each line separately is considerably faster than encoding the joined body: a single non-ASCII
+        # character widens the internal representation of the whole joined string and defeats the ASCII fast path.
+        buffer = self._body_buffer
+        del buffer[:]
+        if lines is not None:
+            # the lines of mixed operations are rendered already (see `#__mixed_lines()`)
+            for line in lines:
+                buffer += line.encode("utf-8")
+                buffer += b"\n"
+            return bytes(buffer)
+        seq_ids = self.__seq_ids(len(events)) if self._id_type == "seq" else None
+        last_idx = None
+        for i, (evt, idx, typ) in enumerate(events):
+            if idx != last_idx:
+                prefix, suffix = self.__encoded_action_line_parts(self._op_type, idx)
+                last_idx = idx
+            buffer += prefix
+            if seq_ids:
+                # render the id directly into the buffer
+                buffer += b"%012d" % seq_ids[i]
+                buffer += suffix
+            buffer += evt.encode("utf-8")
+            buffer += b"\n"
+        # the Elasticsearch client only accepts `str` or `bytes` as bulk body. The body ends with a newline already so
+        # the client does not need to copy it once more to append one.
+        return bytes(buffer)
+
+    def __mixed_lines(self, events):
+        ops = self._random.choices(self._op_types, cum_weights=self._op_type_cum_weights, k=len(events))
+        seq_ids = self._id_type == "seq"
+        if seq_ids:
+            # new documents and updates of the `index` operations are drawn for the whole bulk request upfront
+            index_ids = iter(self.__seq_ids(ops.count("index")))
+        live_ids = self._live_ids
+        lines = []
+        append = lines.append
+        for (evt, idx, typ), op in zip(events, ops):
+            doc_id = None
+            if op == "upsert":
+                # upserts insert documents that do not exist (any more) so they may target any id of this client
+                doc_id = self.__any_seq_id()
+            elif op in TARGETED_OP_TYPES:
+                doc_id = self.__existing_seq_id()
+                if doc_id is None:
+                    # there is no document to target (yet)
+                    op = "index"
+            if op == "index" and seq_ids:
+                doc_id = next(index_ids, None)
+                if doc_id is None:
+                    # this operation replaces a targeted operation without a target
+                    doc_id = self.seq_id
+                    self.__incr_seq_id()
+            elif op == "create" and seq_ids:
+                doc_id = self.seq_id
+                self.__incr_seq_id()
+
+            prefix, suffix = self.__action_line_parts(OP_TYPES[op], idx)
+            append(prefix if doc_id is None else "%s%012d%s" % (prefix, doc_id, suffix))
+            if op == "index" or op == "create":
+                append(evt)
+            elif op == "update":
+                append(UPDATE_DOC_TEMPLATE % evt[len(EVENT_PREFIX):len(EVENT_PREFIX) + TIMESTAMP_LENGTH])
+            elif op == "upsert":
+                append(SCRIPTED_UPSERT_TEMPLATE % evt)
+
+            if doc_id is not None:
+                if op == "delete":
+                    live_ids.remove(doc_id)
                 else:
-                    # otherwise stop immediately
-                    raise
+                    live_ids.add(doc_id)
+        return lines
+
+    def __any_seq_id(self):
+        if self.seq_id == 0:
+            doc_id = self.seq_id
+            self.__incr_seq_id()
+            return doc_id
+        doc_id, = self._id_distribution.sample(self._random, self.seq_id, 1)
+        return doc_id
+
+    def __existing_seq_id(self):
+        for _ in range(MAX_TARGET_ATTEMPTS):
+            if self.seq_id == 0:
+                return None
+            doc_id, = self._id_distribution.sample(self._random, self.seq_id, 1)
+            if doc_id in self._live_ids:
+                return doc_id
+        return None
 
+    def __action_line_parts(self, op_type, idx):
+        """
+        :return: A tuple (prefix, suffix) of the action-and-metadata line for the given operation type and index. With
+                 sequential ids, the document id needs to be inserted in between. Otherwise, the prefix is the complete
+                 action-and-metadata line and the suffix is empty.
+        """
+        key = (op_type, idx)
+        parts = self._action_lines.get(key)
+        if parts is None:
             if self._id_type == "auto":
-                bulk_array.append('{"index": {"_index": "%s"}}' % idx)
+                parts = '{"%s": {"_index": "%s"}}' % (op_type, idx), ""
             else:
-                docid = "%s-%d" % (self.__get_seq_id(), self._params["client_id"])
-                bulk_array.append('{"index": {"_index": "%s", "_id": "%s"}}' % (idx, docid))
+                parts = '{"%s": {"_index": "%s", "_id": "' % (op_type, idx), '-%d"}}' % self._params["client_id"]
+            self._action_lines[key] = parts
+        return parts
 
-            bulk_array.append(evt)
+    def __encoded_action_line_parts(self, op_type, idx):
+        """
+        :return: The UTF-8 encoded variant of ``#__action_line_parts()`` including the line break at the end of the line.
+        """
+        key = (op_type, idx)
+        parts = self._encoded_action_lines.get(key)
+        if parts is None:
+            prefix, suffix = self.__action_line_parts(op_type, idx)
+            if self._id_type == "auto":
+                parts = (prefix + "\n").encode("utf-8"), b""
+            else:
+                parts = prefix.encode("utf-8"), (suffix + "\n").encode("utf-8")
+            self._encoded_action_lines[key] = parts
+        return parts
+
+    def __build_replay_ring(self):
+        for _ in range(self._replay_ring_size):
+            events = self.__generate_events()
+            body = bytearray(self.__bytes_body(events))
+            # remember where the timestamp of each event and the index name of each action line are in the body so we
+            # can overwrite them in place later. Action lines and timestamps are ASCII; only the remainder of an event
+            # may contain multi-byte characters which does not affect the positions below.
+            index_positions = []
+            timestamp_positions = []
+            position = 0
+            index_offset = len(ACTION_LINE_PREFIX % self._op_type)
+            for evt, idx, typ in events:
+                action_line, _ = self.__encoded_action_line_parts(self._op_type, idx)
+                index_positions.append(position + index_offset)
+                position += len(action_line)
+                timestamp_positions.append(position + len(EVENT_PREFIX))
+                position += len(evt.encode("utf-8")) + 1
+            self._replay_ring.append(ReplayBulk(body, len(events), events[0][1], index_positions, timestamp_positions))
+
+    def __replay_params(self):
+        replay_bulk = self._replay_ring[self._replay_ring_position]
+        self._replay_ring_position = (self._replay_ring_position + 1) % len(self._replay_ring)
+        timestamp_prefix, index = self._randomevent.next_bulk_timestamp()
+        replay_bulk.patch(timestamp_prefix.encode("ascii"), index)
 
         response = {
-            "body": "\n".join(bulk_array),
+            "body": bytes(replay_bulk.body),
             "action-metadata-present": True,
-            # the bulk array contains the action-and-metadata line and the actual document
-            "bulk-size": len(bulk_array) // 2,
+            "bulk-size": replay_bulk.bulk_size,
+            "bulk-size-bytes": len(replay_bulk.body),
             "unit": "docs"
         }
 
@@ -151,25 +577,95 @@ class ElasticlogsBulkSource:
 
         return response
 
-    def __get_seq_id(self):
-        _id = self.seq_id
-        if random.uniform(0, 1) < self._id_seq_probability:
-            # conflict
-            if self._low_id_bias:
-                # update; heavily bias towards older ids
-                _p = 10
-                _min = 0
-                _max = _id
-                # _p ~> 0: results closer to min, _p >> 0: results closer to max
-                _id = _min + (_max - _min) * pow(random.random(), _p)
+    def __seq_ids(self, count):
+        """
+        :return: The ids of the next ``count`` documents. Updates (conflicts) are drawn at once for all documents and
+                 target documents that have been created before.
+        """
+        first_id = self.seq_id
+        if self._id_seq_probability <= 0.0:
+            self.seq_id += count
+            return range(first_id, self.seq_id)
+        random = self._random.random
+        probability = self._id_seq_probability
+        conflicts = [random() < probability for _ in range(count)]
+        targets = iter(self._id_distribution.sample(self._random, first_id, sum(conflicts)))
+        ids = []
+        append = ids.append
+        seq_id = first_id
+        for conflict in conflicts:
+            if conflict:
+                append(next(targets))
             else:
-                # update; pick id from pure uniform distribution
-                _id = random.randint(0, _id-1 if _id > 0 else 0)
-        else:
-            # new document
-            self.__incr_seq_id()
-
-        return "%012d" % _id
+                # new document
+                append(seq_id)
+                seq_id += 1
+        self.seq_id = seq_id
+        return ids
 
     def __incr_seq_id(self):
         self.seq_id += 1
+
+
+def create_partition(track, params, kwargs, partition_index, total_partitions):
+    """
+    Creates the partition ``partition_index`` of ``ElasticlogsBulkSource``. Used as a picklable factory for
+    background producers.
+    """
+    return ElasticlogsBulkSource(track, params, **kwargs).partition(partition_index, total_partitions)
+
+
+class LiveIds:
+    """
+    The set of sequential ids of the documents that currently exist, stored as a bitmap with one bit per id.
+    """
+    def __init__(self):
+        self._bits = bytearray()
+
+    def add(self, doc_id):
+        byte = doc_id >> 3
+        if byte >= len(self._bits):
+            # grow in larger steps to avoid resizing for every new id
+            self._bits.extend(bytes(max(byte + 1 - len(self._bits), 4096)))
+        self._bits[byte] |= 1 << (doc_id & 7)
+
+    def remove(self, doc_id):
+        byte = doc_id >> 3
+        if byte < len(self._bits):
+            self._bits[byte] &= ~(1 << (doc_id & 7)) & 0xFF
+
+    def __contains__(self, doc_id):
+        byte = doc_id >> 3
+        return byte < len(self._bits) and self._bits[byte] & (1 << (doc_id & 7)) != 0
+
+
+class ReplayBulk:
+    """
+    A pre-generated bulk request body whose timestamps and index names are overwritten in place before it is replayed.
+    """
+    def __init__(self, body, bulk_size, index, index_positions, timestamp_positions):
+        self.body = body
+        self.bulk_size = bulk_size
+        self._index = index
+        self._index_positions = index_positions
+        self._timestamp_positions = timestamp_positions
+
+    def patch(self, timestamp_prefix, index):
+        """
+        :param timestamp_prefix: The ISO 8601 timestamp up to seconds (``yyyy-MM-ddTHH:mm:ss``) as ASCII ``bytes``.
+                                 Milliseconds are kept as generated.
+        :param index: The name of the index to write to.
+        """
+        body = self.body
+        width = len(timestamp_prefix)
+        for position in self._timestamp_positions:
+            body[position:position + width] = timestamp_prefix
+        if index != self._index:
+            encoded_index = index.encode("utf-8")
+            if len(encoded_index) != len(self._index.encode("utf-8")):
+                # date patterns in index names always have a fixed width
+                raise AssertionError("Cannot replace index name [{}] with [{}] of different length".format(self._index, index))
+            width = len(encoded_index)
+            for position in self._index_positions:
+                body[position:position + width] = encoded_index
+            self._index = index
@@ -0,0 +1,118 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import copy
+import logging
+import mmap
+import os
+import zlib
+
+from eventdata.parameter_sources import corpus
+
+logger = logging.getLogger("track.eventdata")
+
+
+class ElasticlogsCorpusSource:
+    """
+    Replays bulk indexing requests from a corpus that has been pre-generated with
+    ``python3 -m eventdata.parameter_sources.corpus``.
+
+    Part files are memory-mapped and bulk requests are handed out as byte ranges so there is no per-document work.
+    Bulk requests are distributed round-robin across clients. Each client raises ``StopIteration`` when it has sent
+    all of its bulk requests.
+
+    It expects the parameter hash to contain the following keys:
+        "corpus_dir"               -    Directory of the pre-generated corpus. (mandatory)
+        "index"                    -    Name of the index or alias that the corpus must have been generated for, i.e. its
+                                        ``--index``. The target index is part of the bulk requests so a corpus for
+                                        another index is rejected. If not set, the corpus is replayed as it is.
+        "looped"                   -    If set, clients start over from their first bulk request when they have sent all
+                                        of them instead of stopping. Must be True/False. Default is False.
+    """
+    def __init__(self, track, params, **kwargs):
+        self.infinite = False
+        self._params = params
+        self._corpus_dir = params["corpus_dir"]
+        self._looped = str(params.get("looped", False)).lower() == "true"
+        self._metadata = corpus.load_metadata(self._corpus_dir)
+        corpus_index = self._metadata["params"]["index"]
+        if "index" in params and params["index"] != corpus_index:
+            raise AssertionError("The corpus [{}] has been generated for the index [{}] but the operation targets [{}]."
+                                 .format(self._corpus_dir, corpus_index, params["index"]))
+        self._compressed = self._metadata["compressed"]
+        # all bulk requests of the corpus as (part index, bulk index within part)
+        self._bulks = []
+        self._offsets = []
+        self._documents = []
+        for part_index, part in enumerate(self._metadata["parts"]):
+            offsets, documents = corpus.load_offsets(self._corpus_dir, part)
+            self._offsets.append(offsets)
+            self._documents.append(documents)
+            self._bulks.extend((part_index, bulk_index) for bulk_index in range(part["bulks"]))
+        self._client_bulks = self._bulks
+        self._current = 0
+        # memory maps are created lazily as param sources are created in one process and used in another one
+        self._part_maps = None
+
+    def partition(self, partition_index, total_partitions):
+        partition = copy.copy(self)
+        partition._client_bulks = self._bulks[partition_index::total_partitions]
+        if not partition._client_bulks:
+            logger.warning("Corpus [%s] contains [%d] bulk requests which is not enough for client [%d].",
+                           self._corpus_dir, len(self._bulks), partition_index)
+        return partition
+
+    @property
+    def percent_completed(self):
+        if self._looped or not self._client_bulks:
+            return None
+        return self._current / len(self._client_bulks)
+
+    def params(self):
+        if self._current == len(self._client_bulks):
+            if not self._looped or not self._client_bulks:
+                raise StopIteration()
+            self._current = 0
+        part_index, bulk_index = self._client_bulks[self._current]
+        self._current += 1
+
+        if self._part_maps is None:
+            self._part_maps = [self.__map(part) for part in self._metadata["parts"]]
+        offsets = self._offsets[part_index]
+        body = self._part_maps[part_index][offsets[bulk_index]:offsets[bulk_index + 1]]
+        if self._compressed:
+            # each bulk request is a separate gzip member
+            body = zlib.decompress(body, wbits=16 + zlib.MAX_WBITS)
+
+        response = {
+            "body": body,
+            "action-metadata-present": True,
+            "bulk-size": self._documents[part_index][bulk_index],
+            "bulk-size-bytes": len(body),
+            "unit": "docs"
+        }
+
+        if "pipeline" in self._params.keys():
+            response["pipeline"] = self._params["pipeline"]
+
+        return response
+
+    def __map(self, part):
+        with open(os.path.join(self._corpus_dir, part["name"]), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
@@ -16,23 +16,48 @@
 # under the License.
 
 
+from eventdata.parameter_sources import randomstream
+from eventdata.schedulers import session_scheduler
 from eventdata.utils import globals as gs
+import collections
+import copy
+import heapq
+import itertools
 import math
 import re
 import json
 import logging
 import os
 import os.path
-import random
 import datetime
 import time
 
 logger = logging.getLogger("track.eventdata")
 
-available_dashboards = ["traffic", "content_issues", "discover"]
+dashboard_specs_dir = os.path.join(os.path.dirname(__file__), "..", "dashboard_specs")
+
+available_dashboards = sorted(os.path.splitext(f)[0] for f in os.listdir(dashboard_specs_dir) if f.endswith(".json"))
 
 epoch = datetime.datetime.utcfromtimestamp(0)
 
+# values that change between requests to a dashboard and how they are rendered into the compiled request body
+SLOT_ENCODERS = {
+    "index_pattern": lambda value: json.dumps(value, ensure_ascii=False).encode("utf-8"),
+    "query_string": lambda value: json.dumps(value, ensure_ascii=False).encode("utf-8"),
+    "interval": lambda value: json.dumps(value, ensure_ascii=False).encode("utf-8"),
+    "preference": lambda value: b"%d" % value,
+    "ts_min_ms": lambda value: b"%d" % value,
+    "ts_max_ms": lambda value: b"%d" % value,
+    "discover_size": lambda value: b"%d" % value
+}
+
+SLOT_PATTERN = re.compile(r'"@@(\w+)@@"')
+
+think_time_distributions = ["exponential", "uniform", "constant"]
+
+# compiled msearch bodies by dashboard spec file and whether throttled indices are ignored
+compiled_bodies = {}
+
 
 class Error(Exception):
     """Base class for exceptions in this module."""
@@ -50,12 +75,60 @@ class ConfigurationError(Error):
         self.message = message
 
 
+class CompiledMsearchBody:
+    """
+    An msearch request body that has been serialized to NDJSON once with placeholders for all values that change between
+    requests (see ``SLOT_ENCODERS``). Rendering only encodes these values and joins them with the pre-serialized parts.
+    """
+    def __init__(self, lines):
+        """
+        :param lines: The lines of the msearch request body. Each value that should be replaced later is given as a
+                      placeholder string ``@@name@@`` where ``name`` is a key in ``SLOT_ENCODERS``.
+        """
+        body = "".join(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n" for line in lines)
+        parts = SLOT_PATTERN.split(body)
+        # parts alternates between static parts and slot names
+        self._static_parts = [part.encode("utf-8") for part in parts[0::2]]
+        self._slots = parts[1::2]
+        unknown = set(self._slots) - set(SLOT_ENCODERS.keys())
+        if unknown:
+            raise ConfigurationError("Unknown slots {} in msearch body.".format(sorted(unknown)))
+        self.line_count = len(lines)
+
+    def render(self, values):
+        """
+        :param values: A dict with the value of each slot.
+        :return: The msearch request body as UTF-8 encoded ``bytes``.
+        """
+        encoded = {name: SLOT_ENCODERS[name](values[name]) for name in values}
+        static_parts = self._static_parts
+        chunks = [static_parts[0]]
+        for slot, static_part in zip(self._slots, static_parts[1:]):
+            chunks.append(encoded[slot])
+            chunks.append(static_part)
+        return b"".join(chunks)
+
+
+def slot(name):
+    """
+    :return: The placeholder for the slot ``name`` in the lines of a ``CompiledMsearchBody``.
+    """
+    return "@@{}@@".format(name)
+
+
 class ElasticlogsKibanaSource:
     """
     Simulates a set of sample Kibana dashboards for the elasticlogs data set.
 
     It expects the parameter hash to contain the following keys:
-        "dashboard"                     -   String indicating which dashboard to simulate. Options are 'traffic', 'content_issues' and 'discover'.
+        "dashboard"                     -   String indicating which dashboard to simulate. Either the name of a built-in dashboard ('traffic',
+                                            'content_issues' or 'discover') or the path to a dashboard spec file ending in `.json`. Relative
+                                            paths are resolved against the track directory.
+        "dashboard_mix"                 -   (Optional) List of dashboards to simulate instead of `dashboard`. Each entry is an object with the keys
+                                            `dashboard` (mandatory, same values as above), `weight` (defaults to 1) and optionally `window_length`
+                                            and `index_pattern` which override the respective top-level parameter. Each request picks one entry
+                                            at random with a probability proportional to its weight. Fieldstats are always looked up for the
+                                            top-level `index_pattern`.
         "query_string"                  -   String indicating file to load or list of strings indicating actual query parameters to randomize during benchmarking. Defaults 
                                             to ["*"], If a list has been specified, a random value will be selected.
         "index_pattern"                 -   String or list of strings representing the index pattern to query. If a list has
@@ -82,14 +155,48 @@ class ElasticlogsKibanaSource:
                                             Default is not to set this query parameter which means Elasticsearch will use its default value.
         "pre_filter_shard_size"         -   Defines the `pre_filter_shard_size` parameter used with throttled (frozen) indices. Defaults to 1.
         "debug"                         -   Boolean indicating whether request and response should be logged for debugging. Defaults to `false`.
-        "seed"                          -   Optional seed used to randomize window_length and window_end parameters.
+        "seed"                          -   Optional seed used to randomize window_length and window_end parameters. Each client derives its own
+                                            independent random stream from the seed and its client index.
+        "window_rounding"               -   (Optional) Rounds the start of time windows down and their end up to a multiple of this duration,
+                                            e.g. '1m' similar to `now-15m/m` to `now/m` in Kibana. Consists of a number and either m (minutes),
+                                            h (hours) or d (days). Defaults to no rounding.
+        "target_cache_hit_ratio"        -   (Optional) Share of requests that repeat one of the `recent_requests` most recent requests of the
+                                            client with identical time window and preference so that they can be served from the shard request
+                                            cache. Repeated requests are marked with `window_reused` in the meta data. Not supported with
+                                            sessions. Defaults to 0.
+        "recent_requests"               -   Number of recent requests per client that can be repeated. Defaults to 10.
+        "session_users"                 -   (Optional) Number of Kibana users that each client simulates. Defaults to 0 which disables sessions
+                                            and sends dashboard requests back-to-back. See below for details.
+        "session_refresh_interval"      -   Auto-refresh interval of dashboards in seconds. 0 disables auto-refresh. Defaults to 30.
+        "session_think_time"            -   Mean time in seconds between interactions of a user with Kibana. Defaults to 60.
+        "session_think_time_distribution" - Distribution of think times. One of 'exponential' (default), 'uniform' (between 0 and twice the mean)
+                                            and 'constant'.
+        "session_zoom_probability"      -   Probability that an interaction zooms into the current time window. Defaults to 0.3.
+        "session_discover_probability"  -   Probability that an interaction drills down into Discover. Defaults to 0.2.
+        "session_zoom_factor"           -   Share of the current time window that remains after zooming in. Defaults to 0.25.
+
+    A dashboard spec is a JSON object with a list of search request bodies, one per visualisation, in the key
+    ``panels``. Values that change between requests are given as the placeholder strings "@@query_string@@",
+    "@@interval@@", "@@ts_min_ms@@", "@@ts_max_ms@@" and "@@discover_size@@". See the specs of the built-in dashboards
+    in ``dashboard_specs`` for examples.
+
+    With sessions, each client simulates ``session_users`` users that are scheduled on a single timeline. A user opens a
+    dashboard (picked from the dashboard mix), which is auto-refreshed every ``session_refresh_interval`` seconds. A
+    refresh moves relative time windows along with the current time. After each think time the user interacts with
+    Kibana: zooming into a random part of the current time window (which then stays fixed), drilling down into Discover
+    for the current time window or opening another dashboard. ``meta_data`` contains the action in ``session_action``.
+    The time when the next action is due is passed to the ``kibana-sessions`` scheduler (see ``SessionScheduler``),
+    which the task needs to use. As each client sends one request at a time, actions are delayed while a request is
+    running.
+
+    The msearch request body of each dashboard is serialized only once (see ``CompiledMsearchBody``) and ``params()``
+    returns it as NDJSON encoded ``bytes`` with the values of the current request filled in.
     """
     def __init__(self, track, params, **kwargs):
         self._params = params
         self._indices = track.indices
         self._index_pattern = params["index_pattern"]
         self._query_string_list = ["*"]
-        self._dashboard = params["dashboard"]
         self._discover_size = params.get("discover_size", 500)
         self._ignore_throttled = params.get("ignore_throttled", True)
         self._debug = params.get("debug", False)
@@ -99,7 +206,7 @@ class ElasticlogsKibanaSource:
         self.infinite = True
         self.utcnow = kwargs.get("utcnow", datetime.datetime.utcnow)
 
-        random.seed()
+        self._random = randomstream.partition_random(None, None, "kibana")
 
         if "query_string" in params.keys():
             if isinstance(params["query_string"], str):    
@@ -112,9 +219,6 @@ class ElasticlogsKibanaSource:
             else:
                 self._query_string_list = params["query_string"]
 
-        if self._dashboard not in available_dashboards:
-            raise ConfigurationError("Unknown dashboard [{}]. Must be one of {}.".format(self._dashboard, available_dashboards))
-
         key = "{}_@timestamp".format(self._index_pattern)
         if key in gs.global_fieldstats.keys():
             stats = gs.global_fieldstats[key]
@@ -124,74 +228,152 @@ class ElasticlogsKibanaSource:
         else:
             self._fieldstats_provided = False
 
-        re1 = re.compile(r"^(\d+\.*\d*)([dhm])$")
-        re2 = re.compile(r"^(\d+\.*\d*)%$")
-
-        m1 = re1.match(self._window_length)
-        m2 = re2.match(self._window_length)
-        if m1:
-            val = float(m1.group(1))
-            unit = m1.group(2)
-
-            if unit == "m":
-                self._window_duration_ms = int(60*val*1000)
-            elif unit == "h":
-                self._window_duration_ms = int(3600*val*1000)
-            else:
-                self._window_duration_ms = int(86400*val*1000)
-        elif m2:
-            if self._fieldstats_provided:
-                val = int(math.fabs(float(m2.group(1)) / 100.0) * (self._fieldstats_end_ms - self._fieldstats_start_ms))
-                self._window_duration_ms = val
-            else:
-                raise ConfigurationError("Invalid window_length as a percentage ({}) may only be used when fieldstats have been provided.".format(self._window_length))
-        elif self._window_length == "random":
-            if not self._fieldstats_provided:
-                raise ConfigurationError("Invalid window_length ({}) may only be used when fieldstats have been provided.".format(self._window_length))
+        if "dashboard_mix" in params:
+            dashboard_mix = params["dashboard_mix"]
+            if not isinstance(dashboard_mix, list) or len(dashboard_mix) == 0:
+                raise ConfigurationError("The parameter [dashboard_mix] must be a non-empty list.")
         else:
-            raise ConfigurationError("Invalid window_length parameter supplied: {}.".format(self._window_length))
-                
+            dashboard_mix = [{"dashboard": params["dashboard"]}]
+        self._variants = [self.__create_variant(entry) for entry in dashboard_mix]
+        weights = [variant["weight"] for variant in self._variants]
+        if any(weight < 0 for weight in weights) or sum(weights) <= 0:
+            raise ConfigurationError("The weights in [dashboard_mix] must not be negative and at least one must be positive.")
+        self._variant_cum_weights = list(itertools.accumulate(weights))
+
         # Interpret window specification(s)
         if "window_end" in params.keys():
             self._window_end = self.__parse_window_parameters(params["window_end"])
         else:
             self._window_end = [{"type": "relative", "offset_ms": 0}]
 
+        window_rounding = params.get("window_rounding")
+        if window_rounding is None:
+            self._window_rounding_ms = None
+        else:
+            self._window_rounding_ms = self.__parse_duration_ms(window_rounding)
+            if self._window_rounding_ms is None:
+                raise ConfigurationError("Invalid window_rounding parameter supplied: {}.".format(window_rounding))
+
+        self._target_cache_hit_ratio = float(params.get("target_cache_hit_ratio", 0))
+        if not 0 <= self._target_cache_hit_ratio <= 1:
+            raise ConfigurationError("The parameter [target_cache_hit_ratio] must be in the range [0, 1].")
+        self._recent_requests = collections.deque(maxlen=int(params.get("recent_requests", 10)))
+        if self._target_cache_hit_ratio > 0 and self._recent_requests.maxlen < 1:
+            raise ConfigurationError("The parameter [recent_requests] must be positive.")
+        # Like Kibana, send all requests of a client (or session user) with the same preference so that repeated
+        # requests hit the same shard copies and can be served from their request cache.
+        self._stable_preference = self._window_rounding_ms is not None or self._target_cache_hit_ratio > 0
+        self._preferences = randomstream.partition_random(None, None, "preference")
+        self._preference = self.__new_preference()
+
+        self._session_users = int(params.get("session_users", 0))
+        self._sessions = None
+        self._perf_counter = kwargs.get("perf_counter", time.perf_counter)
+        if self._session_users > 0:
+            if self._target_cache_hit_ratio > 0:
+                raise ConfigurationError("The parameter [target_cache_hit_ratio] cannot be combined with [session_users].")
+            self._session_refresh_interval = float(params.get("session_refresh_interval", 30))
+            self._session_think_time = float(params.get("session_think_time", 60))
+            self._session_think_time_distribution = params.get("session_think_time_distribution", "exponential")
+            self._session_zoom_probability = float(params.get("session_zoom_probability", 0.3))
+            self._session_discover_probability = float(params.get("session_discover_probability", 0.2))
+            self._session_zoom_factor = float(params.get("session_zoom_factor", 0.25))
+            if self._session_refresh_interval < 0:
+                raise ConfigurationError("The parameter [session_refresh_interval] must not be negative.")
+            if self._session_think_time <= 0:
+                raise ConfigurationError("The parameter [session_think_time] must be positive.")
+            if self._session_think_time_distribution not in think_time_distributions:
+                raise ConfigurationError("Unknown think time distribution [{}]. Must be one of {}."
+                                         .format(self._session_think_time_distribution, think_time_distributions))
+            if self._session_zoom_probability < 0 or self._session_discover_probability < 0 or \
+                    self._session_zoom_probability + self._session_discover_probability > 1:
+                raise ConfigurationError("The parameters [session_zoom_probability] and [session_discover_probability] "
+                                         "must not be negative and their sum must not exceed 1.")
+            if not 0 < self._session_zoom_factor <= 1:
+                raise ConfigurationError("The parameter [session_zoom_factor] must be in the range (0, 1].")
+            # refreshes only move the time window if its end is relative to the current time
+            self._sliding_window = all(spec["type"] == "relative" for spec in self._window_end)
+            self._discover_body = self.__compile_body("discover")
+
     def partition(self, partition_index, total_partitions):
-        seed = (partition_index + 1) * self._params["seed"] if "seed" in self._params else None
-        random.seed(seed)
-        return self
+        partition = copy.copy(self)
+        partition._random = randomstream.partition_random(self._params.get("seed"), partition_index, "kibana")
+        partition._recent_requests = collections.deque(maxlen=self._recent_requests.maxlen)
+        partition._preferences = randomstream.partition_random(self._params.get("seed"), partition_index, "preference")
+        partition._preference = partition.__new_preference()
+        # each client simulates its own users
+        partition._sessions = None
+        return partition
 
     def params(self):
+        if self._session_users > 0:
+            return self.__session_params()
+
+        if self._target_cache_hit_ratio > 0 and self._recent_requests and \
+                self._random.random() < self._target_cache_hit_ratio:
+            response = self._random.choice(self._recent_requests)
+            meta_data = dict(response["meta_data"])
+            meta_data["window_reused"] = True
+            return {
+                "body": response["body"],
+                "meta_data": meta_data,
+                "params": response["params"]
+            }
+
+        variant = self.__select_variant()
+        ts_min_ms, ts_max_ms = self.__time_window(variant)
+        query_string = self.__select_random_item(self._query_string_list)
+        index_pattern = self.__select_random_item(variant["index_pattern"])
+
+        response = self.__request(variant["dashboard"], variant["compiled_body"], variant["window_length"],
+                                  index_pattern, query_string, ts_min_ms, ts_max_ms)
+        if self._target_cache_hit_ratio > 0:
+            self._recent_requests.append(response)
+        return response
+
+    def __select_variant(self):
+        if len(self._variants) == 1:
+            return self._variants[0]
+        else:
+            return self._random.choices(self._variants, cum_weights=self._variant_cum_weights)[0]
+
+    def __time_window(self, variant):
         # Determine window_end boundaries
         if len(self._window_end) == 1:
             ts_max_ms = int(self.__window_boundary_to_ms(self._window_end[0]))
         else:
             t1 = self.__window_boundary_to_ms(self._window_end[0])
             t2 = self.__window_boundary_to_ms(self._window_end[1])
-            offset = (int)(random.random() * math.fabs(t2 - t1))
+            offset = (int)(self._random.random() * math.fabs(t2 - t1))
 
             ts_max_ms = int(offset + min(t1, t2))
 
-        if self._window_length == "random":
+        window_duration_ms = variant["window_duration_ms"]
+        if window_duration_ms is None:
             max_window_length = int(math.fabs(ts_max_ms - self._fieldstats_start_ms))
-            self._window_duration_ms = random.randrange(60 * 1000, max_window_length + 1, 60 * 1000)
+            window_duration_ms = self._random.randrange(60 * 1000, max_window_length + 1, 60 * 1000)
 
-        ts_min_ms = int(ts_max_ms - self._window_duration_ms)
+        ts_min_ms = int(ts_max_ms - window_duration_ms)
+        return ts_min_ms, ts_max_ms
 
-        window_size_seconds = int(self._window_duration_ms / 1000)
+    def __request(self, dashboard, compiled_body, window_length, index_pattern, query_string, ts_min_ms, ts_max_ms,
+                  preference=None):
+        window_size_seconds = int((ts_max_ms - ts_min_ms) / 1000)
+        if self._window_rounding_ms:
+            # like Kibana's date math rounding (e.g. now-15m/m to now/m), so that repeated requests are identical. The
+            # end is rounded up to the last millisecond of its unit.
+            ts_min_ms -= ts_min_ms % self._window_rounding_ms
+            ts_max_ms += self._window_rounding_ms - 1 - ts_max_ms % self._window_rounding_ms
 
         # Determine histogram interval
         interval = ElasticlogsKibanaSource.determine_interval(window_size_seconds, 50, 100)
-        query_string = self.__select_random_item(self._query_string_list)
-        index_pattern = self.__select_random_item(self._index_pattern)
 
         meta_data = {
             "interval": interval,
             "index_pattern": index_pattern,
             "query_string": query_string,
-            "dashboard": self._dashboard,
-            "window_length": self._window_length,
+            "dashboard": dashboard,
+            "window_length": window_length,
             "ignore_throttled": self._ignore_throttled,
             "debug": self._debug
         }
@@ -201,21 +383,199 @@ class ElasticlogsKibanaSource:
         if self._max_concurrent_shard_requests > 0:
             request_params["max_concurrent_shard_requests"] = self._max_concurrent_shard_requests
 
-        if self._dashboard == "traffic":
-            response = {"body": self.__traffic_dashboard(index_pattern, query_string, interval, ts_min_ms, ts_max_ms, self._ignore_throttled)}
-        elif self._dashboard == "content_issues":
-            response = {"body": self.__content_issues_dashboard(index_pattern, query_string, interval, ts_min_ms, ts_max_ms, self._ignore_throttled)}
-        elif self._dashboard == "discover":
-            response = {"body": self.__discover(self._discover_size, index_pattern, query_string, interval, ts_min_ms, ts_max_ms, self._ignore_throttled)}
+        body = compiled_body.render({
+            "index_pattern": index_pattern,
+            "preference": preference if preference is not None else self.__get_preference(),
+            "query_string": query_string,
+            "interval": interval,
+            "ts_min_ms": ts_min_ms,
+            "ts_max_ms": ts_max_ms,
+            "discover_size": self._discover_size
+        })
+
+        return {
+            "body": body,
+            "meta_data": meta_data,
+            "params": request_params
+        }
 
-        response["meta_data"] = meta_data
-        response["params"] = request_params
+    def __session_params(self):
+        now = self._perf_counter()
+        if self._sessions is None:
+            # users arrive spread across one think time. The first one arrives immediately as the scheduler sends the
+            # first request without waiting.
+            self._sessions = []
+            for user_id in range(self._session_users):
+                user = {"id": user_id, "action": "open", "next_refresh": math.inf, "next_interaction": math.inf,
+                        "preference": self.__new_preference()}
+                arrival = now + self._random.random() * self._session_think_time if user_id > 0 else now
+                heapq.heappush(self._sessions, (arrival, user_id, user))
+
+        due, user_id, user = heapq.heappop(self._sessions)
+        # the next actions of this user are scheduled relative to when this one is actually sent
+        start = max(due, now)
+        # relative time windows are determined for the time when the action is due
+        delay_ms = int((start - now) * 1000)
+        action = user["action"]
+        dashboard = user.get("dashboard")
+        compiled_body = user.get("compiled_body")
+
+        if action == "open":
+            variant = self.__select_variant()
+            ts_min_ms, ts_max_ms = self.__time_window(variant)
+            if self._sliding_window:
+                ts_min_ms += delay_ms
+                ts_max_ms += delay_ms
+            dashboard = variant["dashboard"]
+            compiled_body = variant["compiled_body"]
+            user.update({
+                "dashboard": dashboard,
+                "compiled_body": compiled_body,
+                "window_length": variant["window_length"],
+                "query_string": self.__select_random_item(self._query_string_list),
+                "index_pattern": self.__select_random_item(variant["index_pattern"]),
+                "ts_min_ms": ts_min_ms,
+                "ts_max_ms": ts_max_ms,
+                # a sliding window keeps its distance to the current time
+                "end_offset_ms": ts_max_ms - delay_ms - self.__current_epoch_ms() if self._sliding_window else None
+            })
+        elif action == "refresh":
+            if user["end_offset_ms"] is not None:
+                ts_max_ms = int(self.__current_epoch_ms() + delay_ms + user["end_offset_ms"])
+                user["ts_min_ms"] += ts_max_ms - user["ts_max_ms"]
+                user["ts_max_ms"] = ts_max_ms
+        elif action == "zoom":
+            duration_ms = user["ts_max_ms"] - user["ts_min_ms"]
+            zoomed_duration_ms = min(max(int(duration_ms * self._session_zoom_factor), 60 * 1000), duration_ms)
+            user["ts_min_ms"] += int(self._random.random() * (duration_ms - zoomed_duration_ms))
+            user["ts_max_ms"] = user["ts_min_ms"] + zoomed_duration_ms
+            # Kibana switches to an absolute time range when zooming in
+            user["end_offset_ms"] = None
+        elif action == "discover":
+            dashboard = "discover"
+            compiled_body = self._discover_body
+
+        response = self.__request(dashboard, compiled_body, user["window_length"], user["index_pattern"],
+                                  user["query_string"], user["ts_min_ms"], user["ts_max_ms"], user["preference"])
+        response["meta_data"]["session_action"] = action
+
+        # schedule the next action of this user. Auto-refresh restarts whenever the dashboard is (re)loaded.
+        if self._session_refresh_interval > 0:
+            user["next_refresh"] = start + self._session_refresh_interval
+        if action != "refresh":
+            user["next_interaction"] = start + self.__think_time()
+        if user["next_interaction"] <= user["next_refresh"]:
+            r = self._random.random()
+            if r < self._session_zoom_probability:
+                user["action"] = "zoom"
+            elif r < self._session_zoom_probability + self._session_discover_probability:
+                user["action"] = "discover"
+            else:
+                user["action"] = "open"
+            heapq.heappush(self._sessions, (user["next_interaction"], user_id, user))
+        else:
+            user["action"] = "refresh"
+            heapq.heappush(self._sessions, (user["next_refresh"], user_id, user))
+        session_scheduler.next_action_due.set(self._sessions[0][0])
 
         return response
 
+    def __think_time(self):
+        if self._session_think_time_distribution == "exponential":
+            return self._random.expovariate(1.0 / self._session_think_time)
+        elif self._session_think_time_distribution == "uniform":
+            return self._random.uniform(0, 2 * self._session_think_time)
+        else:
+            return self._session_think_time
+
+    def __create_variant(self, entry):
+        if not isinstance(entry, dict) or "dashboard" not in entry:
+            raise ConfigurationError("Each entry in [dashboard_mix] must be an object with the key [dashboard].")
+        dashboard = entry["dashboard"]
+        window_length = entry.get("window_length", self._window_length)
+        return {
+            "dashboard": dashboard,
+            "weight": float(entry.get("weight", 1)),
+            "index_pattern": entry.get("index_pattern", self._index_pattern),
+            "window_length": window_length,
+            "window_duration_ms": self.__parse_window_length(window_length),
+            "compiled_body": self.__compile_body(dashboard)
+        }
+
+    def __parse_duration_ms(self, duration):
+        m = re.match(r"^(\d+\.*\d*)([dhm])$", duration)
+        if m:
+            val = float(m.group(1))
+            unit = m.group(2)
+
+            if unit == "m":
+                return int(60*val*1000)
+            elif unit == "h":
+                return int(3600*val*1000)
+            else:
+                return int(86400*val*1000)
+        else:
+            return None
+
+    def __parse_window_length(self, window_length):
+        re2 = re.compile(r"^(\d+\.*\d*)%$")
+
+        duration_ms = self.__parse_duration_ms(window_length)
+        m2 = re2.match(window_length)
+        if duration_ms is not None:
+            return duration_ms
+        elif m2:
+            if self._fieldstats_provided:
+                return int(math.fabs(float(m2.group(1)) / 100.0) * (self._fieldstats_end_ms - self._fieldstats_start_ms))
+            else:
+                raise ConfigurationError("Invalid window_length as a percentage ({}) may only be used when fieldstats have been provided.".format(window_length))
+        elif window_length == "random":
+            if not self._fieldstats_provided:
+                raise ConfigurationError("Invalid window_length ({}) may only be used when fieldstats have been provided.".format(window_length))
+            # the duration is determined for each request
+            return None
+        else:
+            raise ConfigurationError("Invalid window_length parameter supplied: {}.".format(window_length))
+
+    def __compile_body(self, dashboard):
+        if dashboard.endswith(".json"):
+            spec_path = os.path.join(os.path.dirname(__file__), "..", dashboard)
+        elif dashboard in available_dashboards:
+            spec_path = os.path.join(dashboard_specs_dir, "{}.json".format(dashboard))
+        else:
+            raise ConfigurationError("Unknown dashboard [{}]. Must be one of {} or the path to a dashboard spec file."
+                                     .format(dashboard, available_dashboards))
+        # the compiled body only depends on the parameters that are fixed per task, so it is shared across clients
+        key = (os.path.realpath(spec_path), self._ignore_throttled)
+        if key not in compiled_bodies:
+            header = {
+                "index": slot("index_pattern"),
+                "ignore_unavailable": True,
+                "preference": slot("preference"),
+                "ignore_throttled": self._ignore_throttled
+            }
+            lines = []
+            for panel in self.__load_panels(dashboard, spec_path):
+                lines.append(header)
+                lines.append(panel)
+            compiled_bodies[key] = CompiledMsearchBody(lines)
+        return compiled_bodies[key]
+
+    def __load_panels(self, dashboard, path):
+        try:
+            with open(path, "rt", encoding="utf-8") as f:
+                spec = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ConfigurationError("Cannot load dashboard spec [{}]: {}".format(dashboard, e))
+        panels = spec.get("panels") if isinstance(spec, dict) else None
+        if not panels or not isinstance(panels, list) or not all(isinstance(panel, dict) for panel in panels):
+            raise ConfigurationError("Dashboard spec [{}] must contain a non-empty list of search bodies in [panels]."
+                                     .format(dashboard))
+        return panels
+
     def __select_random_item(self, values):
         if isinstance(values, list):
-            idx = random.randint(0, len(values)-1)
+            idx = self._random.randint(0, len(values)-1)
             return values[idx] 
         else:
             return values
@@ -350,68 +710,10 @@ class ElasticlogsKibanaSource:
 
         return selected_interval
 
+    def __new_preference(self):
+        return self._preferences.getrandbits(31) if self._stable_preference else None
+
     def __get_preference(self):
+        if self._preference is not None:
+            return self._preference
         return int(round(time.time() * 1000))
-
-    def __content_issues_dashboard(self, index_pattern, query_string, interval, ts_min_ms, ts_max_ms, ignore_throttled):
-        preference = self.__get_preference()
-        header = {
-            "index": index_pattern,
-            "ignore_unavailable": True,
-            "preference": preference,
-            "ignore_throttled": ignore_throttled
-        }
-        return [
-                   header,
-                   {"size":0,"aggs":{"2":{"cardinality":{"field":"nginx.access.remote_ip"}}},"version":True,"_source":{"excludes":[]},"stored_fields":["*"],"script_fields":{},"docvalue_fields":["@timestamp"],"query":{"bool":{"must":[{"match_all":{}},{"match_all":{}},{"query_string":{"query":query_string,"analyze_wildcard":True,"default_field":"*"}},{"match_phrase":{"nginx.access.response_code":{"query":404}}},{"range":{"@timestamp":{"gte":ts_min_ms,"lte":ts_max_ms,"format":"epoch_millis"}}}],"filter":[],"should":[],"must_not":[]}},"highlight":{"pre_tags":["@kibana-highlighted-field@"],"post_tags":["@/kibana-highlighted-field@"],"fields":{"*":{}},"fragment_size":2147483647}},
-                   header,
-                   {"size":0,"aggs":{"2":{"terms":{"field":"nginx.access.remote_ip","size":20,"order":{"_count":"desc"}}}},"version":True,"_source":{"excludes":[]},"stored_fields":["*"],"script_fields":{},"docvalue_fields":["@timestamp"],"query":{"bool":{"must":[{"match_all":{}},{"match_all":{}},{"query_string":{"query":query_string,"analyze_wildcard":True,"default_field":"*"}},{"match_phrase":{"nginx.access.response_code":{"query":404}}},{"range":{"@timestamp":{"gte":ts_min_ms,"lte":ts_max_ms,"format":"epoch_millis"}}}],"filter":[],"should":[],"must_not":[]}},"highlight":{"pre_tags":["@kibana-highlighted-field@"],"post_tags":["@/kibana-highlighted-field@"],"fields":{"*":{}},"fragment_size":2147483647}},
-                   header,
-                   {"size":0,"aggs":{"2":{"terms":{"field":"nginx.access.url","size":20,"order":{"_count":"desc"}}}},"version":True,"_source":{"excludes":[]},"stored_fields":["*"],"script_fields":{},"docvalue_fields":["@timestamp"],"query":{"bool":{"must":[{"match_all":{}},{"match_all":{}},{"query_string":{"query":query_string,"analyze_wildcard":True,"default_field":"*"}},{"match_phrase":{"nginx.access.response_code":{"query":404}}},{"range":{"@timestamp":{"gte":ts_min_ms,"lte":ts_max_ms,"format":"epoch_millis"}}}],"filter":[],"should":[],"must_not":[]}},"highlight":{"pre_tags":["@kibana-highlighted-field@"],"post_tags":["@/kibana-highlighted-field@"],"fields":{"*":{}},"fragment_size":2147483647}},
-                   header,
-                   {"size":0,"aggs":{"2":{"terms":{"field":"nginx.access.referrer","size":20,"order":{"_count":"desc"}}}},"version":True,"_source":{"excludes":[]},"stored_fields":["*"],"script_fields":{},"docvalue_fields":["@timestamp"],"query":{"bool":{"must":[{"match_all":{}},{"match_all":{}},{"query_string":{"query":query_string,"analyze_wildcard":True,"default_field":"*"}},{"match_phrase":{"nginx.access.response_code":{"query":404}}},{"range":{"@timestamp":{"gte":ts_min_ms,"lte":ts_max_ms,"format":"epoch_millis"}}}],"filter":[],"should":[],"must_not":[]}},"highlight":{"pre_tags":["@kibana-highlighted-field@"],"post_tags":["@/kibana-highlighted-field@"],"fields":{"*":{}},"fragment_size":2147483647}},
-                   header,
-                   {"size":0,"aggs":{"2":{"date_histogram":{"field":"@timestamp","fixed_interval":interval,"time_zone":"Europe/London","min_doc_count":1}}},"version":True,"_source":{"excludes":[]},"stored_fields":["*"],"script_fields":{},"docvalue_fields":["@timestamp"],"query":{"bool":{"must":[{"match_all":{}},{"match_all":{}},{"query_string":{"query":query_string,"analyze_wildcard":True,"default_field":"*"}},{"match_phrase":{"nginx.access.response_code":{"query":404}}},{"range":{"@timestamp":{"gte":ts_min_ms,"lte":ts_max_ms,"format":"epoch_millis"}}}],"filter":[],"should":[],"must_not":[]}},"highlight":{"pre_tags":["@kibana-highlighted-field@"],"post_tags":["@/kibana-highlighted-field@"],"fields":{"*":{}},"fragment_size":2147483647}}
-               ]
-
-    def __traffic_dashboard(self, index_pattern, query_string, interval, ts_min_ms, ts_max_ms, ignore_throttled):
-        preference = self.__get_preference()
-        header = {
-            "index": index_pattern,
-            "ignore_unavailable": True,
-            "preference": preference,
-            "ignore_throttled": ignore_throttled
-
-        }
-        return [
-                   header,
-                   {"size":0,"aggs":{"filter_agg":{"filter":{"geo_bounding_box":{"nginx.access.geoip.location":{"top_left":{"lat":90,"lon":-180},"bottom_right":{"lat":-90,"lon":180}}}},"aggs":{"2":{"geohash_grid":{"field":"nginx.access.geoip.location","precision":2},"aggs":{"3":{"geo_centroid":{"field":"nginx.access.geoip.location"}}}}}}},"version":True,"stored_fields":["*"],"script_fields":{},"docvalue_fields":["@timestamp"],"query":{"bool":{"must":[{"match_all":{}},{"query_string":{"query":query_string,"analyze_wildcard":True,"default_field":"*"}},{"range":{"@timestamp":{"gte":ts_min_ms,"lte":ts_max_ms,"format":"epoch_millis"}}}],"filter":[],"should":[],"must_not":[]}},"highlight":{"pre_tags":["@kibana-highlighted-field@"],"post_tags":["@/kibana-highlighted-field@"],"fields":{"*":{}},"fragment_size":2147483647}},
-                   header,
-                   {"size":0,"aggs":{"2":{"date_histogram":{"field":"@timestamp","fixed_interval":interval,"time_zone":"Europe/London","min_doc_count":1},"aggs":{"3":{"filters":{"filters":{"200s":{"query_string":{"query":"nginx.access.response_code: [200 TO 300]","analyze_wildcard":True,"default_field":"*"}},"300s":{"query_string":{"query":"nginx.access.response_code: [300 TO 400]","analyze_wildcard":True,"default_field":"*"}},"400s":{"query_string":{"query":"nginx.access.response_code: [400 TO 500]","analyze_wildcard":True,"default_field":"*"}},"500s":{"query_string":{"query":"nginx.access.response_code: [500 TO 600]","analyze_wildcard":True,"default_field":"*"}}}}}}}},"version":True,"stored_fields":["*"],"script_fields":{},"docvalue_fields":["@timestamp"],"query":{"bool":{"must":[{"match_all":{}},{"query_string":{"query":query_string,"analyze_wildcard":True,"default_field":"*"}},{"range":{"@timestamp":{"gte":ts_min_ms,"lte":ts_max_ms,"format":"epoch_millis"}}}],"filter":[],"should":[],"must_not":[]}},"highlight":{"pre_tags":["@kibana-highlighted-field@"],"post_tags":["@/kibana-highlighted-field@"],"fields":{"*":{}},"fragment_size":2147483647}},
-                   header,
-                   {"size":0,"aggs":{"2":{"terms":{"field":"nginx.access.url","size":10,"order":{"_count":"desc"}}}},"version":True,"stored_fields":["*"],"script_fields":{},"docvalue_fields":["@timestamp"],"query":{"bool":{"must":[{"match_all":{}},{"query_string":{"query":query_string,"analyze_wildcard":True,"default_field":"*"}},{"range":{"@timestamp":{"gte":ts_min_ms,"lte":ts_max_ms,"format":"epoch_millis"}}}],"filter":[],"should":[],"must_not":[]}},"highlight":{"pre_tags":["@kibana-highlighted-field@"],"post_tags":["@/kibana-highlighted-field@"],"fields":{"*":{}},"fragment_size":2147483647}},
-                   header,
-                   {"size":0,"aggs":{"2":{"date_histogram":{"field":"@timestamp","fixed_interval":interval,"time_zone":"Europe/London","min_doc_count":1},"aggs":{"1":{"sum":{"field":"nginx.access.body_sent.bytes"}}}}},"version":True,"stored_fields":["*"],"script_fields":{},"docvalue_fields":["@timestamp"],"query":{"bool":{"must":[{"match_all":{}},{"query_string":{"query":query_string,"analyze_wildcard":True,"default_field":"*"}},{"range":{"@timestamp":{"gte":ts_min_ms,"lte":ts_max_ms,"format":"epoch_millis"}}}],"filter":[],"should":[],"must_not":[]}},"highlight":{"pre_tags":["@kibana-highlighted-field@"],"post_tags":["@/kibana-highlighted-field@"],"fields":{"*":{}},"fragment_size":2147483647}},
-                   header,
-                   {"size":0,"aggs":{"2":{"terms":{"field":"nginx.access.user_agent.name","size":5,"order":{"_count":"desc"}},"aggs":{"3":{"terms":{"field":"nginx.access.user_agent.major","size":5,"order":{"_count":"desc"}}}}}},"version":True,"stored_fields":["*"],"script_fields":{},"docvalue_fields":["@timestamp"],"query":{"bool":{"must":[{"query_string":{"query":"*","analyze_wildcard":True,"default_field":"*"}},{"query_string":{"query":query_string,"analyze_wildcard":True,"default_field":"*"}},{"range":{"@timestamp":{"gte":ts_min_ms,"lte":ts_max_ms,"format":"epoch_millis"}}}],"filter":[],"should":[],"must_not":[]}},"highlight":{"pre_tags":["@kibana-highlighted-field@"],"post_tags":["@/kibana-highlighted-field@"],"fields":{"*":{}},"fragment_size":2147483647}},
-                   header,
-                   {"size":0,"aggs":{"2":{"terms":{"field":"nginx.access.user_agent.os_name","size":5,"order":{"_count":"desc"}},"aggs":{"3":{"terms":{"field":"nginx.access.user_agent.os_major","size":5,"order":{"_count":"desc"}}}}}},"version":True,"stored_fields":["*"],"script_fields":{},"docvalue_fields":["@timestamp"],"query":{"bool":{"must":[{"query_string":{"query":"*","analyze_wildcard":True,"default_field":"*"}},{"query_string":{"query":query_string,"analyze_wildcard":True,"default_field":"*"}},{"range":{"@timestamp":{"gte":ts_min_ms,"lte":ts_max_ms,"format":"epoch_millis"}}}],"filter":[],"should":[],"must_not":[]}},"highlight":{"pre_tags":["@kibana-highlighted-field@"],"post_tags":["@/kibana-highlighted-field@"],"fields":{"*":{}},"fragment_size":2147483647}},
-                   header,
-                   {"size":0,"aggs":{"2":{"date_histogram":{"field":"@timestamp","fixed_interval":interval,"time_zone":"Europe/London","min_doc_count":1},"aggs":{"3":{"terms":{"field":"nginx.access.response_code","size":10,"order":{"_count":"desc"}}}}}},"version":True,"_source":{"excludes":[]},"stored_fields":["*"],"script_fields":{},"docvalue_fields":["@timestamp"],"query":{"bool":{"must":[{"match_all":{}},{"query_string":{"query":"nginx.access.response_code: [400 TO 600]","analyze_wildcard":True,"default_field":"*"}},{"query_string":{"query":query_string,"analyze_wildcard":True,"default_field":"*"}},{"range":{"@timestamp":{"gte":ts_min_ms,"lte":ts_max_ms,"format":"epoch_millis"}}}],"filter":[],"should":[],"must_not":[]}},"highlight":{"pre_tags":["@kibana-highlighted-field@"],"post_tags":["@/kibana-highlighted-field@"],"fields":{"*":{}},"fragment_size":2147483647}}
-               ]
-
-    def __discover(self, discover_size, index_pattern, query_string, interval, ts_min_ms, ts_max_ms, ignore_throttled):
-        preference = self.__get_preference()
-        header = {
-            "index": index_pattern,
-            "ignore_unavailable": True,
-            "preference": preference,
-            "ignore_throttled": ignore_throttled
-
-        }
-        return [
-                   header,
-                   {"version":True,"size":discover_size,"sort":[{"@timestamp":{"order":"desc","unmapped_type":"boolean"}}],"_source":{"excludes":[]},"aggs":{"2":{"date_histogram":{"field":"@timestamp","fixed_interval":interval,"time_zone":"Europe/London","min_doc_count":1}}},"stored_fields":["*"],"script_fields":{},"docvalue_fields":["@timestamp"],"query":{"bool":{"must":[{"query_string":{"query":query_string,"analyze_wildcard":True,"default_field":"*"}},{"range":{"@timestamp":{"gte":ts_min_ms,"lte":ts_max_ms,"format":"epoch_millis"}}}],"filter":[],"should":[],"must_not":[]}},"highlight":{"pre_tags":["@kibana-highlighted-field@"],"post_tags":["@/kibana-highlighted-field@"],"fields":{"*":{}},"fragment_size":2147483647}}
-                ]
-
-
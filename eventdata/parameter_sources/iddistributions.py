@@ -0,0 +1,147 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""
+Distributions of the sequential ids that are targeted by updates.
+
+Each distribution draws all targets of a bulk request at once with ``sample(rng, upper, count)`` which returns
+``count`` ids in the range [0, ``upper``), i.e. among the documents that have been created before the bulk request.
+"""
+
+import math
+
+DISTRIBUTIONS = ["uniform", "low_id_bias", "zipf", "window", "hot_set"]
+
+
+class Uniform:
+    """
+    All existing documents are updated with the same probability.
+    """
+    def sample(self, rng, upper, count):
+        if upper <= 1:
+            return [0] * count
+        randrange = rng.randrange
+        return [randrange(upper) for _ in range(count)]
+
+
+class LowIdBias:
+    """
+    Heavily favors the oldest documents.
+    """
+    def __init__(self, exponent=10):
+        # exponent ~> 0: results closer to the lowest id, exponent >> 0: results closer to the highest id
+        self.exponent = exponent
+
+    def sample(self, rng, upper, count):
+        random = rng.random
+        exponent = self.exponent
+        return [int(upper * pow(random(), exponent)) for _ in range(count)]
+
+
+class ZipfRecency:
+    """
+    Favors recent documents: the probability to update the document with recency rank ``r`` (the most recent document
+    has rank 1) is proportional to ``1 / r^exponent``.
+
+    Ranks are drawn with the inverse distribution function of the continuous approximation of the Zipf distribution
+    which only requires a single random number per id.
+    """
+    def __init__(self, exponent=1.0):
+        if exponent <= 0:
+            raise AssertionError("The value [{}] is invalid for the parameter [id_seq_zipf_exponent]".format(exponent))
+        self.exponent = exponent
+
+    def sample(self, rng, upper, count):
+        if upper <= 1:
+            return [0] * count
+        random = rng.random
+        # ranks are in [1, upper + 1) before truncation
+        n = upper + 1
+        if self.exponent == 1.0:
+            log_n = math.log(n)
+            ranks = [math.exp(log_n * random()) for _ in range(count)]
+        else:
+            e = 1.0 - self.exponent
+            scale = pow(n, e) - 1.0
+            inv_e = 1.0 / e
+            ranks = [pow(scale * random() + 1.0, inv_e) for _ in range(count)]
+        return [max(upper - int(rank), 0) for rank in ranks]
+
+
+class SlidingWindow:
+    """
+    Updates are spread uniformly across the most recent ``size`` documents.
+    """
+    def __init__(self, size=10000):
+        if size <= 0:
+            raise AssertionError("The value [{}] is invalid for the parameter [id_seq_window_size]".format(size))
+        self.size = size
+
+    def sample(self, rng, upper, count):
+        if upper <= 1:
+            return [0] * count
+        randrange = rng.randrange
+        window = min(self.size, upper)
+        last = upper - 1
+        return [last - randrange(window) for _ in range(count)]
+
+
+class HotSet:
+    """
+    A fixed set of hot documents (the ``size`` oldest documents) receives the share ``probability`` of all updates. The
+    remaining updates are spread uniformly across all documents.
+    """
+    def __init__(self, size=1000, probability=0.9):
+        if size <= 0:
+            raise AssertionError("The value [{}] is invalid for the parameter [id_seq_hot_set_size]".format(size))
+        if not 0.0 <= probability <= 1.0:
+            raise AssertionError("The value [{}] is invalid for the parameter [id_seq_hot_set_probability]"
+                                 .format(probability))
+        self.size = size
+        self.probability = probability
+
+    def sample(self, rng, upper, count):
+        if upper <= 1:
+            return [0] * count
+        random = rng.random
+        probability = self.probability
+        hot = min(self.size, upper)
+        # scale one random number to the chosen range instead of drawing a second one
+        return [int(hot * r / probability) if r < probability else int(upper * (r - probability) / (1.0 - probability))
+                for r in [random() for _ in range(count)]]
+
+
+def create(params):
+    """
+    Creates the distribution of update targets from the parameters of ``elasticlogs_bulk``.
+    """
+    distribution = params.get("id_seq_distribution")
+    if distribution is None:
+        distribution = "low_id_bias" if str(params.get("id_seq_low_id_bias", False)).lower() == "true" else "uniform"
+    if distribution == "uniform":
+        return Uniform()
+    elif distribution == "low_id_bias":
+        return LowIdBias()
+    elif distribution == "zipf":
+        return ZipfRecency(float(params.get("id_seq_zipf_exponent", 1.0)))
+    elif distribution == "window":
+        return SlidingWindow(int(params.get("id_seq_window_size", 10000)))
+    elif distribution == "hot_set":
+        return HotSet(int(params.get("id_seq_hot_set_size", 1000)), float(params.get("id_seq_hot_set_probability", 0.9)))
+    else:
+        raise AssertionError("The value [{}] is invalid for the parameter [id_seq_distribution]. Supported values are {}"
+                             .format(distribution, DISTRIBUTIONS))
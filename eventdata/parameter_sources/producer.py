@@ -0,0 +1,166 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import multiprocessing
+import queue
+import threading
+import time
+
+PRODUCER_MODES = ["none", "thread", "process"]
+DEFAULT_QUEUE_SIZE = 10
+DEFAULT_TIMEOUT = 60
+# how often to check whether the producer is still alive while waiting for it
+POLL_INTERVAL = 1
+
+# marks the end of the stream of bulk requests
+_EXHAUSTED = "exhausted"
+
+
+class BulkProducer:
+    """
+    Generates bulk requests ahead of demand in a background thread or process and buffers them in a bounded queue.
+
+    Stalls are recorded on both ends of the queue: A consumer stall means that a bulk request was requested but none
+    was ready, i.e. the generator limits throughput. A producer stall means that the queue was full, i.e. the
+    generator is ahead of the cluster.
+
+    Rally calls parameter sources synchronously from the event loop of its worker so a consumer stall blocks all clients
+    of that worker until a bulk request is ready or ``timeout`` has elapsed.
+    """
+    def __init__(self, create_source, mode="thread", queue_size=DEFAULT_QUEUE_SIZE, timeout=DEFAULT_TIMEOUT):
+        """
+        :param create_source: A callable that creates the parameter source to produce bulk requests with. It is
+                              called in the background thread or process and needs to be picklable for processes.
+        :param mode: Either ``thread`` or ``process``.
+        :param queue_size: The maximum number of bulk requests that are generated ahead of demand.
+        :param timeout: The maximum time in seconds to wait for a bulk request.
+        """
+        if mode == "thread":
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._worker_type = threading.Thread
+        elif mode == "process":
+            self._queue = multiprocessing.Queue(maxsize=queue_size)
+            self._worker_type = multiprocessing.Process
+        else:
+            raise AssertionError("The value [{}] is invalid for the parameter [producer]".format(mode))
+        self._create_source = create_source
+        self._timeout = timeout
+        # shared with the producer so this works for threads and processes alike
+        self._producer_stalls = multiprocessing.Value("q", 0)
+        self._producer_stall_time = multiprocessing.Value("d", 0.0)
+        self._worker = None
+        self._exhausted = False
+        self.percent_completed = None
+        self.bulks = 0
+        self.consumer_stalls = 0
+        self.consumer_stall_time = 0.0
+
+    def start(self):
+        self._worker = self._worker_type(target=self._produce, daemon=True,
+                                         args=(self._create_source, self._queue, self._producer_stalls,
+                                               self._producer_stall_time))
+        self._worker.start()
+
+    @staticmethod
+    def _produce(create_source, bulk_queue, producer_stalls, producer_stall_time):
+        try:
+            source = create_source()
+            while True:
+                try:
+                    item = (source.params(), source.percent_completed)
+                except StopIteration:
+                    item = _EXHAUSTED
+                try:
+                    bulk_queue.put_nowait(item)
+                except queue.Full:
+                    start = time.perf_counter()
+                    bulk_queue.put(item)
+                    with producer_stalls.get_lock():
+                        producer_stalls.value += 1
+                    with producer_stall_time.get_lock():
+                        producer_stall_time.value += time.perf_counter() - start
+                if item is _EXHAUSTED:
+                    return
+        except BaseException as e:
+            # surface generator errors on the consumer side
+            bulk_queue.put(e)
+
+    def get(self):
+        """
+        :return: The next bulk request. Raises ``StopIteration`` when the parameter source is exhausted.
+        """
+        if self._exhausted:
+            raise StopIteration()
+        if self._worker is None:
+            self.start()
+        try:
+            item = self._queue.get_nowait()
+        except queue.Empty:
+            start = time.perf_counter()
+            item = self.__wait(start)
+            self.consumer_stalls += 1
+            self.consumer_stall_time += time.perf_counter() - start
+
+        if isinstance(item, BaseException):
+            self._exhausted = True
+            raise item
+        elif item == _EXHAUSTED:
+            self._exhausted = True
+            raise StopIteration()
+        response, self.percent_completed = item
+        self.bulks += 1
+        return response
+
+    def __wait(self, start):
+        while True:
+            remaining = self._timeout - (time.perf_counter() - start)
+            if remaining <= 0:
+                self._exhausted = True
+                raise TimeoutError("No bulk request has been produced within [{}] seconds.".format(self._timeout))
+            try:
+                return self._queue.get(timeout=min(remaining, POLL_INTERVAL))
+            except queue.Empty:
+                if not self._worker.is_alive():
+                    # the producer puts its last item before it terminates so check again
+                    try:
+                        return self._queue.get_nowait()
+                    except queue.Empty:
+                        self._exhausted = True
+                        raise RuntimeError("The bulk producer has terminated unexpectedly.")
+
+    @property
+    def queue_depth(self):
+        try:
+            return self._queue.qsize()
+        except NotImplementedError:
+            # multiprocessing queues do not support this on all platforms (e.g. macOS)
+            return None
+
+    @property
+    def stats(self):
+        """
+        :return: A dict with the current queue depth, the number of bulk requests consumed and the number and duration
+                 (in seconds) of consumer and producer stalls.
+        """
+        return {
+            "queue_depth": self.queue_depth,
+            "bulks": self.bulks,
+            "consumer_stalls": self.consumer_stalls,
+            "consumer_stall_time": self.consumer_stall_time,
+            "producer_stalls": self._producer_stalls.value,
+            "producer_stall_time": self._producer_stall_time.value
+        }
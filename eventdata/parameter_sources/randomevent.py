@@ -17,23 +17,150 @@
 
 
 import datetime
-import gzip
+import functools
 import itertools
-import json
 import os
+import logging
 import random
 import re
 
+from eventdata.parameter_sources import datacache, randomstream, volumebudget
 from eventdata.parameter_sources.timeutils import TimestampStructGenerator
 from eventdata.parameter_sources.weightedarray import WeightedArray
 from eventdata.utils import elasticlogs_bulk_source as ebs
 
+logger = logging.getLogger("track.eventdata")
+
 cwd = os.path.dirname(__file__)
 
+# Number of pre-rendered JSON fragments that each of Agent, ClientIp, Referrer and Request keep per process by default.
+DEFAULT_FRAGMENT_CACHE_SIZE = 50000
+
+# The raw event as it would appear in an nginx access log file.
+RAW_EVENT_TEMPLATE = '%s - - [%s] "%s %s HTTP/%s" %s %s "%s" "%s"'
+# The length of the raw event without its values. The components report the length of their values along with their
+# fragments so the raw event size can be calculated without rendering the raw event.
+RAW_EVENT_OVERHEAD = len(RAW_EVENT_TEMPLATE % (("",) * 9))
+
+# An event consists of a header with per-event data followed by one fragment for each of agent, client ip, referrer and
+# request. These fragments only depend on the corresponding row in the data set (except for rare client ips) and are
+# thus cached. Note that the strings in the data sets are already JSON-escaped.
+EVENT_HEADER_TEMPLATE = '{"@timestamp": "%s", ' \
+                        '"offset":%s, ' \
+                        '"source":"/usr/local/var/log/nginx/access.log","fileset":{"module":"nginx","name":"access"},"input":{"type":"log"},' \
+                        '"beat":{"version":"6.3.0","hostname":"%s","name":"%s"},' \
+                        '"prospector":{"type":"log"},' \
+                        '"nginx":{"access":{"user_name": "-",'
+
+EVENT_WITH_RAW_SIZE_HEADER_TEMPLATE = '{"@timestamp": "%s", ' \
+                                      '"_raw_event_size":%d, ' \
+                                      '"offset":%s, ' \
+                                      '"source":"/usr/local/var/log/nginx/access.log","fileset":{"module":"nginx","name":"access"},"input":{"type":"log"},' \
+                                      '"beat":{"version":"6.3.0","hostname":"%s","name":"%s"},' \
+                                      '"prospector":{"type":"log"},' \
+                                      '"nginx":{"access":{"user_name": "-",'
+
+AGENT_FRAGMENT_TEMPLATE = '"agent":"%s","user_agent": {"major": "%s","os": "%s","os_major": "%s","name": "%s","os_name": "%s","device": "%s"},'
+
+CLIENTIP_FRAGMENT_TEMPLATE = '"remote_ip": "%s","remote_ip_list":["%s"],'
+
+GEOIP_FRAGMENT_TEMPLATE = '"geoip":{"continent_name": "%s","city_name": "%s","country_name": "%s","country_iso_code": "%s","location":{"lat": %s,"lon": %s} },'
+
+REFERRER_FRAGMENT_TEMPLATE = '"referrer":"%s",'
+
+REQUEST_FRAGMENT_TEMPLATE = '"url": "%s","body_sent":{"bytes": %s},"method":"%s","response_code":%s,"http_version":"%s"} } }'
+
+# Events with only the raw event as `message` (see the parameter `raw_message`) which is left to an ingest pipeline to parse.
+# As above, values are already JSON-escaped but the quotes of the raw event need to be escaped here.
+RAW_MESSAGE_TEMPLATE = '"message":"%s - - [%s] \\"%s %s HTTP/%s\\" %s %s \\"%s\\" \\"%s\\""}'
+
+RAW_MESSAGE_HEADER_TEMPLATE = '{"@timestamp": "%s", ' \
+                              '"offset":%s, ' \
+                              '"source":"/usr/local/var/log/nginx/access.log","fileset":{"module":"nginx","name":"access"},"input":{"type":"log"},' \
+                              '"beat":{"version":"6.3.0","hostname":"%s","name":"%s"},' \
+                              '"prospector":{"type":"log"},'
+
+RAW_MESSAGE_WITH_RAW_SIZE_HEADER_TEMPLATE = '{"@timestamp": "%s", ' \
+                                            '"_raw_event_size":%d, ' \
+                                            '"offset":%s, ' \
+                                            '"source":"/usr/local/var/log/nginx/access.log","fileset":{"module":"nginx","name":"access"},"input":{"type":"log"},' \
+                                            '"beat":{"version":"6.3.0","hostname":"%s","name":"%s"},' \
+                                            '"prospector":{"type":"log"},'
+
+# the request part of the raw event (verb, request, http version, response and bytes)
+RAW_REQUEST_FRAGMENT_TEMPLATE = '%s %s HTTP/%s\\" %s %s'
+
+# the raw event assembled from the raw fragments of client ip, request, referrer and agent
+RAW_MESSAGE_FRAGMENTS_TEMPLATE = '"message":"%s - - [%s] \\"%s \\"%s\\" \\"%s\\""}'
+
+HTTP_DATE_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+EVENT_TEMPLATE = EVENT_HEADER_TEMPLATE + AGENT_FRAGMENT_TEMPLATE + CLIENTIP_FRAGMENT_TEMPLATE + \
+                 GEOIP_FRAGMENT_TEMPLATE + REFERRER_FRAGMENT_TEMPLATE + REQUEST_FRAGMENT_TEMPLATE
+
+EVENT_WITH_RAW_SIZE_TEMPLATE = EVENT_WITH_RAW_SIZE_HEADER_TEMPLATE + AGENT_FRAGMENT_TEMPLATE + \
+                               CLIENTIP_FRAGMENT_TEMPLATE + GEOIP_FRAGMENT_TEMPLATE + REFERRER_FRAGMENT_TEMPLATE + \
+                               REQUEST_FRAGMENT_TEMPLATE
+
+RAW_MESSAGE_EVENT_TEMPLATE = RAW_MESSAGE_HEADER_TEMPLATE + RAW_MESSAGE_TEMPLATE
+
+RAW_MESSAGE_EVENT_WITH_RAW_SIZE_TEMPLATE = RAW_MESSAGE_WITH_RAW_SIZE_HEADER_TEMPLATE + RAW_MESSAGE_TEMPLATE
+
+
+@functools.lru_cache(maxsize=1024)
+def http_date(iso_prefix):
+    """
+    :param iso_prefix: An ISO 8601 timestamp in UTC up to seconds, e.g. ``2019-06-17T23:59:59``.
+    :return: The timestamp in the format of nginx access logs, e.g. ``17/Jun/2019:23:59:59 +0000``.
+    """
+    return "%s/%s/%s:%s +0000" % (iso_prefix[8:10], HTTP_DATE_MONTHS[int(iso_prefix[5:7]) - 1], iso_prefix[0:4],
+                                  iso_prefix[11:19])
+
+
+def shared_fragment_cache(name, render, size):
+    """
+    :param name: Name of the fragment cache.
+    :param render: A module-level function that renders a fragment from the data sets in ``global_lookups``.
+    :param size: Maximum number of cached fragments.
+    :return: The cache of rendered fragments with this name and size that is shared by all clients in this process.
+    """
+    key = "_%s_fragments_%d" % (name, size)
+    if key not in ebs.global_lookups:
+        ebs.global_lookups[key] = functools.lru_cache(maxsize=size)(render)
+    return ebs.global_lookups[key]
+
+
+def _lookup_value(lookup, key):
+    if key == "":
+        return key
+    else:
+        return lookup[key]
+
+
+def _agent_values(agent):
+    lookups = ebs.global_lookups
+    return (_lookup_value(lookups['_agent_lookup'], agent[6]),
+            _lookup_value(lookups['_agents_major_lookup'], agent[5]),
+            _lookup_value(lookups['_agents_os_lookup'], agent[1]),
+            _lookup_value(lookups['_agents_os_major_lookup'], agent[4]),
+            _lookup_value(lookups['_agents_name_lookup'], agent[0]),
+            _lookup_value(lookups['_agents_os_name_lookup'], agent[2]),
+            _lookup_value(lookups['_agents_device_lookup'], agent[3]))
+
+
+def _render_agent_fragment(idx):
+    values = _agent_values(ebs.global_lookups['_agents'][idx])
+    return AGENT_FRAGMENT_TEMPLATE % values, len(values[0])
+
+
+def _render_agent_raw_fragment(idx):
+    return _lookup_value(ebs.global_lookups['_agent_lookup'], ebs.global_lookups['_agents'][idx][6])
+
 
 class Agent:
-    def __init__(self):
-        
+    def __init__(self, rng=random, fragment_cache_size=DEFAULT_FRAGMENT_CACHE_SIZE):
+        self._random = rng
+
         if '_agents' in ebs.global_lookups.keys():
             self._agents = ebs.global_lookups['_agents']
         else:
@@ -43,72 +170,109 @@ class Agent:
         if '_agents_name_lookup' in ebs.global_lookups.keys():
             self._agents_name_lookup = ebs.global_lookups['_agents_name_lookup']
         else:
-            with gzip.open('%s/data/agents_name_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._agents_name_lookup = json.load(data_file)
+            self._agents_name_lookup = datacache.load_lookup('%s/data/agents_name_lookup.json.gz' % cwd)
             ebs.global_lookups['_agents_name_lookup'] = self._agents_name_lookup
 
         if '_agents_os_lookup' in ebs.global_lookups.keys():
             self._agents_os_lookup = ebs.global_lookups['_agents_os_lookup']
         else:
-            with gzip.open('%s/data/agents_os_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._agents_os_lookup = json.load(data_file)
+            self._agents_os_lookup = datacache.load_lookup('%s/data/agents_os_lookup.json.gz' % cwd)
             ebs.global_lookups['_agents_os_lookup'] = self._agents_os_lookup
 
         if '_agents_os_name_lookup' in ebs.global_lookups.keys():
             self._agents_os_name_lookup = ebs.global_lookups['_agents_os_name_lookup']
         else:
-            with gzip.open('%s/data/agents_os_name_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._agents_os_name_lookup = json.load(data_file)
+            self._agents_os_name_lookup = datacache.load_lookup('%s/data/agents_os_name_lookup.json.gz' % cwd)
             ebs.global_lookups['_agents_os_name_lookup'] = self._agents_os_name_lookup
 
         if '_agents_os_major_lookup' in ebs.global_lookups.keys():
             self._agents_os_major_lookup = ebs.global_lookups['_agents_os_major_lookup']
         else:
-            with gzip.open('%s/data/agents_os_major_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._agents_os_major_lookup = json.load(data_file)
+            self._agents_os_major_lookup = datacache.load_lookup('%s/data/agents_os_major_lookup.json.gz' % cwd)
             ebs.global_lookups['_agents_os_major_lookup'] = self._agents_os_major_lookup
 
         if '_agents_major_lookup' in ebs.global_lookups.keys():
             self._agents_major_lookup = ebs.global_lookups['_agents_major_lookup']
         else:
-            with gzip.open('%s/data/agents_major_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._agents_major_lookup = json.load(data_file)
+            self._agents_major_lookup = datacache.load_lookup('%s/data/agents_major_lookup.json.gz' % cwd)
             ebs.global_lookups['_agents_major_lookup'] = self._agents_major_lookup
 
         if '_agents_device_lookup' in ebs.global_lookups.keys():
             self._agents_device_lookup = ebs.global_lookups['_agents_device_lookup']
         else:
-            with gzip.open('%s/data/agents_device_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._agents_device_lookup = json.load(data_file)
+            self._agents_device_lookup = datacache.load_lookup('%s/data/agents_device_lookup.json.gz' % cwd)
             ebs.global_lookups['_agents_device_lookup'] = self._agents_device_lookup
 
         if '_agent_lookup' in ebs.global_lookups.keys():
             self._agent_lookup = ebs.global_lookups['_agent_lookup']
         else:
-            with gzip.open('%s/data/agent_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._agent_lookup = json.load(data_file)
+            self._agent_lookup = datacache.load_lookup('%s/data/agent_lookup.json.gz' % cwd)
             ebs.global_lookups['_agent_lookup'] = self._agent_lookup
 
+        # rendered fragments only depend on the data sets so they are shared by all clients in this process
+        self.fragment_cache = shared_fragment_cache("agent", _render_agent_fragment, fragment_cache_size)
+        self.raw_fragment_cache = shared_fragment_cache("agent_raw", _render_agent_raw_fragment, fragment_cache_size)
+
     def add_fields(self, event):
-        agent = self._agents.get_random()
+        (event['agent'], event['useragent_major'], event['useragent_os'], event['useragent_os_major'],
+         event['useragent_name'], event['useragent_os_name'], event['useragent_device']) = self.fields()
+
+    def fields(self):
+        """
+        :return: A tuple (agent, major, os, os_major, name, os_name, device) for a random user agent.
+        """
+        return _agent_values(self._agents.get_random(self._random))
+
+    def fragment(self):
+        """
+        :return: A tuple (fragment, raw_size) for a random user agent where ``fragment`` is the rendered JSON fragment and
+                 ``raw_size`` the length of the user agent in the raw event.
+        """
+        return self.fragment_cache(self._agents.get_random_index(self._random))
+
+    def raw_fragment(self):
+        """
+        :return: A random user agent as it appears in the raw event.
+        """
+        return self.raw_fragment_cache(self._agents.get_random_index(self._random))
+
+
+def _clientip_data(key):
+    rare, idx = key
+    return ebs.global_lookups['_rare_clientips' if rare else '_clientips'][idx]
+
+
+def _geoip_values(data):
+    lookups = ebs.global_lookups
+    return (_lookup_value(lookups['_clientips_continent_name_lookup'], data[5]),
+            _lookup_value(lookups['_clientips_city_name_lookup'], data[2]),
+            _lookup_value(lookups['_clientips_country_name_lookup'], data[3]),
+            _lookup_value(lookups['_clientips_country_iso_code_lookup'], data[4]),
+            data[1][0],
+            data[1][1],
+            _lookup_value(lookups['_clientips_continent_code_lookup'], data[5]))
+
+
+def _render_clientip_fragment(key):
+    data = _clientip_data(key)
+    values = _geoip_values(data)
+    geoip_fragment = GEOIP_FRAGMENT_TEMPLATE % values[:6]
+    rare, _ = key
+    if rare:
+        # rare client ips are completed randomly so only the geoip part and the ip prefix are cached
+        return geoip_fragment, data[0], values[6]
+    else:
+        return CLIENTIP_FRAGMENT_TEMPLATE % (data[0], data[0]) + geoip_fragment, len(data[0]), values[6]
 
-        event['useragent_name'] = self.__get_lookup_value(self._agents_name_lookup, agent[0])
-        event['useragent_os'] = self.__get_lookup_value(self._agents_os_lookup, agent[1])
-        event['useragent_os_name'] = self.__get_lookup_value(self._agents_os_name_lookup, agent[2])
-        event['useragent_device'] = self.__get_lookup_value(self._agents_device_lookup, agent[3])
-        event['useragent_os_major'] = self.__get_lookup_value(self._agents_os_major_lookup, agent[4])
-        event['useragent_major'] = self.__get_lookup_value(self._agents_major_lookup, agent[5])
-        event['agent'] = self.__get_lookup_value(self._agent_lookup, agent[6])
 
-    def __get_lookup_value(self, lookup, key):
-        if key == "":
-            return key
-        else :
-            return lookup[key]
+def _render_clientip_raw_fragment(key):
+    data = _clientip_data(key)
+    return data[0], _lookup_value(ebs.global_lookups['_clientips_continent_code_lookup'], data[5])
 
 
 class ClientIp:
-    def __init__(self):
+    def __init__(self, rng=random, fragment_cache_size=DEFAULT_FRAGMENT_CACHE_SIZE):
+        self._random = rng
         self._rare_clientip_probability = 0.269736965199
 
         if '_clientips' in ebs.global_lookups.keys():
@@ -126,74 +290,109 @@ class ClientIp:
         if '_clientips_country_name_lookup' in ebs.global_lookups.keys():
             self._clientips_country_name_lookup = ebs.global_lookups['_clientips_country_name_lookup']
         else:
-            with gzip.open('%s/data/clientips_country_name_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._clientips_country_name_lookup = json.load(data_file)
+            self._clientips_country_name_lookup = datacache.load_lookup('%s/data/clientips_country_name_lookup.json.gz' % cwd)
             ebs.global_lookups['_clientips_country_name_lookup'] = self._clientips_country_name_lookup
 
         if '_clientips_country_iso_code_lookup' in ebs.global_lookups.keys():
             self._clientips_country_iso_code_lookup = ebs.global_lookups['_clientips_country_iso_code_lookup']
         else:
-            with gzip.open('%s/data/clientips_country_iso_code_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._clientips_country_iso_code_lookup = json.load(data_file)
+            self._clientips_country_iso_code_lookup = datacache.load_lookup('%s/data/clientips_country_iso_code_lookup.json.gz' % cwd)
             ebs.global_lookups['_clientips_country_iso_code_lookup'] = self._clientips_country_iso_code_lookup
 
         if '_clientips_continent_name_lookup' in ebs.global_lookups.keys():
             self._clientips_continent_name_lookup = ebs.global_lookups['_clientips_continent_name_lookup']
         else:
-            with gzip.open('%s/data/clientips_continent_name_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._clientips_continent_name_lookup = json.load(data_file)
+            self._clientips_continent_name_lookup = datacache.load_lookup('%s/data/clientips_continent_name_lookup.json.gz' % cwd)
             ebs.global_lookups['_clientips_continent_name_lookup'] = self._clientips_continent_name_lookup
 
         if '_clientips_continent_code_lookup' in ebs.global_lookups.keys():
             self._clientips_continent_code_lookup = ebs.global_lookups['_clientips_continent_code_lookup']
         else:
-            with gzip.open('%s/data/clientips_continent_code_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._clientips_continent_code_lookup = json.load(data_file)
+            self._clientips_continent_code_lookup = datacache.load_lookup('%s/data/clientips_continent_code_lookup.json.gz' % cwd)
             ebs.global_lookups['_clientips_continent_code_lookup'] = self._clientips_continent_code_lookup
 
         if '_clientips_city_name_lookup' in ebs.global_lookups.keys():
             self._clientips_city_name_lookup = ebs.global_lookups['_clientips_city_name_lookup']
         else:
-            with gzip.open('%s/data/clientips_city_name_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._clientips_city_name_lookup = json.load(data_file)
+            self._clientips_city_name_lookup = datacache.load_lookup('%s/data/clientips_city_name_lookup.json.gz' % cwd)
             ebs.global_lookups['_clientips_city_name_lookup'] = self._clientips_city_name_lookup
 
+        # rendered fragments only depend on the data sets so they are shared by all clients in this process
+        self.fragment_cache = shared_fragment_cache("clientip", _render_clientip_fragment, fragment_cache_size)
+        self.raw_fragment_cache = shared_fragment_cache("clientip_raw", _render_clientip_raw_fragment, fragment_cache_size)
+
     def add_fields(self, event):
-        p = random.random()
+        (event['clientip'], event['geoip_continent_name'], event['geoip_city_name'], event['geoip_country_name'],
+         event['geoip_country_iso_code'], event['geoip_location_lat'], event['geoip_location_lon'],
+         event['geoip_continent_code']) = self.fields()
+
+    def fields(self):
+        """
+        :return: A tuple (clientip, continent_name, city_name, country_name, country_iso_code, lat, lon, continent_code)
+                 for a random client ip.
+        """
+        p = self._random.random()
         if p < self._rare_clientip_probability:
-            data = self._rare_clientips.get_random()
-            event['clientip'] = self.__fill_out_ip_prefix(data[0])
+            data = self._rare_clientips.get_random(self._random)
+            clientip = self.__fill_out_ip_prefix(data[0])
         else:
-            data = self._clientips.get_random()
-            event['clientip'] = data[0]
+            data = self._clientips.get_random(self._random)
+            clientip = data[0]
 
-        event['geoip_location_lat'] = data[1][0]
-        event['geoip_location_lon'] = data[1][1]
-        event['geoip_city_name'] = self.__get_lookup_value(self._clientips_city_name_lookup, data[2])
-        event['geoip_country_name'] = self.__get_lookup_value(self._clientips_country_name_lookup, data[3])
-        event['geoip_country_iso_code'] = self.__get_lookup_value(self._clientips_country_iso_code_lookup, data[4])
-        event['geoip_continent_name'] = self.__get_lookup_value(self._clientips_continent_name_lookup, data[5])
-        event['geoip_continent_code'] = self.__get_lookup_value(self._clientips_continent_code_lookup, data[5])
+        return (clientip,) + _geoip_values(data)
+
+    def fragment(self):
+        """
+        :return: A tuple (fragment, raw_size, continent_code) for a random client ip where ``fragment`` is the rendered
+                 JSON fragment and ``raw_size`` the length of the client ip in the raw event.
+        """
+        p = self._random.random()
+        if p < self._rare_clientip_probability:
+            geoip_fragment, ip_prefix, continent_code = self.fragment_cache(
+                (True, self._rare_clientips.get_random_index(self._random)))
+            clientip = self.__fill_out_ip_prefix(ip_prefix)
+            return CLIENTIP_FRAGMENT_TEMPLATE % (clientip, clientip) + geoip_fragment, len(clientip), continent_code
+        else:
+            return self.fragment_cache((False, self._clientips.get_random_index(self._random)))
+
+    def raw_fragment(self):
+        """
+        :return: A tuple (clientip, continent_code) for a random client ip.
+        """
+        p = self._random.random()
+        if p < self._rare_clientip_probability:
+            ip_prefix, continent_code = self.raw_fragment_cache((True, self._rare_clientips.get_random_index(self._random)))
+            return self.__fill_out_ip_prefix(ip_prefix), continent_code
+        else:
+            return self.raw_fragment_cache((False, self._clientips.get_random_index(self._random)))
 
     def __fill_out_ip_prefix(self, ip_prefix):
-        rnd1 = random.random()
+        rnd1 = self._random.random()
         v1 = rnd1 * (1 - rnd1) * 255 * 4
         k1 = (int)(v1)
-        rnd2 = random.random()
+        rnd2 = self._random.random()
         v2 = rnd2 * (1 - rnd2) * 255 * 4
         k2 = (int)(v2)
 
         return "{}.{}.{}".format(ip_prefix, k1, k2)
 
-    def __get_lookup_value(self, lookup, key):
-        if key == "":
-            return key
-        else :
-            return lookup[key]
+
+def _referrer_value(data):
+    return "%s%s" % (ebs.global_lookups['_referrers_url_base_lookup'][data[0]], data[1])
+
+
+def _render_referrer_fragment(idx):
+    referrer = _referrer_value(ebs.global_lookups['_referrers'][idx])
+    return REFERRER_FRAGMENT_TEMPLATE % referrer, len(referrer)
+
+
+def _render_referrer_raw_fragment(idx):
+    return _referrer_value(ebs.global_lookups['_referrers'][idx])
 
 
 class Referrer:
-    def __init__(self):
+    def __init__(self, rng=random, fragment_cache_size=DEFAULT_FRAGMENT_CACHE_SIZE):
+        self._random = rng
         if '_referrers' in ebs.global_lookups.keys():
             self._referrers = ebs.global_lookups['_referrers']
         else:
@@ -203,17 +402,55 @@ class Referrer:
         if '_referrers_url_base_lookup' in ebs.global_lookups.keys():
             self._referrers_url_base_lookup = ebs.global_lookups['_referrers_url_base_lookup']
         else:
-            with gzip.open('%s/data/referrers_url_base_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._referrers_url_base_lookup = json.load(data_file)
+            self._referrers_url_base_lookup = datacache.load_lookup('%s/data/referrers_url_base_lookup.json.gz' % cwd)
             ebs.global_lookups['_referrers_url_base_lookup'] = self._referrers_url_base_lookup
 
+        # rendered fragments only depend on the data sets so they are shared by all clients in this process
+        self.fragment_cache = shared_fragment_cache("referrer", _render_referrer_fragment, fragment_cache_size)
+        self.raw_fragment_cache = shared_fragment_cache("referrer_raw", _render_referrer_raw_fragment, fragment_cache_size)
+
     def add_fields(self, event):
-        data = self._referrers.get_random()
-        event['referrer'] = "%s%s" % (self._referrers_url_base_lookup[data[0]], data[1])
+        event['referrer'] = self.fields()
+
+    def fields(self):
+        """
+        :return: A random referrer.
+        """
+        return _referrer_value(self._referrers.get_random(self._random))
+
+    def fragment(self):
+        """
+        :return: A tuple (fragment, raw_size) for a random referrer where ``fragment`` is the rendered JSON fragment and
+                 ``raw_size`` the length of the referrer in the raw event.
+        """
+        return self.fragment_cache(self._referrers.get_random_index(self._random))
+
+    def raw_fragment(self):
+        """
+        :return: A random referrer as it appears in the raw event.
+        """
+        return self.raw_fragment_cache(self._referrers.get_random_index(self._random))
+
+
+def _request_values(data):
+    return "{}{}".format(ebs.global_lookups['_requests_url_base_lookup'][data[0]], data[1]), data[2], data[3], data[4], \
+           data[5]
+
+
+def _render_request_fragment(idx):
+    values = _request_values(ebs.global_lookups['_requests'][idx])
+    return REQUEST_FRAGMENT_TEMPLATE % values, sum(len(str(value)) for value in values)
+
+
+def _render_request_raw_fragment(idx):
+    request, size, verb, response, httpversion = values = _request_values(ebs.global_lookups['_requests'][idx])
+    return (RAW_REQUEST_FRAGMENT_TEMPLATE % (verb, request, httpversion, response, size),
+            sum(len(str(value)) for value in values))
 
 
 class Request:
-    def __init__(self):
+    def __init__(self, rng=random, fragment_cache_size=DEFAULT_FRAGMENT_CACHE_SIZE):
+        self._random = rng
         if '_requests' in ebs.global_lookups.keys():
             self._requests = ebs.global_lookups['_requests']
         else:
@@ -223,17 +460,35 @@ class Request:
         if '_requests_url_base_lookup' in ebs.global_lookups.keys():
             self._requests_url_base_lookup = ebs.global_lookups['_requests_url_base_lookup']
         else:
-            with gzip.open('%s/data/requests_url_base_lookup.json.gz' % cwd, 'rt') as data_file:
-                self._requests_url_base_lookup = json.load(data_file)
+            self._requests_url_base_lookup = datacache.load_lookup('%s/data/requests_url_base_lookup.json.gz' % cwd)
             ebs.global_lookups['_requests_url_base_lookup'] = self._requests_url_base_lookup
 
+        # rendered fragments only depend on the data sets so they are shared by all clients in this process
+        self.fragment_cache = shared_fragment_cache("request", _render_request_fragment, fragment_cache_size)
+        self.raw_fragment_cache = shared_fragment_cache("request_raw", _render_request_raw_fragment, fragment_cache_size)
+
     def add_fields(self, event):
-        data = self._requests.get_random()
-        event['request'] = "{}{}".format(self._requests_url_base_lookup[data[0]], data[1])
-        event['bytes'] = data[2]
-        event['verb'] = data[3]
-        event['response'] = data[4]
-        event['httpversion'] = data[5]
+        event['request'], event['bytes'], event['verb'], event['response'], event['httpversion'] = self.fields()
+
+    def fields(self):
+        """
+        :return: A tuple (request, bytes, verb, response, httpversion) for a random request.
+        """
+        return _request_values(self._requests.get_random(self._random))
+
+    def fragment(self):
+        """
+        :return: A tuple (fragment, raw_size) for a random request where ``fragment`` is the rendered JSON fragment and
+                 ``raw_size`` the total length of request, bytes, verb, response and httpversion in the raw event.
+        """
+        return self.fragment_cache(self._requests.get_random_index(self._random))
+
+    def raw_fragment(self):
+        """
+        :return: A tuple (fragment, raw_size) for a random request where ``fragment`` is the request part of the raw event
+                 (see ``RAW_REQUEST_FRAGMENT_TEMPLATE``) and ``raw_size`` is calculated as for ``#fragment()``.
+        """
+        return self.raw_fragment_cache(self._requests.get_random_index(self._random))
 
 
 def convert_to_bytes(size):
@@ -256,12 +511,18 @@ def convert_to_bytes(size):
         raise ValueError("Invalid byte size value [{}]".format(size))
 
 
+
 class RandomEvent:
     def __init__(self, params, agent=Agent, client_ip=ClientIp, referrer=Referrer, request=Request):
-        self._agent = agent()
-        self._clientip = client_ip()
-        self._referrer = referrer()
-        self._request = request()
+        self._random = randomstream.partition_random(params.get("seed"), params.get("client_id"), "event")
+        fragment_cache_size = int(params.get("fragment_cache_size", DEFAULT_FRAGMENT_CACHE_SIZE))
+        self._agent = agent(self._random, fragment_cache_size)
+        self._clientip = client_ip(self._random, fragment_cache_size)
+        self._referrer = referrer(self._random, fragment_cache_size)
+        self._request = request(self._random, fragment_cache_size)
+        self._bulks = 0
+        # an event that did not fit into the previous byte-limited bulk; it is emitted first in the next bulk
+        self._overflow_event = None
         # We will reuse the event dictionary. This assumes that each field will be present (and thus overwritten) in each event.
         # This reduces object churn and improves peak indexing throughput.
         self._event = {}
@@ -295,7 +556,30 @@ class RandomEvent:
         self.current_logging_volume = 0
         self.total_days = params.get("number_of_days")
         self.remaining_days = self.total_days
+        self._volume_budget = None
+        if self.daily_logging_volume and "client_id" in params and \
+                str(params.get("shared_daily_volume", False)).lower() == "true":
+            if volumebudget.is_supported():
+                key = (params.get("index"), params["daily_logging_volume"], self.total_days, params.get("starting_point"),
+                       params.get("offset"))
+                self._volume_budget = volumebudget.SharedVolumeBudget(key, int(params["client_id"]),
+                                                                      int(params["client_count"]),
+                                                                      convert_to_bytes(params["daily_logging_volume"]),
+                                                                      # this is only expected to be used in tests
+                                                                      params.get("__volume_budget_dir"))
+            else:
+                logger.warning("A shared daily logging volume is not supported on this platform. Each client accounts "
+                               "for its share of the daily logging volume independently.")
+        # the current (zero-based) day and the remaining bytes leased from the shared daily volume budget
+        self._day = 0
+        self._leased_volume = 0
         self.record_raw_event_size = params.get("record_raw_event_size", False)
+        # only emit the raw event as `message` instead of pre-parsed fields
+        self.raw_message = str(params.get("raw_message", False)).lower() == "true"
+        self._timestamp_spread_millis = int(params.get("timestamp_spread_millis", 0))
+        if not 0 <= self._timestamp_spread_millis <= 1000:
+            raise ValueError("The value [{}] is invalid for the parameter [timestamp_spread_millis]".format(
+                self._timestamp_spread_millis))
         self._offset = 0
         self._web_host = itertools.cycle([1, 2, 3])
         self._timestruct = None
@@ -317,6 +601,17 @@ class RandomEvent:
         self._timestruct = self._timestamp_generator.next_timestamp()
         self._index_name = self.__generate_index_pattern(self._timestruct)
 
+    def next_bulk_timestamp(self):
+        """
+        Advances time for a new bulk request without generating any events. This is intended for callers that replay
+        previously generated events with updated timestamps.
+
+        :return: A tuple (iso_prefix, index) with the current timestamp up to seconds and the corresponding index name.
+        """
+        self._timestruct = self._timestamp_generator.next_timestamp()
+        self._index_name = self.__generate_index_pattern(self._timestruct)
+        return self._timestruct["iso_prefix"], self._index_name
+
     def generate_event(self):
         if self.remaining_days == 0:
             raise StopIteration()
@@ -340,41 +635,30 @@ class RandomEvent:
 
         if self.record_raw_event_size or self.daily_logging_volume:
             # determine the raw event size (as if this were contained in nginx log file). We do not bother to
-            # reformat the timestamp as this is not worth the overhead.
-            raw_event = '%s - - [%s] "%s %s HTTP/%s" %s %s "%s" "%s"' % (event["clientip"], event["@timestamp"],
-                                                                         event["verb"], event["request"],
-                                                                         event["httpversion"], event["response"],
-                                                                         event["bytes"], event["referrer"],
-                                                                         event["agent"])
+            # reformat the timestamp as this is not worth the overhead. Like in ``#generate_bulk()``, this is
+            # equivalent to len(RAW_EVENT_TEMPLATE % (...)) but without rendering the raw event.
+            raw_event_size = RAW_EVENT_OVERHEAD + len(event["@timestamp"]) + len(event["clientip"]) + \
+                len(str(event["verb"])) + len(event["request"]) + len(str(event["httpversion"])) + \
+                len(str(event["response"])) + len(str(event["bytes"])) + len(event["referrer"]) + len(event["agent"])
             if self.daily_logging_volume:
-                self.current_logging_volume += len(raw_event)
-                if self.current_logging_volume > self.daily_logging_volume:
-                    if self.remaining_days is not None:
-                        self.remaining_days -= 1
-                    self._timestamp_generator.skip(datetime.timedelta(days=1))
-                    # advance time now for real (we usually use #simulate_tick() which will keep everything except for
-                    # microseconds constant.
-                    self._timestruct = self._timestamp_generator.next_timestamp()
-                    self._index_name = self.__generate_index_pattern(self._timestruct)
-                    self.current_logging_volume = 0
-
-        if self.record_raw_event_size:
+                self.__account_logging_volume(raw_event_size)
+
+        if self.raw_message:
+            raw_values = (event["clientip"], http_date(event["@timestamp"][:19]), event["verb"], event["request"],
+                          event["httpversion"], event["response"], event["bytes"], event["referrer"], event["agent"])
+            if self.record_raw_event_size:
+                line = RAW_MESSAGE_EVENT_WITH_RAW_SIZE_TEMPLATE % \
+                       ((event["@timestamp"], raw_event_size, event["offset"], event["hostname"], event["hostname"]) +
+                        raw_values)
+            else:
+                line = RAW_MESSAGE_EVENT_TEMPLATE % \
+                       ((event["@timestamp"], event["offset"], event["hostname"], event["hostname"]) + raw_values)
+        elif self.record_raw_event_size:
             # we are on the hot code path here and thus we want to avoid conditionally creating strings so we duplicate
             # the event.
-            line = '{"@timestamp": "%s", ' \
-                   '"_raw_event_size":%d, ' \
-                   '"offset":%s, ' \
-                   '"source":"/usr/local/var/log/nginx/access.log","fileset":{"module":"nginx","name":"access"},"input":{"type":"log"},' \
-                   '"beat":{"version":"6.3.0","hostname":"%s","name":"%s"},' \
-                   '"prospector":{"type":"log"},' \
-                   '"nginx":{"access":{"user_name": "-",' \
-                   '"agent":"%s","user_agent": {"major": "%s","os": "%s","os_major": "%s","name": "%s","os_name": "%s","device": "%s"},' \
-                   '"remote_ip": "%s","remote_ip_list":["%s"],' \
-                   '"geoip":{"continent_name": "%s","city_name": "%s","country_name": "%s","country_iso_code": "%s","location":{"lat": %s,"lon": %s} },' \
-                   '"referrer":"%s",' \
-                   '"url": "%s","body_sent":{"bytes": %s},"method":"%s","response_code":%s,"http_version":"%s"} } }' % \
+            line = EVENT_WITH_RAW_SIZE_TEMPLATE % \
                    (event["@timestamp"],
-                    len(raw_event),
+                    raw_event_size,
                     event["offset"],
                     event["hostname"],event["hostname"],
                     event["agent"], event["useragent_major"], event["useragent_os"], event["useragent_os_major"], event["useragent_name"], event["useragent_os_name"], event["useragent_device"],
@@ -383,17 +667,7 @@ class RandomEvent:
                     event["referrer"],
                     event["request"], event["bytes"], event["verb"], event["response"], event["httpversion"])
         else:
-            line = '{"@timestamp": "%s", ' \
-                   '"offset":%s, ' \
-                   '"source":"/usr/local/var/log/nginx/access.log","fileset":{"module":"nginx","name":"access"},"input":{"type":"log"},' \
-                   '"beat":{"version":"6.3.0","hostname":"%s","name":"%s"},' \
-                   '"prospector":{"type":"log"},' \
-                   '"nginx":{"access":{"user_name": "-",' \
-                   '"agent":"%s","user_agent": {"major": "%s","os": "%s","os_major": "%s","name": "%s","os_name": "%s","device": "%s"},' \
-                   '"remote_ip": "%s","remote_ip_list":["%s"],' \
-                   '"geoip":{"continent_name": "%s","city_name": "%s","country_name": "%s","country_iso_code": "%s","location":{"lat": %s,"lon": %s} },' \
-                   '"referrer":"%s",' \
-                   '"url": "%s","body_sent":{"bytes": %s},"method":"%s","response_code":%s,"http_version":"%s"} } }' % \
+            line = EVENT_TEMPLATE % \
                    (event["@timestamp"],
                     event["offset"],
                     event["hostname"],event["hostname"],
@@ -405,6 +679,166 @@ class RandomEvent:
 
         return line, index, self._type
 
+    def generate_bulk(self, bulk_size, max_bytes=None, line_overhead=0):
+        """
+        Generates all events for one bulk request. This produces the same events as calling ``#start_bulk()`` followed
+        by ``bulk_size`` calls to ``#generate_event()`` but avoids the intermediate event dictionary and most of the
+        per-event attribute lookups. Events are assembled from pre-rendered fragments (see ``DEFAULT_FRAGMENT_CACHE_SIZE``)
+        and all timestamps of the bulk are generated at once. Unlike ``#generate_event()``, this supports spreading the
+        timestamps of a bulk across a configurable number of milliseconds (``timestamp_spread_millis``).
+
+        :param bulk_size: The number of events to generate.
+        :param max_bytes: If set, stop generating events before their total size exceeds this number of bytes. The size
+                          of an event is the length of its line plus the length of its index name plus ``line_overhead``.
+                          An event that does not fit is kept for the next bulk. A bulk always contains at least one event.
+        :param line_overhead: The size that the caller adds to each event (e.g. for the action-and-metadata line).
+        :return: A list of tuples (event, index, type). It contains fewer than ``bulk_size`` items if the generator is
+                 exhausted within the bulk.
+        """
+        overflow_event = self._overflow_event
+        self._overflow_event = None
+        if self.remaining_days == 0 and overflow_event is None:
+            raise StopIteration()
+        self.start_bulk(bulk_size)
+        timestamps = self._timestamp_generator.current_timestamps(bulk_size, self._timestamp_spread_millis)
+        # position within `timestamps`; restarts when we cross a date boundary
+        position = 0
+        total_bytes = 0
+
+        events = []
+        append = events.append
+        if overflow_event is not None:
+            line, index, event_bytes = overflow_event
+            append((line, index, self._type))
+            total_bytes += event_bytes
+            bulk_size -= 1
+        agent_fragment = self._agent.fragment
+        clientip_fragment = self._clientip.fragment
+        referrer_fragment = self._referrer.fragment
+        request_fragment = self._request.fragment
+        web_host = self._web_host
+        doc_type = self._type
+        raw_event_size_needed = self.record_raw_event_size or self.daily_logging_volume
+        # assume a typical event size of 263 bytes but limit the file size to 4GB
+        offset = (self._offset + 263) % (4 * 1024 * 1024 * 1024)
+        raw_message = self.raw_message
+        if raw_message:
+            agent_fragment = self._agent.raw_fragment
+            clientip_fragment = self._clientip.raw_fragment
+            referrer_fragment = self._referrer.raw_fragment
+            request_fragment = self._request.raw_fragment
+            if self.record_raw_event_size:
+                template = RAW_MESSAGE_WITH_RAW_SIZE_HEADER_TEMPLATE + RAW_MESSAGE_FRAGMENTS_TEMPLATE
+            else:
+                template = RAW_MESSAGE_HEADER_TEMPLATE + RAW_MESSAGE_FRAGMENTS_TEMPLATE
+        elif self.record_raw_event_size:
+            template = EVENT_WITH_RAW_SIZE_HEADER_TEMPLATE + "%s%s%s%s"
+        else:
+            template = EVENT_HEADER_TEMPLATE + "%s%s%s%s"
+
+        for _ in range(bulk_size):
+            if self.remaining_days == 0:
+                break
+            ts = timestamps[position]
+            position += 1
+            # index for the current line - we may cross a date boundary later if we're above the daily logging volume
+            index = self._index_name
+            if raw_message:
+                a_fragment = agent_fragment()
+                c_fragment, continent_code = clientip_fragment()
+                r_fragment = referrer_fragment()
+                q_fragment, request_size = request_fragment()
+                agent_size, clientip_size, referrer_size = len(a_fragment), len(c_fragment), len(r_fragment)
+            else:
+                a_fragment, agent_size = agent_fragment()
+                c_fragment, clientip_size, continent_code = clientip_fragment()
+                r_fragment, referrer_size = referrer_fragment()
+                q_fragment, request_size = request_fragment()
+            hostname = "web-%s-%s.elastic.co" % (continent_code, next(web_host))
+
+            if raw_event_size_needed:
+                # equivalent to len(RAW_EVENT_TEMPLATE % (...)) but without rendering the raw event
+                raw_event_size = RAW_EVENT_OVERHEAD + len(ts) + clientip_size + request_size + referrer_size + agent_size
+                if self.daily_logging_volume and self.__account_logging_volume(raw_event_size):
+                    timestamps = self._timestamp_generator.current_timestamps(bulk_size, self._timestamp_spread_millis)
+                    position = 0
+
+            if raw_message:
+                if self.record_raw_event_size:
+                    line = template % (ts, raw_event_size, offset, hostname, hostname,
+                                       c_fragment, http_date(ts[:19]), q_fragment, r_fragment, a_fragment)
+                else:
+                    line = template % (ts, offset, hostname, hostname,
+                                       c_fragment, http_date(ts[:19]), q_fragment, r_fragment, a_fragment)
+            elif self.record_raw_event_size:
+                line = template % (ts, raw_event_size, offset, hostname, hostname,
+                                   a_fragment, c_fragment, r_fragment, q_fragment)
+            else:
+                line = template % (ts, offset, hostname, hostname, a_fragment, c_fragment, r_fragment, q_fragment)
+            if max_bytes is not None:
+                event_bytes = len(line) + len(index) + line_overhead
+                if events and total_bytes + event_bytes > max_bytes:
+                    self._overflow_event = (line, index, event_bytes)
+                    break
+                total_bytes += event_bytes
+            append((line, index, doc_type))
+
+        self._bulks += 1
+        if self._bulks % 1000 == 0:
+            logger.info("Fragment cache hit rates after [%d] bulks: %s", self._bulks, self.__fragment_cache_hit_rates())
+        return events
+
+    @property
+    def fragment_cache_stats(self):
+        """
+        :return: A dict with the statistics (hits, misses, maxsize, currsize) of each fragment cache.
+        """
+        return {
+            "agent": self._agent.fragment_cache.cache_info(),
+            "clientip": self._clientip.fragment_cache.cache_info(),
+            "referrer": self._referrer.fragment_cache.cache_info(),
+            "request": self._request.fragment_cache.cache_info()
+        }
+
+    def __fragment_cache_hit_rates(self):
+        hit_rates = []
+        for name, stats in self.fragment_cache_stats.items():
+            lookups = stats.hits + stats.misses
+            hit_rates.append("{}: {:.1%}".format(name, stats.hits / lookups if lookups else 0.0))
+        return ", ".join(hit_rates)
+
+    def __account_logging_volume(self, raw_event_size):
+        if self._volume_budget:
+            return self.__account_shared_logging_volume(raw_event_size)
+        self.current_logging_volume += raw_event_size
+        if self.current_logging_volume > self.daily_logging_volume:
+            self.__skip_days(1)
+            self.current_logging_volume = 0
+            return True
+        return False
+
+    def __account_shared_logging_volume(self, raw_event_size):
+        self._leased_volume -= raw_event_size
+        if self._leased_volume > 0:
+            return False
+        day, leased, self.current_logging_volume, self.daily_logging_volume = self._volume_budget.lease()
+        # carry over what we have used in excess of the previous lease
+        self._leased_volume += leased
+        if day > self._day:
+            self.__skip_days(day - self._day)
+            self._day = day
+            return True
+        return False
+
+    def __skip_days(self, days):
+        if self.remaining_days is not None:
+            self.remaining_days = max(self.remaining_days - days, 0)
+        self._timestamp_generator.skip(datetime.timedelta(days=days))
+        # advance time now for real (we usually use #simulate_tick() which will keep everything except for
+        # microseconds constant.
+        self._timestruct = self._timestamp_generator.next_timestamp()
+        self._index_name = self.__generate_index_pattern(self._timestruct)
+
     def __generate_index_pattern(self, timestruct):
         if self._index_pattern:
             return self._index.format(ts=timestruct)
@@ -0,0 +1,37 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import random
+
+
+def partition_random(seed, partition_index, stream):
+    """
+    Creates an independent random number generator for one partition (i.e. client) of a parameter source.
+
+    Each client owns its generator, so clients that run in the same process do not perturb each other and a run is
+    reproducible regardless of the number of clients.
+
+    :param seed: The user-provided seed or ``None``. If ``None``, the generator is seeded from the operating system.
+    :param partition_index: The index of the partition or ``None`` if the parameter source is not partitioned.
+    :param stream: A name for the purpose of this generator. Generators with the same seed and partition but a different
+                   stream name produce independent sequences.
+    :return: A ``random.Random`` instance.
+    """
+    if seed is None:
+        return random.Random()
+    # strings are hashed with SHA-512 by ``random.seed`` which results in a stable seed across Python processes
+    return random.Random("{}/{}/{}".format(seed, partition_index, stream))
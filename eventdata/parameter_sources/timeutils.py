@@ -21,6 +21,9 @@ import re
 
 epoch = datetime.datetime.utcfromtimestamp(0)
 
+# maximum number of millisecond suffix tables that TimestampStructGenerator keeps for different bulk sizes
+MAX_SUFFIX_TABLES = 16
+
 
 class TimeParsingError(Exception):
     """Exception raised for parameter parsing errors.
@@ -43,13 +46,65 @@ class TimestampStructGenerator:
         # reuse to reduce object churn
         self._ts = {}
         self._simulated_micros = 0.0
+        # the second for which `_ts` has been formatted last
+        self._current_second = None
+        # (count, spread_millis) -> millisecond suffixes for `#bulk_timestamps()`
+        self._suffixes = {}
 
     def next_timestamp(self):
         self._simulated_micros = 0.0
         delta = (self._utcnow() - self._start) * self._acceleration_factor
-        self.__to_struct(self._starting_point + delta)
+        dt = self._starting_point + delta
+        second = dt.replace(microsecond=0)
+        if second != self._current_second:
+            self.__to_struct(dt)
+            self._current_second = second
         return self.simulate_tick(0)
 
+    def bulk_timestamps(self, count, spread_millis=0):
+        """
+
+        Advances to the current timestamp (like ``#next_timestamp()``) and returns the timestamps for all events of a
+        bulk. This is equivalent to calling ``#simulate_tick(1 / count)`` ``count`` times but formats the timestamp
+        prefix only once per second and takes the millisecond suffixes from a precomputed table.
+
+        :param count: The number of events in the bulk.
+        :param spread_millis: If positive, timestamps are spread evenly across this many milliseconds (at most 1000).
+        :return: A list of ``count`` ISO 8601 formatted timestamps.
+        """
+        self.next_timestamp()
+        return self.current_timestamps(count, spread_millis)
+
+    def current_timestamps(self, count, spread_millis=0):
+        """
+
+        :return: A list of ``count`` ISO 8601 formatted timestamps for the current second without advancing it (see
+                 ``#bulk_timestamps()``).
+        """
+        key = (count, spread_millis)
+        suffixes = self._suffixes.get(key)
+        if suffixes is None:
+            if len(self._suffixes) >= MAX_SUFFIX_TABLES:
+                # bulk sizes vary (e.g. with adaptive bulk sizing); don't let the tables pile up
+                self._suffixes.clear()
+            suffixes = self.__suffixes(count, spread_millis)
+            self._suffixes[key] = suffixes
+        iso_prefix = self._ts["iso_prefix"]
+        return [iso_prefix + suffix for suffix in suffixes]
+
+    def __suffixes(self, count, spread_millis):
+        if spread_millis > 0:
+            spread_millis = min(spread_millis, 1000)
+            return tuple(".%03dZ" % (i * spread_millis // count) for i in range(count))
+        else:
+            # mimic repeated calls to #simulate_tick(1 / count) including float rounding
+            suffixes = []
+            micros = 0.0
+            for _ in range(count):
+                micros += 1 / count
+                suffixes.append(".%03dZ" % micros)
+            return tuple(suffixes)
+
     def simulate_tick(self, micros):
         """
 
@@ -68,6 +123,7 @@ class TimestampStructGenerator:
         self._starting_point = self._starting_point + delta
         # also reset the generator start as we want to ensure the same delta in #next_timestamp()
         self._start = self._utcnow()
+        self._current_second = None
 
     def __to_struct(self, dt):
         # string formatting is about 4 times faster than strftime.
@@ -0,0 +1,125 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+"""
+A daily logging volume budget that is shared by all bulk indexing clients on a load driver.
+
+The state lives in a small memory-mapped file in the temp directory that is protected by an advisory file lock:
+
+* The budget per simulated day, i.e. the shares (``daily_logging_volume / client_count``) of all clients. It is set
+  in full when the first client registers, so a client that starts early cannot move on to the next day with the
+  budget of the clients that have registered so far. As the state is local to a machine, all clients need to run on
+  the same load driver.
+* The current simulated day and the number of bytes that have been consumed in it.
+* A bitmap of registered client ids. A client that finds its own id registered already belongs to a new benchmark and
+  resets the state left behind by the previous one.
+
+Clients do not take the lock for every event but lease a small part of the budget at a time. When the budget of the
+current day is spent, the next lease moves all clients to the next day at once.
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("track.eventdata")
+
+MAGIC = b"EDVB"
+FORMAT_VERSION = 1
+# magic, format version, budget per day, current day, consumed bytes in the current day
+HEADER = struct.Struct("<4sIqqq")
+# share of a client's daily budget that it leases at once
+LEASES_PER_DAY = 100
+
+
+def is_supported():
+    return fcntl is not None
+
+
+def budget_file_name(key, client_count, budget_dir=None):
+    digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(budget_dir or tempfile.gettempdir(), "eventdata-volume-{}-{}.bin".format(client_count, digest))
+
+
+class SharedVolumeBudget:
+    def __init__(self, key, client_id, client_count, daily_volume, budget_dir=None):
+        """
+        Registers a client with the budget shared by all clients with the same ``key`` on this machine.
+
+        :param key: Identifies the benchmark (e.g. the index name and the volume parameters).
+        :param client_id: The id of this client in range [0, ``client_count``).
+        :param client_count: The total number of clients.
+        :param daily_volume: The daily logging volume in bytes of all clients (i.e. across all load drivers).
+        :param budget_dir: The directory of the shared state. Defaults to the temp directory.
+        """
+        share = daily_volume // client_count
+        budget = share * client_count
+        self.lease_size = max(share // LEASES_PER_DAY, 1)
+        self._path = budget_file_name(key, client_count, budget_dir)
+        self._size = HEADER.size + (client_count + 7) // 8
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size != self._size:
+                os.ftruncate(fd, self._size)
+            self._mm = mmap.mmap(fd, self._size)
+            magic, version, _, day, consumed = HEADER.unpack_from(self._mm, 0)
+            byte, bit = HEADER.size + client_id // 8, 1 << (client_id % 8)
+            if magic != MAGIC or version != FORMAT_VERSION or self._mm[byte] & bit:
+                # left over from a previous benchmark (or a new file)
+                self._mm[:] = bytes(self._size)
+                day, consumed = 0, 0
+            self._mm[byte] |= bit
+            HEADER.pack_into(self._mm, 0, MAGIC, FORMAT_VERSION, budget, day, consumed)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def lease(self):
+        """
+        Leases a part of the budget of the current day. If the budget of the current day is spent, this advances the
+        current day for all clients.
+
+        :return: A tuple (day, leased, consumed, budget) with the (zero-based) day the lease belongs to, the number of
+                 leased bytes, the bytes consumed in that day by all clients including this lease and the budget per day.
+        """
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            _, _, budget, day, consumed = HEADER.unpack_from(self._mm, 0)
+            if consumed >= budget:
+                day += 1
+                consumed = 0
+            leased = min(self.lease_size, budget - consumed)
+            consumed += leased
+            HEADER.pack_into(self._mm, 0, MAGIC, FORMAT_VERSION, budget, day, consumed)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return day, leased, consumed, budget
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
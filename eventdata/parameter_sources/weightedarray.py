@@ -16,107 +16,87 @@
 # under the License.
 
 
-import json
+import array
 import random
-import gzip
-import sys
-import itertools
-import bisect
 
+from eventdata.parameter_sources import datacache
 
-class WeightedArray:
-    # These data sets have a very long tail and we apply a staged approach to  save memory.
-    # If we'd just generate one large array, the array length would be in the tens of
-    # millions for some of the arrays resulting in an unacceptable memory usage per client.
-    #
-    # Based on experiments with the current data sets, we settled that one list represents the top 99
-    # percent of all items and the other one represents the long tail with the last percent. These
-    # values provide an acceptable tradeoff for memory usage.
-    CUTOFF_FREQUENCY = 100
-    # defines the percentage of values that represents the "bottom" part.
-    CUTOFF_PERCENT = 1 / CUTOFF_FREQUENCY
-
-    def __init__(self, json_file):
-        with gzip.open(json_file, 'rt') as data_file:
-            item_list = json.load(data_file)
-
-        # 1. Calculate a histogram of all weights.
-        h = self.histogram(item_list)
-
-        # 2. Calculate the weight that represents the last percent based on the histogram ...
-        bottom_percent_weight = self.weight_of_bottom_percent(h, percent=WeightedArray.CUTOFF_PERCENT)
 
-        # 3. ... so we can partition the items into the bottom and top parts.
-        #
-        # This implementation results in a peak memory usage of one client between 200 and 300 MB.
-        self._top_choices = self.create_items(item_list, min_weight=bottom_percent_weight)
-        self._bottom_choices = self.create_items(item_list, max_weight=bottom_percent_weight)
-
-        self._counter = 0
-        # we increment before accessing the elements
-        self._bottom_idx = -1
-        self._top_idx = -1
+class WeightedArray:
+    """
+    Draws weighted random samples from a data set using Walker's alias method (in the variant described by Vose).
+
+    The data sets have a very long tail. Instead of materializing a list of choices where each item occurs in proportion
+    to its weight (which required tens of millions of entries for some data sets), we store one probability and one alias
+    index per distinct item. This keeps memory usage linear in the number of distinct items and still allows to draw a
+    sample in constant time.
+    """
+    def __init__(self, json_file, cache_dir=None):
+        # the alias table is built only if the data set is not available in the data cache yet
+        self._choices, self._probabilities, self._aliases = datacache.load_weighted(json_file,
+                                                                                    self.create_alias_table,
+                                                                                    cache_dir=cache_dir)
         # Not calculating the length over and over on the hot code path gives us a little bit higher peak throughput
-        self._bottom_len = len(self._bottom_choices)
-        self._top_len = len(self._top_choices)
+        self._len = len(self._choices)
 
-    def weight_of_bottom_percent(self, histogram, percent):
+    def create_alias_table(self, weights):
         """
-        Determines the corresponding weight that represents at most the provided number of percent of all elements.
+        Creates the alias table for the provided weights.
 
-        :param histogram: A histogram of all elements.
-        :param percent: A float representing the maximum number of elements that should be covered. 1.00 is 100% percent.
+        :param weights: A list of (positive) weights.
+        :return: A tuple (probabilities, aliases). ``probabilities[i]`` is the probability to pick the ``i``-th item when
+                 its column has been chosen and ``aliases[i]`` is the index of the item to pick otherwise.
         """
-        total = 0
-        for weight, frequency in histogram.items():
-            total += weight * frequency
-
-        running_total = 0
-        for weight, frequency in histogram.items():
-            running_total += weight * frequency
-            if running_total > percent * total:
-                return weight
-
-    def histogram(self, item_list):
+        n = len(weights)
+        total = sum(weights)
+        probabilities = array.array("d", [1.0] * n)
+        aliases = array.array("I", range(n))
+
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            probabilities[s] = scaled[s]
+            aliases[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # Any remaining items are (up to rounding errors) exactly at probability 1.0 which is the default already.
+        return probabilities, aliases
+
+    def get_random(self, rng=random):
         """
-        Creates a histogram of the provided items.
-
-        :param item_list: A list of tuples (weight, data).
+        :param rng: The random number generator to draw from. Defaults to the global generator of the ``random`` module.
+        :return: A randomly chosen item.
         """
-        h = {}
-        for w, _ in item_list:
-            if w not in h:
-                h[w] = 0
-            h[w] += 1
-        return h
-
-    def create_items(self, item_list, min_weight=None, max_weight=None):
-        choices = []
-        weights = []
-        low = sys.maxsize
+        # a single random number decides both the column and whether we pick the item itself or its alias
+        r = rng.random() * self._len
+        idx = int(r)
+        if r - idx < self._probabilities[idx]:
+            return self._choices[idx]
+        else:
+            return self._choices[self._aliases[idx]]
 
-        for w, c in item_list:
-            if (min_weight and w > min_weight) or (max_weight and w <= max_weight):
-                low = low if low < w else w
-                weights.append(w)
-                choices.append(c)
+    def get_random_index(self, rng=random):
+        """
+        :param rng: The random number generator to draw from. Defaults to the global generator of the ``random`` module.
+        :return: The index of a randomly chosen item. It draws the same item as ``#get_random()`` given the same state of
+                 ``rng``.
+        """
+        r = rng.random() * self._len
+        idx = int(r)
+        if r - idx < self._probabilities[idx]:
+            return idx
+        else:
+            return self._aliases[idx]
 
-        cumdist = list(itertools.accumulate(weights))
-        # choose the size of the resulting array so that the item with the lowest frequency still has a chance to appear (once).
-        total = cumdist[-1]
-        size = total // low
-        # pre-generate the randomly distributed weighted choices as we want to avoid any expensive operations
-        # on the fast-path (i.e. in #get_random()).
-        #
-        return [choices[bisect.bisect(cumdist, random.random() * total)] for _ in range(size)]
+    def __getitem__(self, idx):
+        return self._choices[idx]
 
-    def get_random(self):
-        self._counter += 1
-        if self._counter < WeightedArray.CUTOFF_FREQUENCY:
-            self._top_idx = (self._top_idx + 1) % self._top_len
-            return self._top_choices[self._top_idx]
-        else:
-            # Don't let this counter ever overflow. We're just interested in small counts anyway.
-            self._counter = 0
-            self._bottom_idx = (self._bottom_idx + 1) % self._bottom_len
-            return self._bottom_choices[self._bottom_idx]
+    def __len__(self):
+        return self._len
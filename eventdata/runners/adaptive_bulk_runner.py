@@ -0,0 +1,55 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from eventdata.utils import globals as gs
+
+
+async def adaptive_bulk(es, params):
+    """
+    Runs a bulk request and reports the service time of Elasticsearch (``took``) back to the parameter source so it
+    can adapt the size of subsequent bulk requests (see ``ElasticlogsBulkSource``).
+
+    It expects the parameter hash to contain the following keys:
+        "body"          - The bulk request body.
+        "bulk-size"     - The number of documents in the bulk request.
+        "feedback-key"  - Key under which the service time is reported to the parameter source.
+        "pipeline"      - Name of an ingest pipeline (optional).
+    """
+    bulk_params = {}
+    if "pipeline" in params:
+        bulk_params["pipeline"] = params["pipeline"]
+    response = await es.bulk(body=params["body"], params=bulk_params)
+    took = response["took"]
+    gs.global_bulk_took[params["feedback-key"]] = took
+
+    error_count = 0
+    if response["errors"]:
+        for item in response["items"]:
+            for details in item.values():
+                if details.get("status", 200) > 299:
+                    error_count += 1
+
+    bulk_size = params["bulk-size"]
+    return {
+        "weight": bulk_size,
+        "unit": "docs",
+        "bulk-size": bulk_size,
+        "took": took,
+        "success": error_count == 0,
+        "success-count": bulk_size - error_count,
+        "error-count": error_count
+    }
@@ -47,7 +47,8 @@ async def kibana(es, params):
     Simulates Kibana msearch dashboard queries.
 
     It expects the parameter hash to contain the following keys:
-        "body"      - msearch request body representing the Kibana dashboard in the  form of an array of dicts.
+        "body"      - msearch request body representing the Kibana dashboard either in the form of an array of dicts or as
+                      NDJSON encoded ``bytes``.
         "params"    - msearch request parameters.
         "meta_data" - Dictionary containing meta data information to be carried through into metrics.
     """
@@ -55,10 +56,15 @@ async def kibana(es, params):
     request_params = params["params"]
     meta_data = params["meta_data"]
 
-    if meta_data["debug"]:
-        logger.info("Request:\n=====\n{}\n=====".format(json.dumps(request)))
-
-    visualisations = int(len(request) / 2)
+    if isinstance(request, bytes):
+        if meta_data["debug"]:
+            logger.info("Request:\n=====\n{}\n=====".format(request.decode("utf-8")))
+        # each visualisation consists of a header and a body line
+        visualisations = int(request.count(b"\n") / 2)
+    else:
+        if meta_data["debug"]:
+            logger.info("Request:\n=====\n{}\n=====".format(json.dumps(request)))
+        visualisations = int(len(request) / 2)
 
     response = {}
 
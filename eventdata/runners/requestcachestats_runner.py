@@ -0,0 +1,77 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import json
+
+import logging
+
+logger = logging.getLogger("track.eventdata")
+
+
+async def request_cache_totals(es):
+    result = await es.nodes.stats(metric="indices", index_metric="request_cache")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Request cache stats => {}".format(json.dumps(result)))
+
+    totals = {
+        "hit_count": 0,
+        "miss_count": 0,
+        "evictions": 0,
+        "memory_size_in_bytes": 0
+    }
+    for node in result["nodes"].values():
+        request_cache = node["indices"]["request_cache"]
+        for name in totals.keys():
+            totals[name] += request_cache.get(name, 0)
+    return totals
+
+
+async def requestcachestats(es, params):
+    """
+    Retrieves the shard request cache statistics of all nodes. With ``measurement_period``, it retrieves them once more
+    after this period and reports the hits, misses and hit ratio in between. Run it in parallel to the tasks that should
+    be measured, e.g. to determine the request cache hit ratio that is actually achieved by Kibana queries. Otherwise,
+    only the totals are reported. Errors are raised so that Rally marks the request as failed.
+
+    It expects the parameter hash to contain the following keys:
+        "measurement_period"  - (Optional) Number of seconds between both retrievals of the statistics.
+    """
+    measurement_period = params.get("measurement_period")
+    response = {
+        "weight": 1,
+        "unit": "ops"
+    }
+
+    totals = await request_cache_totals(es)
+    if measurement_period is not None:
+        baseline = totals
+        await asyncio.sleep(float(measurement_period))
+        totals = await request_cache_totals(es)
+        hits = totals["hit_count"] - baseline["hit_count"]
+        misses = totals["miss_count"] - baseline["miss_count"]
+        response["request_cache_hits"] = hits
+        response["request_cache_misses"] = misses
+        response["request_cache_evictions_delta"] = totals["evictions"] - baseline["evictions"]
+        if hits + misses > 0:
+            response["request_cache_hit_ratio"] = hits / (hits + misses)
+
+    response["request_cache_hit_count"] = totals["hit_count"]
+    response["request_cache_miss_count"] = totals["miss_count"]
+    response["request_cache_evictions"] = totals["evictions"]
+    response["request_cache_memory_size_in_bytes"] = totals["memory_size_in_bytes"]
+    return response
@@ -0,0 +1,49 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import contextvars
+import time
+
+# perf_counter() value at which the next action of the Kibana users simulated by the current client is due. Rally runs
+# each client in its own asyncio task and thus each client only sees the value set by its own parameter source.
+next_action_due = contextvars.ContextVar("next_action_due", default=None)
+
+
+class SessionScheduler:
+    """
+    This scheduler sends the requests of Kibana user sessions (see the parameter ``session_users`` of the
+    ``elasticlogs_kibana`` parameter source) when the next action of a user is due. Rally waits for that time before it
+    sends a request, so neither service time nor latency include the think times of users. As Rally schedules relative
+    to the start of the task, latency also includes the time that an action has been overdue because the client was
+    still busy with the previous request.
+    """
+    def __init__(self, params, perf_counter=time.perf_counter):
+        self.perf_counter = perf_counter
+        self.task_start = None
+
+    def next(self, current):
+        now = self.perf_counter()
+        if self.task_start is None:
+            self.task_start = now
+        due = next_action_due.get()
+        if due is None:
+            # the parameter source has not determined any action yet, so the first one is due immediately
+            return 0
+        return max(due - self.task_start, current)
+
+    def __str__(self):
+        return "Kibana session scheduler."
@@ -17,26 +17,34 @@
 
 
 from eventdata.parameter_sources.elasticlogs_bulk_source import ElasticlogsBulkSource
+from eventdata.parameter_sources.elasticlogs_corpus_source import ElasticlogsCorpusSource
 from eventdata.parameter_sources.elasticlogs_kibana_source import ElasticlogsKibanaSource
+from eventdata.runners import adaptive_bulk_runner
 from eventdata.runners import deleteindex_runner
 from eventdata.runners import fieldstats_runner
 from eventdata.runners import indicesstats_runner
 from eventdata.runners import kibana_runner
 from eventdata.runners import nodestorage_runner
+from eventdata.runners import requestcachestats_runner
 from eventdata.runners import rollover_runner
 from eventdata.runners import mount_searchable_snapshot_runner
+from eventdata.schedulers import session_scheduler
 from eventdata.schedulers import utilization_scheduler
 
 
 def register(registry):
+    registry.register_runner("adaptive_bulk", adaptive_bulk_runner.adaptive_bulk, async_runner=True)
     registry.register_runner("delete_indices", deleteindex_runner.deleteindex, async_runner=True)
     registry.register_runner("fieldstats", fieldstats_runner.fieldstats, async_runner=True)
     registry.register_runner("indicesstats", indicesstats_runner.indicesstats, async_runner=True)
     registry.register_runner("kibana", kibana_runner.kibana, async_runner=True)
     registry.register_runner("node_storage", nodestorage_runner.nodestorage, async_runner=True)
+    registry.register_runner("requestcachestats", requestcachestats_runner.requestcachestats, async_runner=True)
     registry.register_runner("rollover", rollover_runner.rollover, async_runner=True)
     registry.register_runner("mount-searchable-snapshot", mount_searchable_snapshot_runner.MountSearchableSnapshotRunner(), async_runner=True)
 
     registry.register_param_source("elasticlogs_bulk", ElasticlogsBulkSource)
     registry.register_param_source("elasticlogs_kibana", ElasticlogsKibanaSource)
+    registry.register_param_source("elasticlogs_corpus", ElasticlogsCorpusSource)
     registry.register_scheduler("utilization", utilization_scheduler.UtilizationBasedScheduler)
+    registry.register_scheduler("kibana-sessions", session_scheduler.SessionScheduler)
@@ -18,3 +18,5 @@
 
 global_fieldstats = {}
 global_config = {}
+# service time (`took` in milliseconds) of the last bulk request per parameter source for adaptive bulk sizing
+global_bulk_took = {}
@@ -0,0 +1,120 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import array
+import gzip
+import json
+import os
+
+from eventdata.parameter_sources import datacache
+
+
+def write_json(path, content):
+    with gzip.open(str(path), "wt") as f:
+        json.dump(content, f)
+    return str(path)
+
+
+def alias_table(weights):
+    return array.array("d", [1.0] * len(weights)), array.array("I", range(len(weights)))
+
+
+def test_caches_lookup_tables(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    json_file = write_json(tmp_path / "names_lookup.json.gz", {"0": "Chrome", "1": "Firefox", "2": "Opera"})
+
+    assert datacache.load_lookup(json_file, cache_dir=cache_dir) == {"0": "Chrome", "1": "Firefox", "2": "Opera"}
+    assert os.path.isfile(datacache.cache_file_name(json_file, cache_dir))
+    # served from the cache
+    assert datacache.load_lookup(json_file, cache_dir=cache_dir) == {"0": "Chrome", "1": "Firefox", "2": "Opera"}
+
+
+def test_caches_weighted_data_sets(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    json_file = write_json(tmp_path / "clientips.json.gz", [
+        [10, ["12.107.122.0", [42.0093, -88.0926], "543", 7279]],
+        [20, ["89.173.122.0", [48.6667, 19.5], "", 178]],
+    ])
+
+    rows, probabilities, aliases = datacache.load_weighted(json_file, alias_table, cache_dir=cache_dir)
+    assert rows[1] == ["89.173.122.0", [48.6667, 19.5], "", 178]
+
+    def fail(weights):
+        raise AssertionError("alias table should be loaded from the cache")
+
+    rows, probabilities, aliases = datacache.load_weighted(json_file, fail, cache_dir=cache_dir)
+    assert isinstance(rows, datacache.ColumnarRows)
+    assert len(rows) == 2
+    assert rows[0] == ("12.107.122.0", (42.0093, -88.0926), "543", 7279)
+    assert rows[1] == ("89.173.122.0", (48.6667, 19.5), "", 178)
+    assert list(probabilities) == [1.0, 1.0]
+    assert list(aliases) == [0, 1]
+
+
+def test_rebuilds_cache_if_source_changes(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    json_file = write_json(tmp_path / "lookup.json.gz", {"0": "old"})
+    assert datacache.load_lookup(json_file, cache_dir=cache_dir) == {"0": "old"}
+
+    write_json(tmp_path / "lookup.json.gz", {"0": "new"})
+    assert datacache.load_lookup(json_file, cache_dir=cache_dir) == {"0": "new"}
+    assert datacache.load_lookup(json_file, cache_dir=cache_dir) == {"0": "new"}
+
+
+def test_rebuilds_empty_or_truncated_cache(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    json_file = write_json(tmp_path / "lookup.json.gz", {"0": "Chrome", "1": "Firefox"})
+    assert datacache.load_lookup(json_file, cache_dir=cache_dir) == {"0": "Chrome", "1": "Firefox"}
+    cache_file = datacache.cache_file_name(json_file, cache_dir)
+    with open(cache_file, "rb") as f:
+        content = f.read()
+
+    for corrupt in [b"", content[:8], content[:len(content) - 4]]:
+        with open(cache_file, "wb") as f:
+            f.write(corrupt)
+        assert datacache.load_lookup(json_file, cache_dir=cache_dir) == {"0": "Chrome", "1": "Firefox"}
+        # ... and the cache has been rebuilt
+        with open(cache_file, "rb") as f:
+            assert f.read() == content
+
+
+def test_does_not_cache_irregular_data_sets(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    json_file = write_json(tmp_path / "irregular.json.gz", [[1, ["a", 1]], [1, ["b"]]])
+
+    rows, _, _ = datacache.load_weighted(json_file, alias_table, cache_dir=cache_dir)
+    assert rows == [["a", 1], ["b"]]
+    assert not os.path.exists(datacache.cache_file_name(json_file, cache_dir))
+
+
+def test_shares_strings_with_other_processes(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    json_file = write_json(tmp_path / "names_lookup.json.gz", {"0": "Chrome", "2": "Ölbrowser"})
+    datacache.load_lookup(json_file, cache_dir=cache_dir)
+
+    datacache.use_shared_strings(True)
+    try:
+        lookup = datacache.load_lookup(json_file, cache_dir=cache_dir)
+    finally:
+        datacache.use_shared_strings(False)
+
+    assert isinstance(lookup, datacache.LookupTable)
+    assert lookup["0"] == "Chrome"
+    assert lookup["2"] == "Ölbrowser"
+    assert dict(lookup) == {"0": "Chrome", "2": "Ölbrowser"}
+    for missing in ["1", "3", "-1", "a"]:
+        assert missing not in lookup
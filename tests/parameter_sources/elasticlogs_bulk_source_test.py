@@ -15,7 +15,14 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import datetime
+import json
+import pickle
+
+import pytest
+
 from eventdata.parameter_sources.elasticlogs_bulk_source import ElasticlogsBulkSource
+from eventdata.utils import globals as gs
 from tests.parameter_sources import StaticTrack
 
 
@@ -25,6 +32,7 @@ class StaticEventGenerator:
         self.type = type
         self.doc = doc
         self.at_most = at_most
+        self.percent_completed = None
 
     def start_bulk(self, bulk_size):
         pass
@@ -35,6 +43,17 @@ class StaticEventGenerator:
         self.at_most -= 1
         return self.doc, self.index, self.type
 
+    def generate_bulk(self, bulk_size):
+        events = []
+        for _ in range(bulk_size):
+            try:
+                events.append(self.generate_event())
+            except StopIteration:
+                if not events:
+                    raise
+                break
+        return events
+
 
 def test_generates_a_complete_bulk():
     expected_bulk_size = 10
@@ -67,3 +86,379 @@ def test_generates_a_bulk_that_ends_prematurely():
     assert generated_params["action-metadata-present"] is True
     assert generated_params["bulk-size"] == 5
     assert generated_params["unit"] == "docs"
+
+
+def test_partitions_generate_reproducible_and_independent_ids():
+    def bulk_ids(partition_index):
+        generator = StaticEventGenerator(index="elasticlogs", type="_doc", doc='{"loc": [-0.14851,51.5250]}')
+        param_source = ElasticlogsBulkSource(track=StaticTrack(), params={
+            "index": "elasticlogs",
+            "bulk-size": 100,
+            "id_type": "seq",
+            "id_seq_probability": 0.5,
+            "seed": 42
+        }, random_event=generator)
+        client_param_source = param_source.partition(partition_index=partition_index, total_partitions=2)
+        # warm up so that there are existing ids to update
+        client_param_source.params()
+        return client_param_source.params()["body"]
+
+    assert bulk_ids(0) == bulk_ids(0)
+    assert bulk_ids(0) != bulk_ids(1)
+
+
+def test_generates_bytes_body_identical_to_string_body():
+    def create_params(body_format):
+        generator = StaticEventGenerator(index="elasticlogs", type="_doc", doc='{"city": "Zürich"}', at_most=25)
+        param_source = ElasticlogsBulkSource(track=StaticTrack(), params={
+            "index": "elasticlogs",
+            "bulk-size": 10,
+            "id_type": "seq",
+            "seed": 42,
+            "bulk_body_format": body_format
+        }, random_event=generator)
+        client_param_source = param_source.partition(partition_index=0, total_partitions=1)
+        return [client_param_source.params() for _ in range(3)]
+
+    for string_params, bytes_params in zip(create_params("string"), create_params("bytes")):
+        assert isinstance(bytes_params["body"], bytes)
+        assert bytes_params["body"] == (string_params["body"] + "\n").encode("utf-8")
+        assert bytes_params["bulk-size"] == string_params["bulk-size"]
+
+
+def test_replays_pre_generated_bulks_with_current_timestamps():
+    now = [datetime.datetime(year=2019, month=6, day=17, hour=23, minute=59, second=58)]
+    param_source = ElasticlogsBulkSource(track=StaticTrack(), params={
+        "index": "elasticlogs-<yyyy>-<mm>-<dd>",
+        "bulk-size": 5,
+        "starting_point": "2019-06-17 23:59:58",
+        "seed": 42,
+        "replay_ring_size": 2,
+        "__utc_now": lambda: now[0]
+    })
+    client_param_source = param_source.partition(partition_index=0, total_partitions=1)
+
+    bodies = []
+    for _ in range(3):
+        now[0] += datetime.timedelta(seconds=1)
+        generated_params = client_param_source.params()
+        assert generated_params["bulk-size"] == 5
+        bodies.append(generated_params["body"])
+
+    assert bodies[0] != bodies[1]
+    expected_timestamps = ["2019-06-17T23:59:59", "2019-06-18T00:00:00", "2019-06-18T00:00:01"]
+    expected_indices = ["elasticlogs-2019-06-17", "elasticlogs-2019-06-18", "elasticlogs-2019-06-18"]
+    for body, expected_timestamp, expected_index in zip(bodies, expected_timestamps, expected_indices):
+        assert body.endswith(b"\n")
+        lines = [json.loads(line) for line in body.decode("utf-8").splitlines()]
+        for action, doc in zip(lines[::2], lines[1::2]):
+            assert action["index"]["_index"] == expected_index
+            assert doc["@timestamp"].startswith(expected_timestamp)
+    # only timestamps and index names differ between replays of the same bulk
+    assert bodies[2].replace(b"2019-06-18T00:00:01", b"2019-06-17T23:59:59").replace(
+        b"elasticlogs-2019-06-18", b"elasticlogs-2019-06-17") == bodies[0]
+
+
+def test_replay_ring_rejects_raw_message():
+    with pytest.raises(AssertionError, match=r"The parameter \[replay_ring_size\] cannot be combined with \[raw_message\]"):
+        ElasticlogsBulkSource(track=StaticTrack(), params={
+            "index": "elasticlogs",
+            "bulk-size": 10,
+            "raw_message": True,
+            "replay_ring_size": 4
+        })
+
+
+def test_replay_ring_requires_auto_ids():
+    with pytest.raises(AssertionError, match=r"The parameter \[replay_ring_size\] requires \[id_type\] auto"):
+        ElasticlogsBulkSource(track=StaticTrack(), params={
+            "index": "elasticlogs",
+            "bulk-size": 10,
+            "id_type": "seq",
+            "replay_ring_size": 10
+        }, random_event=StaticEventGenerator(index="elasticlogs", type="_doc", doc="{}"))
+
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+def test_generates_bulks_in_background_producer(mode):
+    generator = StaticEventGenerator(index="elasticlogs", type="_doc", doc='{"location": [-0.1485188,51.5250666]}',
+                                     at_most=25)
+    param_source = ElasticlogsBulkSource(track=StaticTrack(), params={
+        "index": "elasticlogs",
+        "bulk-size": 10,
+        "producer": mode,
+        "producer_queue_size": 2
+    }, random_event=generator)
+    client_param_source = param_source.partition(partition_index=0, total_partitions=1)
+
+    assert [client_param_source.params()["bulk-size"] for _ in range(3)] == [10, 10, 5]
+    with pytest.raises(StopIteration):
+        client_param_source.params()
+    with pytest.raises(StopIteration):
+        client_param_source.params()
+
+    stats = client_param_source.producer_stats
+    assert stats["bulks"] == 3
+    assert stats["consumer_stalls"] >= 0
+    assert stats["producer_stalls"] >= 0
+
+
+def test_background_producer_can_be_started_in_spawned_process():
+    generator = StaticEventGenerator(index="elasticlogs", type="_doc", doc="{}", at_most=5)
+    param_source = ElasticlogsBulkSource(track=StaticTrack(), params={
+        "index": "elasticlogs",
+        "bulk-size": 10,
+        "producer": "process"
+    }, random_event=generator)
+    client_param_source = param_source.partition(partition_index=0, total_partitions=1)
+
+    # with the spawn and forkserver start methods, the factory is pickled
+    create_source = pickle.loads(pickle.dumps(client_param_source._producer._create_source))
+    assert create_source().params()["bulk-size"] == 5
+    # the consumer does not generate events itself
+    assert client_param_source._randomevent is None
+
+
+def test_rejects_unknown_producer():
+    with pytest.raises(AssertionError, match=r"The value \[coroutine\] is invalid for the parameter \[producer\]"):
+        ElasticlogsBulkSource(track=StaticTrack(), params={
+            "index": "elasticlogs",
+            "bulk-size": 10,
+            "producer": "coroutine"
+        }, random_event=StaticEventGenerator(index="elasticlogs", type="_doc", doc="{}"))
+
+
+@pytest.mark.parametrize("body_format", ["string", "bytes"])
+def test_generates_bulks_up_to_byte_target(body_format):
+    param_source = ElasticlogsBulkSource(track=StaticTrack(), params={
+        "index": "elasticlogs-<yyyy>-<mm>-<dd>",
+        "bulk-size-bytes": "64kB",
+        "seed": 42,
+        "bulk_body_format": body_format
+    })
+    client_param_source = param_source.partition(partition_index=0, total_partitions=1)
+
+    for _ in range(5):
+        generated_params = client_param_source.params()
+        body = generated_params["body"]
+        encoded_body = body if isinstance(body, bytes) else body.encode("utf-8")
+        assert generated_params["bulk-size-bytes"] == len(encoded_body)
+        assert generated_params["bulk-size"] == len(body.splitlines()) // 2
+        # we stop before the first event that would exceed the target
+        assert 64 * 1024 - 4096 < len(encoded_body) <= 64 * 1024
+
+
+def test_limits_documents_of_byte_targeted_bulks():
+    param_source = ElasticlogsBulkSource(track=StaticTrack(), params={
+        "index": "elasticlogs",
+        "bulk-size-bytes": "1MB",
+        "bulk-size": 10,
+        "seed": 42
+    })
+    client_param_source = param_source.partition(partition_index=0, total_partitions=1)
+
+    generated_params = client_param_source.params()
+    assert generated_params["bulk-size"] == 10
+    # the estimated document size is based on what has been generated and not on the byte target
+    average_event_size = client_param_source._average_event_size
+    assert 0.9 * generated_params["bulk-size-bytes"] / 10 < average_event_size < 1.1 * generated_params["bulk-size-bytes"] / 10
+
+
+def test_adapts_bulk_size_to_service_time():
+    generator = StaticEventGenerator(index="elasticlogs", type="_doc", doc='{"location": [-0.1485188,51.5250666]}')
+    param_source = ElasticlogsBulkSource(track=StaticTrack(), params={
+        "index": "elasticlogs",
+        "bulk-size": 1000,
+        "bulk-size-target-millis": 500,
+        "min-bulk-size": 300,
+        "max-bulk-size": 1200
+    }, random_event=generator)
+    client_param_source = param_source.partition(partition_index=0, total_partitions=1)
+
+    bulk_sizes = []
+    for took in [None, 100, 200, 300, 800, 900, 100]:
+        generated_params = client_param_source.params()
+        bulk_sizes.append(generated_params["bulk-size"])
+        if took is not None:
+            gs.global_bulk_took[generated_params["feedback-key"]] = took
+    # no feedback for the first bulk, then additive increase up to the maximum and multiplicative decrease
+    assert bulk_sizes == [1000, 1000, 1100, 1200, 1200, 600, 300]
+
+
+def test_rejects_adaptive_bulk_size_without_initial_bulk_size():
+    with pytest.raises(AssertionError, match=r"\[bulk-size-target-millis\] requires \[bulk-size\]"):
+        ElasticlogsBulkSource(track=StaticTrack(), params={
+            "index": "elasticlogs",
+            "bulk-size-target-millis": 500
+        }, random_event=StaticEventGenerator(index="elasticlogs", type="_doc", doc="{}"))
+
+
+def test_generates_action_lines_per_index():
+    class AlternatingEventGenerator(StaticEventGenerator):
+        def generate_event(self):
+            doc, index, doc_type = super().generate_event()
+            # simulate crossing a date boundary in the middle of a bulk
+            return doc, "{}-{}".format(index, self.at_most // 3), doc_type
+
+    generator = AlternatingEventGenerator(index="elasticlogs", type="_doc", doc="{}", at_most=6)
+    param_source = ElasticlogsBulkSource(track=StaticTrack(), params={
+        "index": "elasticlogs",
+        "bulk-size": 4,
+        "id_type": "seq"
+    }, random_event=generator)
+    client_param_source = param_source.partition(partition_index=3, total_partitions=4)
+
+    assert client_param_source.params()["body"].split("\n")[::2] == [
+        '{"index": {"_index": "elasticlogs-1", "_id": "000000000000-3"}}',
+        '{"index": {"_index": "elasticlogs-1", "_id": "000000000001-3"}}',
+        '{"index": {"_index": "elasticlogs-1", "_id": "000000000002-3"}}',
+        '{"index": {"_index": "elasticlogs-0", "_id": "000000000003-3"}}'
+    ]
+
+
+@pytest.mark.parametrize("body_format", ["string", "bytes"])
+def test_mixes_operation_types(body_format):
+    generator = StaticEventGenerator(index="elasticlogs", type="_doc",
+                                     doc='{"@timestamp": "2017-01-01T00:00:00.000Z", "message": "hello"}')
+    param_source = ElasticlogsBulkSource(track=StaticTrack(), params={
+        "index": "elasticlogs",
+        "bulk-size": 500,
+        "id_type": "seq",
+        "op_type_weights": {"index": 2, "create": 1, "update": 1, "upsert": 1, "delete": 1},
+        "bulk_body_format": body_format,
+        "seed": 13
+    }, random_event=generator)
+    client_param_source = param_source.partition(partition_index=0, total_partitions=1)
+
+    live_ids = set()
+    seen_ops = set()
+    for _ in range(4):
+        body = client_param_source.params()["body"]
+        if body_format == "bytes":
+            # bytes bodies always end with a line break
+            body = body.decode("utf-8")[:-1]
+        lines = iter(body.split("\n"))
+        for line in lines:
+            action = json.loads(line)
+            (op_type, meta), = action.items()
+            doc_id = meta["_id"]
+            if op_type == "delete":
+                assert doc_id in live_ids
+                live_ids.remove(doc_id)
+                seen_ops.add(op_type)
+                continue
+            source = json.loads(next(lines))
+            if op_type == "update" and "doc" in source:
+                assert doc_id in live_ids
+                assert source == {"doc": {"@timestamp": "2017-01-01T00:00:00.000Z"}}
+                seen_ops.add("update")
+            elif op_type == "update":
+                assert source["scripted_upsert"] is True
+                assert source["upsert"] == {"@timestamp": "2017-01-01T00:00:00.000Z", "message": "hello"}
+                # upserts may also insert documents that do not exist
+                seen_ops.add("upsert" if doc_id in live_ids else "upsert-insert")
+                live_ids.add(doc_id)
+            else:
+                if op_type == "create":
+                    assert doc_id not in live_ids
+                live_ids.add(doc_id)
+                seen_ops.add(op_type)
+
+    assert seen_ops == {"index", "create", "update", "upsert", "upsert-insert", "delete"}
+
+
+def test_mixed_operation_types_require_sequential_ids():
+    with pytest.raises(AssertionError) as ex:
+        ElasticlogsBulkSource(track=StaticTrack(), params={
+            "index": "elasticlogs",
+            "bulk-size": 1000,
+            "op_type_weights": {"index": 9, "delete": 1}
+        })
+    assert "require [id_type] seq" in str(ex.value)
+
+
+def test_rejects_unknown_operation_types():
+    with pytest.raises(AssertionError) as ex:
+        ElasticlogsBulkSource(track=StaticTrack(), params={
+            "index": "elasticlogs",
+            "bulk-size": 1000,
+            "op_type_weights": {"index": 9, "merge": 1}
+        })
+    assert "Unknown operations ['merge']" in str(ex.value)
+
+
+def test_updates_target_ids_of_configured_distribution():
+    generator = StaticEventGenerator(index="elasticlogs", type="_doc", doc="{}")
+    param_source = ElasticlogsBulkSource(track=StaticTrack(), params={
+        "index": "elasticlogs",
+        "bulk-size": 1000,
+        "id_type": "seq",
+        "id_seq_probability": 0.5,
+        "id_seq_distribution": "window",
+        "id_seq_window_size": 10,
+        "seed": 7
+    }, random_event=generator)
+    client_param_source = param_source.partition(partition_index=0, total_partitions=1)
+
+    client_param_source.params()
+    created = client_param_source.seq_id
+    ids = [int(json.loads(line)["index"]["_id"].split("-")[0])
+           for line in client_param_source.params()["body"].split("\n")[::2]]
+
+    updates = [doc_id for doc_id in ids if doc_id < created]
+    assert len(updates) == 1000 - (client_param_source.seq_id - created)
+    assert updates and all(created - 10 <= doc_id < created for doc_id in updates)
+    assert [doc_id for doc_id in ids if doc_id >= created] == list(range(created, client_param_source.seq_id))
+
+
+@pytest.mark.parametrize("extra_params", [
+    {"bulk_body_format": "string"},
+    {"bulk_body_format": "bytes", "id_type": "seq"},
+    {"replay_ring_size": 2}
+])
+def test_writes_to_data_stream_with_create_operations(extra_params):
+    now = [datetime.datetime(year=2019, month=6, day=17, hour=23, minute=59, second=59)]
+    params = {
+        "index": "logs-elasticlogs-<yyyy>.<mm>.<dd>",
+        "data_stream": True,
+        "bulk-size": 5,
+        "starting_point": "2019-06-17 23:59:59",
+        "seed": 42,
+        "__utc_now": lambda: now[0]
+    }
+    params.update(extra_params)
+    param_source = ElasticlogsBulkSource(track=StaticTrack(), params=params)
+    client_param_source = param_source.partition(partition_index=0, total_partitions=1)
+
+    for expected_index in ["logs-elasticlogs-2019.06.17", "logs-elasticlogs-2019.06.18"]:
+        body = client_param_source.params()["body"]
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        lines = [json.loads(line) for line in body.splitlines()]
+        for action, doc in zip(lines[::2], lines[1::2]):
+            assert list(action.keys()) == ["create"]
+            assert action["create"]["_index"] == expected_index
+            assert "@timestamp" in doc
+        now[0] += datetime.timedelta(seconds=1)
+
+
+def test_data_stream_rejects_operation_mix():
+    with pytest.raises(AssertionError, match=r"The parameter \[op_type_weights\] cannot be combined with \[data_stream\]"):
+        ElasticlogsBulkSource(track=StaticTrack(), params={
+            "index": "logs-elasticlogs-default",
+            "bulk-size": 10,
+            "data_stream": True,
+            "id_type": "seq",
+            "op_type_weights": {"create": 9, "delete": 1}
+        })
+
+
+def test_data_stream_rejects_updates():
+    with pytest.raises(AssertionError, match=r"The parameter \[id_seq_probability\] cannot be combined with \[data_stream\]"):
+        ElasticlogsBulkSource(track=StaticTrack(), params={
+            "index": "logs-elasticlogs-default",
+            "bulk-size": 10,
+            "data_stream": True,
+            "id_type": "seq",
+            "id_seq_probability": 0.1
+        })
@@ -0,0 +1,100 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import gzip
+import json
+
+import pytest
+
+from eventdata.parameter_sources import corpus
+from eventdata.parameter_sources.elasticlogs_corpus_source import ElasticlogsCorpusSource
+from tests.parameter_sources import StaticTrack
+
+
+def generate(corpus_dir, compress=False):
+    return corpus.generate(str(corpus_dir), {"index": "elasticlogs-<yyyy>-<mm>-<dd>", "bulk-size": 10, "seed": 7},
+                           documents=95, partitions=2, workers=1, compress=compress)
+
+
+def read_all(corpus_dir, metadata):
+    data = b""
+    for part in metadata["parts"]:
+        with open(str(corpus_dir / part["name"]), "rb") as f:
+            data += f.read()
+    return gzip.decompress(data) if metadata["compressed"] else data
+
+
+def test_generates_reproducible_corpus(tmp_path):
+    metadata = generate(tmp_path / "a")
+    generate(tmp_path / "b")
+
+    assert metadata["documents"] == 100
+    assert [part["bulks"] for part in metadata["parts"]] == [5, 5]
+    assert read_all(tmp_path / "a", metadata) == read_all(tmp_path / "b", metadata)
+
+    lines = read_all(tmp_path / "a", metadata).decode("utf-8").splitlines()
+    assert len(lines) == 200
+    assert json.loads(lines[0])["index"]["_index"] == "elasticlogs-2020-01-01"
+    assert json.loads(lines[1])["@timestamp"].startswith("2020-01-01T00:00:")
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_replays_corpus_across_clients(tmp_path, compress):
+    metadata = generate(tmp_path, compress=compress)
+    param_source = ElasticlogsCorpusSource(track=StaticTrack(), params={"corpus_dir": str(tmp_path)})
+
+    bodies = []
+    for client in range(3):
+        client_param_source = param_source.partition(partition_index=client, total_partitions=3)
+        while True:
+            try:
+                generated_params = client_param_source.params()
+            except StopIteration:
+                break
+            assert generated_params["bulk-size"] == 10
+            assert generated_params["action-metadata-present"] is True
+            bodies.append(generated_params["body"])
+        assert client_param_source.percent_completed == 1.0
+
+    assert len(bodies) == 10
+    assert len(set(bodies)) == 10
+    assert all(body.endswith(b"\n") for body in bodies)
+    assert sum(len(body) for body in bodies) == len(read_all(tmp_path, metadata))
+
+
+def test_loops_over_corpus(tmp_path):
+    generate(tmp_path)
+    param_source = ElasticlogsCorpusSource(track=StaticTrack(), params={"corpus_dir": str(tmp_path), "looped": True})
+    client_param_source = param_source.partition(partition_index=0, total_partitions=1)
+
+    bodies = [client_param_source.params()["body"] for _ in range(12)]
+    assert bodies[10:] == bodies[:2]
+    assert client_param_source.percent_completed is None
+
+
+def test_rejects_corpus_for_other_index(tmp_path):
+    generate(tmp_path)
+    # the index is part of each bulk request so a corpus for another index would bypass the write alias
+    with pytest.raises(AssertionError) as ex:
+        ElasticlogsCorpusSource(track=StaticTrack(), params={"corpus_dir": str(tmp_path), "index": "elasticlogs_q_write"})
+
+    assert "has been generated for the index [elasticlogs-<yyyy>-<mm>-<dd>] but the operation targets " \
+           "[elasticlogs_q_write]." in str(ex.value)
+
+    param_source = ElasticlogsCorpusSource(track=StaticTrack(), params={"corpus_dir": str(tmp_path),
+                                                                         "index": "elasticlogs-<yyyy>-<mm>-<dd>"})
+    assert param_source.partition(partition_index=0, total_partitions=1).params()["bulk-size"] == 10
@@ -15,15 +15,17 @@
 # specific language governing permissions and limitations
 # under the License.
 
+import contextvars
 import json
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest import mock
 from eventdata.utils import globals as gs
 
 import pytest
 
 from eventdata.parameter_sources.elasticlogs_kibana_source import ElasticlogsKibanaSource, ConfigurationError
+from eventdata.schedulers.session_scheduler import SessionScheduler
 from tests.parameter_sources import StaticTrack
 
 
@@ -40,6 +42,15 @@ def load(dashboard_name):
         return json.load(f)
 
 
+def parsed(response):
+    # the body is sent as NDJSON so parse it for easier comparison
+    body = response["body"]
+    assert isinstance(body, bytes)
+    assert body.endswith(b"\n")
+    response["body"] = [json.loads(line) for line in body.decode("utf-8").splitlines()]
+    return response
+
+
 @mock.patch("time.time")
 def test_create_discover(time):
     time.return_value = 5000
@@ -50,7 +61,7 @@ def test_create_discover(time):
     }, utcnow=lambda: datetime(year=2019, month=11, day=11))
     response = param_source.params()
 
-    assert response == load("discover")
+    assert parsed(response) == load("discover")
 
 
 @mock.patch("time.time")
@@ -63,10 +74,9 @@ def test_create_discover_random_window_length(time, fieldstats):
         "window_length": "random",
         "seed": 1573430400000
     }, utcnow=lambda: datetime(year=2019, month=11, day=11))
-    param_source.partition(0,1)
-    response = param_source.params()
+    response = param_source.partition(0, 1).params()
 
-    assert response == load("discover-random-window-length")
+    assert parsed(response) == load("discover-random-window-length")
 
 
 @mock.patch("time.time")
@@ -79,7 +89,7 @@ def test_create_content_issues_dashboard(time):
     }, utcnow=lambda: datetime(year=2019, month=11, day=11))
     response = param_source.params()
 
-    assert response == load("content_issues")
+    assert parsed(response) == load("content_issues")
     assert "max_concurrent_shard_requests" not in response["params"].keys()
 
 
@@ -108,7 +118,302 @@ def test_create_traffic_dashboard(time):
     }, utcnow=lambda: datetime(year=2019, month=11, day=11))
     response = param_source.params()
 
-    assert response == load("traffic")
+    assert parsed(response) == load("traffic")
+
+
+@mock.patch("time.time")
+def test_compiled_body_escapes_values(time):
+    time.return_value = 5000
+
+    param_source = ElasticlogsKibanaSource(track=StaticTrack(), params={
+        "dashboard": "discover",
+        "index_pattern": ["elasticlogs-\"quoted\"-*"],
+        "query_string": ["nginx.access.url: \"/ünïcode\\path\""],
+        "discover_size": 10,
+        "ignore_throttled": False
+    }, utcnow=lambda: datetime(year=2019, month=11, day=11))
+    header, body = parsed(param_source.params())["body"]
+
+    assert header == {
+        "index": "elasticlogs-\"quoted\"-*",
+        "ignore_unavailable": True,
+        "preference": 5000000,
+        "ignore_throttled": False
+    }
+    assert body["size"] == 10
+    assert body["query"]["bool"]["must"][0]["query_string"]["query"] == "nginx.access.url: \"/ünïcode\\path\""
+    assert body["query"]["bool"]["must"][1]["range"]["@timestamp"] == {
+        "gte": 1573344000000,
+        "lte": 1573430400000,
+        "format": "epoch_millis"
+    }
+
+
+@mock.patch("time.time")
+def test_create_weighted_dashboard_mix(time):
+    time.return_value = 5000
+
+    param_source = ElasticlogsKibanaSource(track=StaticTrack(), params={
+        "index_pattern": "elasticlogs-*",
+        "dashboard_mix": [
+            {"dashboard": "traffic", "weight": 3, "window_length": "15m"},
+            {"dashboard": "discover", "weight": 1, "index_pattern": "elasticlogs-discover-*"},
+            {"dashboard": "content_issues", "weight": 0}
+        ],
+        "seed": 13
+    }, utcnow=lambda: datetime(year=2019, month=11, day=11)).partition(0, 1)
+
+    counts = {"traffic": 0, "discover": 0, "content_issues": 0}
+    for _ in range(1000):
+        response = parsed(param_source.params())
+        meta_data = response["meta_data"]
+        counts[meta_data["dashboard"]] += 1
+        header = response["body"][0]
+        if meta_data["dashboard"] == "traffic":
+            assert len(response["body"]) == 14
+            assert meta_data["window_length"] == "15m"
+            assert meta_data["interval"] == "10s"
+            assert header["index"] == "elasticlogs-*"
+        else:
+            assert len(response["body"]) == 2
+            assert meta_data["window_length"] == "1d"
+            assert meta_data["interval"] == "30m"
+            assert header["index"] == "elasticlogs-discover-*"
+
+    assert counts["content_issues"] == 0
+    assert 700 < counts["traffic"] < 800
+
+
+def test_dashboard_mix_with_invalid_weights_raises_error():
+    with pytest.raises(ConfigurationError) as ex:
+        ElasticlogsKibanaSource(track=StaticTrack(), params={
+            "index_pattern": "elasticlogs-*",
+            "dashboard_mix": [{"dashboard": "traffic", "weight": 0}]
+        })
+
+    assert "The weights in [dashboard_mix] must not be negative and at least one must be positive." == ex.value.message
+
+
+def test_dashboard_mix_entry_requires_dashboard():
+    with pytest.raises(ConfigurationError) as ex:
+        ElasticlogsKibanaSource(track=StaticTrack(), params={
+            "index_pattern": "elasticlogs-*",
+            "dashboard_mix": [{"weight": 1}]
+        })
+
+    assert "Each entry in [dashboard_mix] must be an object with the key [dashboard]." == ex.value.message
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.seconds = 0
+
+    def perf_counter(self):
+        return self.seconds
+
+    def utcnow(self):
+        return datetime(year=2019, month=11, day=11) + timedelta(seconds=self.seconds)
+
+
+def run_sessions(param_source, clock, iterations):
+    # like Rally: ask the scheduler first, then determine the parameters and wait until the request is due
+    def run():
+        scheduler = SessionScheduler(params={}, perf_counter=clock.perf_counter)
+        task_start = clock.seconds
+        scheduled = 0
+        requests = []
+        for _ in range(iterations):
+            scheduled = scheduler.next(scheduled)
+            response = param_source.params()
+            clock.seconds = max(clock.seconds, task_start + scheduled)
+            requests.append((clock.seconds, response))
+        return requests
+    # each Rally client runs in its own context
+    return contextvars.copy_context().run(run)
+
+
+@mock.patch("time.time")
+def test_rounds_time_window(time):
+    time.return_value = 5000
+
+    param_source = ElasticlogsKibanaSource(track=StaticTrack(), params={
+        "dashboard": "discover",
+        "index_pattern": "elasticlogs-*",
+        "window_length": "15m",
+        "window_rounding": "1m"
+    }, utcnow=lambda: datetime(year=2019, month=11, day=11, hour=10, minute=7, second=42, microsecond=123000))
+    response = parsed(param_source.params())
+
+    # like now-15m/m to now/m in Kibana, the end is rounded up to the end of the minute
+    assert response["body"][1]["query"]["bool"]["must"][1]["range"]["@timestamp"] == {
+        "gte": 1573466400000 - 8 * 60 * 1000,
+        "lte": 1573466400000 + 8 * 60 * 1000 - 1,
+        "format": "epoch_millis"
+    }
+
+    # the preference stays the same so that the request can be served from the request cache
+    time.return_value = 5001
+    assert parsed(param_source.params())["body"] == response["body"]
+
+
+def test_uses_stable_preference_per_client():
+    params = {
+        "dashboard": "traffic",
+        "index_pattern": "elasticlogs-*",
+        "window_rounding": "1m",
+        "seed": 7
+    }
+    param_source = ElasticlogsKibanaSource(track=StaticTrack(), params=params)
+
+    def preferences(client):
+        partition = param_source.partition(client, 2)
+        return {parsed(partition.params())["body"][0]["preference"] for _ in range(5)}
+
+    assert len(preferences(0)) == 1
+    assert preferences(0) == preferences(0)
+    assert preferences(0) != preferences(1)
+
+
+def test_uses_stable_preference_per_session_user():
+    clock = SimulatedClock()
+    param_source = ElasticlogsKibanaSource(track=StaticTrack(), params={
+        "dashboard": "traffic",
+        "index_pattern": "elasticlogs-*",
+        "window_rounding": "1m",
+        "session_users": 3,
+        "seed": 7
+    }, utcnow=clock.utcnow, perf_counter=clock.perf_counter).partition(0, 1)
+
+    preferences = {parsed(response)["body"][0]["preference"] for _, response in run_sessions(param_source, clock, 50)}
+
+    assert len(preferences) == 3
+
+
+def test_invalid_window_rounding_raises_error():
+    with pytest.raises(ConfigurationError) as ex:
+        ElasticlogsKibanaSource(track=StaticTrack(), params={
+            "dashboard": "traffic",
+            "index_pattern": "elasticlogs-*",
+            "window_rounding": "1w"
+        })
+
+    assert "Invalid window_rounding parameter supplied: 1w." == ex.value.message
+
+
+def test_repeats_recent_requests_for_target_cache_hit_ratio():
+    clock = SimulatedClock()
+    param_source = ElasticlogsKibanaSource(track=StaticTrack(), params={
+        "dashboard": "traffic",
+        "index_pattern": "elasticlogs-*",
+        "target_cache_hit_ratio": 0.7,
+        "recent_requests": 5,
+        "seed": 17
+    }, utcnow=clock.utcnow).partition(0, 1)
+
+    recent = []
+    reused = 0
+    for _ in range(1000):
+        response = param_source.params()
+        # every request has a different time window
+        clock.seconds += 1
+        if response["meta_data"].get("window_reused", False):
+            reused += 1
+            assert response["body"] in recent[-5:]
+        else:
+            assert response["body"] not in recent
+            recent.append(response["body"])
+
+    assert 650 < reused < 750
+
+
+def test_target_cache_hit_ratio_cannot_be_combined_with_sessions():
+    with pytest.raises(ConfigurationError) as ex:
+        ElasticlogsKibanaSource(track=StaticTrack(), params={
+            "dashboard": "traffic",
+            "index_pattern": "elasticlogs-*",
+            "target_cache_hit_ratio": 0.5,
+            "session_users": 10
+        })
+
+    assert "The parameter [target_cache_hit_ratio] cannot be combined with [session_users]." == ex.value.message
+
+
+def test_simulates_session_with_auto_refresh_and_zoom():
+    clock = SimulatedClock()
+    param_source = ElasticlogsKibanaSource(track=StaticTrack(), params={
+        "dashboard": "traffic",
+        "index_pattern": "elasticlogs-*",
+        "session_users": 1,
+        "session_refresh_interval": 30,
+        "session_think_time": 45,
+        "session_think_time_distribution": "constant",
+        "session_zoom_probability": 1.0,
+        "session_discover_probability": 0.0,
+        "seed": 7
+    }, utcnow=clock.utcnow, perf_counter=clock.perf_counter).partition(0, 1)
+
+    actions = []
+    sent_at = []
+    windows = []
+    for seconds, response in run_sessions(param_source, clock, 4):
+        response = parsed(response)
+        actions.append(response["meta_data"]["session_action"])
+        sent_at.append(seconds)
+        windows.append(response["body"][1]["query"]["bool"]["must"][2]["range"]["@timestamp"])
+
+    assert actions == ["open", "refresh", "zoom", "refresh"]
+    # the first user arrives immediately
+    assert sent_at == [0, 30, 45, 75]
+
+    assert windows[0]["lte"] == 1573430400000
+    assert windows[0]["lte"] - windows[0]["gte"] == 24 * 3600 * 1000
+    # auto-refresh moves the window along with the current time
+    assert windows[1]["gte"] == windows[0]["gte"] + 30000
+    assert windows[1]["lte"] == windows[0]["lte"] + 30000
+    # zooming into a quarter of the window
+    assert windows[2]["lte"] - windows[2]["gte"] == 6 * 3600 * 1000
+    assert windows[1]["gte"] <= windows[2]["gte"] and windows[2]["lte"] <= windows[1]["lte"]
+    # ... fixes the time window
+    assert windows[3] == windows[2]
+
+
+def test_simulates_multiple_users_per_client():
+    clock = SimulatedClock()
+    param_source = ElasticlogsKibanaSource(track=StaticTrack(), params={
+        "index_pattern": "elasticlogs-*",
+        "dashboard_mix": [{"dashboard": "traffic"}, {"dashboard": "content_issues"}],
+        "session_users": 20,
+        "session_refresh_interval": 0,
+        "session_think_time": 10,
+        "seed": 7
+    }, utcnow=clock.utcnow, perf_counter=clock.perf_counter).partition(0, 1)
+
+    actions = {"open": 0, "refresh": 0, "zoom": 0, "discover": 0}
+    dashboards = set()
+    for _, response in run_sessions(param_source, clock, 2000):
+        actions[response["meta_data"]["session_action"]] += 1
+        dashboards.add(response["meta_data"]["dashboard"])
+
+    # 20 users with a mean think time of 10 seconds issue about 2 requests per second
+    assert 800 < clock.seconds < 1200
+    assert actions["refresh"] == 0
+    assert 400 < actions["zoom"] < 800
+    assert 200 < actions["discover"] < 600
+    assert dashboards == {"traffic", "content_issues", "discover"}
+
+
+def test_invalid_session_parameters_raise_error():
+    with pytest.raises(ConfigurationError) as ex:
+        ElasticlogsKibanaSource(track=StaticTrack(), params={
+            "dashboard": "traffic",
+            "index_pattern": "elasticlogs-*",
+            "session_users": 10,
+            "session_zoom_probability": 0.8,
+            "session_discover_probability": 0.4
+        })
+
+    assert "The parameters [session_zoom_probability] and [session_discover_probability] must not be negative and " \
+           "their sum must not exceed 1." == ex.value.message
 
 
 def test_dashboard_is_mandatory():
@@ -129,7 +434,63 @@ def test_invalid_dashboard_raises_error():
     with pytest.raises(ConfigurationError) as ex:
         ElasticlogsKibanaSource(track=StaticTrack(), params={"dashboard": "unknown", "index_pattern": "elasticlogs*"})
 
-    assert "Unknown dashboard [unknown]. Must be one of ['traffic', 'content_issues', 'discover']." == str(ex.value)
+    assert "Unknown dashboard [unknown]. Must be one of ['content_issues', 'discover', 'traffic'] or the path to a " \
+           "dashboard spec file." == str(ex.value)
+
+
+@mock.patch("time.time")
+def test_create_dashboard_from_spec_file(time, tmp_path):
+    time.return_value = 5000
+    spec_file = tmp_path / "custom-dashboard.json"
+    spec_file.write_text(json.dumps({
+        "panels": [
+            {"size": 0, "query": {"query_string": {"query": "@@query_string@@"}}},
+            {"size": 0, "aggs": {"2": {"date_histogram": {"field": "@timestamp", "fixed_interval": "@@interval@@"}}},
+             "query": {"range": {"@timestamp": {"gte": "@@ts_min_ms@@", "lte": "@@ts_max_ms@@"}}}},
+            {"size": "@@discover_size@@"}
+        ]
+    }))
+
+    param_source = ElasticlogsKibanaSource(track=StaticTrack(), params={
+        "dashboard": str(spec_file),
+        "index_pattern": "elasticlogs-*",
+        "query_string": ["nginx.access.response_code: 404"],
+        "discover_size": 20
+    }, utcnow=lambda: datetime(year=2019, month=11, day=11))
+    response = parsed(param_source.params())
+
+    header = {"index": "elasticlogs-*", "ignore_unavailable": True, "preference": 5000000, "ignore_throttled": True}
+    assert response["body"] == [
+        header,
+        {"size": 0, "query": {"query_string": {"query": "nginx.access.response_code: 404"}}},
+        header,
+        {"size": 0, "aggs": {"2": {"date_histogram": {"field": "@timestamp", "fixed_interval": "30m"}}},
+         "query": {"range": {"@timestamp": {"gte": 1573344000000, "lte": 1573430400000}}}},
+        header,
+        {"size": 20}
+    ]
+    assert response["meta_data"]["dashboard"] == str(spec_file)
+
+
+def test_dashboard_spec_without_panels_raises_error(tmp_path):
+    spec_file = tmp_path / "empty-dashboard.json"
+    spec_file.write_text(json.dumps({"panels": []}))
+
+    with pytest.raises(ConfigurationError) as ex:
+        ElasticlogsKibanaSource(track=StaticTrack(), params={"dashboard": str(spec_file), "index_pattern": "elasticlogs*"})
+
+    assert "Dashboard spec [{}] must contain a non-empty list of search bodies in [panels].".format(spec_file) == \
+           ex.value.message
+
+
+def test_dashboard_spec_with_unknown_placeholder_raises_error(tmp_path):
+    spec_file = tmp_path / "invalid-dashboard.json"
+    spec_file.write_text(json.dumps({"panels": [{"size": "@@page_size@@"}]}))
+
+    with pytest.raises(ConfigurationError) as ex:
+        ElasticlogsKibanaSource(track=StaticTrack(), params={"dashboard": str(spec_file), "index_pattern": "elasticlogs*"})
+
+    assert "Unknown slots ['page_size'] in msearch body." == ex.value.message
 
 
 def test_determine_interval():
@@ -0,0 +1,68 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import random
+
+import pytest
+
+from eventdata.parameter_sources import iddistributions
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"id_seq_low_id_bias": True},
+    {"id_seq_distribution": "zipf"},
+    {"id_seq_distribution": "zipf", "id_seq_zipf_exponent": 1.5},
+    {"id_seq_distribution": "window", "id_seq_window_size": 10},
+    {"id_seq_distribution": "hot_set", "id_seq_hot_set_size": 10}
+])
+def test_samples_existing_ids(params):
+    distribution = iddistributions.create(params)
+    rng = random.Random(42)
+
+    assert distribution.sample(rng, 0, 3) == [0, 0, 0]
+    ids = distribution.sample(rng, 1000, 10000)
+    assert len(ids) == 10000
+    assert all(0 <= doc_id < 1000 for doc_id in ids)
+
+
+def test_zipf_favors_recent_ids():
+    ids = iddistributions.ZipfRecency(1.0).sample(random.Random(42), 100000, 10000)
+
+    # P(rank <= 10) = ln(11) / ln(100001) ~ 0.21
+    assert 0.18 < sum(1 for doc_id in ids if doc_id >= 100000 - 10) / len(ids) < 0.24
+    assert ids.count(99999) > ids.count(99990) > ids.count(50000)
+
+
+def test_window_only_targets_recent_ids():
+    ids = iddistributions.SlidingWindow(100).sample(random.Random(42), 100000, 10000)
+
+    assert min(ids) == 100000 - 100
+    assert max(ids) == 100000 - 1
+
+
+def test_hot_set_receives_configured_share_of_updates():
+    ids = iddistributions.HotSet(size=100, probability=0.8).sample(random.Random(42), 100000, 10000)
+
+    assert 0.78 < sum(1 for doc_id in ids if doc_id < 100) / len(ids) < 0.82
+    assert max(ids) > 100
+
+
+def test_rejects_unknown_distribution():
+    with pytest.raises(AssertionError) as ex:
+        iddistributions.create({"id_seq_distribution": "pareto"})
+    assert "The value [pareto] is invalid for the parameter [id_seq_distribution]" in str(ex.value)
@@ -0,0 +1,57 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import threading
+
+import pytest
+
+from eventdata.parameter_sources.producer import BulkProducer
+
+
+class BlockingSource:
+    def __init__(self, released):
+        self.released = released
+        self.percent_completed = None
+
+    def params(self):
+        self.released.wait()
+        raise StopIteration()
+
+
+def test_raises_error_if_no_bulk_is_produced_in_time():
+    released = threading.Event()
+    bulk_producer = BulkProducer(lambda: BlockingSource(released), mode="thread", timeout=0.1)
+    try:
+        with pytest.raises(TimeoutError, match=r"No bulk request has been produced within \[0.1\] seconds."):
+            bulk_producer.get()
+        # the producer is not waited for again
+        with pytest.raises(StopIteration):
+            bulk_producer.get()
+    finally:
+        released.set()
+
+
+def test_raises_error_if_producer_terminated():
+    class TerminatingProducer(BulkProducer):
+        @staticmethod
+        def _produce(create_source, bulk_queue, producer_stalls, producer_stall_time):
+            # terminates without putting anything into the queue
+            pass
+
+    bulk_producer = TerminatingProducer(lambda: None, mode="thread", timeout=5)
+    with pytest.raises(RuntimeError, match=r"The bulk producer has terminated unexpectedly."):
+        bulk_producer.get()
@@ -21,10 +21,14 @@ from datetime import datetime
 import pytest
 
 from eventdata.parameter_sources.randomevent import RandomEvent, convert_to_bytes
+from eventdata.utils import elasticlogs_bulk_source as ebs
 
 
 # Adds all relevant fields for an event
 class StaticAgent:
+    def __init__(self, rng=None, fragment_cache_size=None):
+        pass
+
     def add_fields(self, event):
         event["useragent_name"] = "Chrome"
         event["useragent_os"] = "MacOS"
@@ -37,6 +41,9 @@ class StaticAgent:
 
 
 class StaticClientIp:
+    def __init__(self, rng=None, fragment_cache_size=None):
+        pass
+
     def add_fields(self, event):
         event["clientip"] = "127.0.0.1"
         event["geoip_location_lat"] = "0"
@@ -49,11 +56,17 @@ class StaticClientIp:
 
 
 class StaticReferrer:
+    def __init__(self, rng=None, fragment_cache_size=None):
+        pass
+
     def add_fields(self, event):
         event["referrer"] = "https://www.google.com"
 
 
 class StaticRequest:
+    def __init__(self, rng=None, fragment_cache_size=None):
+        pass
+
     def add_fields(self, event):
         event["request"] = "current/doc-values.html"
         event["bytes"] = "3204"
@@ -103,6 +116,33 @@ def test_random_event_with_event_size():
     assert doc_type == "doc"
 
 
+def test_random_event_with_raw_message():
+    e = RandomEvent(params={
+        "index": "logs",
+        "starting_point": "2019-01-05 15:00:00",
+        "raw_message": True,
+        "record_raw_event_size": True,
+        "__utc_now": lambda: datetime(year=2019, month=6, day=17)
+    },
+        agent=StaticAgent,
+        client_ip=StaticClientIp,
+        referrer=StaticReferrer,
+        request=StaticRequest)
+
+    e.start_bulk(1)
+    raw_doc, index, doc_type = e.generate_event()
+
+    doc = json.loads(raw_doc)
+    assert doc["message"] == '127.0.0.1 - - [05/Jan/2019:15:00:00 +0000] "GET current/doc-values.html HTTP/1.1" 200 3204 ' \
+                             '"https://www.google.com" "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_2) AppleWebKit/537.36 ' \
+                             '(KHTML, like Gecko) Chrome/50.0.2661.66 Safari/537.36"'
+    # the raw event size is the same as for pre-parsed events
+    assert doc["_raw_event_size"] == 236
+    assert "nginx" not in doc
+    assert doc["@timestamp"].startswith("2019-01-05T15:00:00.")
+    assert index == "logs"
+
+
 def test_random_events_with_daily_logging_volume():
     e = RandomEvent(params={
         "index": "logs-<yyyy><mm><dd>",
@@ -203,3 +243,124 @@ def test_convert_invalid_to_bytes():
     assert "Invalid byte size value [3gb]" == str(ex.value)
 
 
+def test_random_events_with_seed_are_reproducible_per_client():
+    def generate(client_id):
+        e = RandomEvent(params={
+            "index": "logs",
+            "starting_point": "2019-01-05 15:00:00",
+            "seed": 42,
+            "client_id": client_id,
+            "__utc_now": lambda: datetime(year=2019, month=6, day=17)
+        })
+        e.start_bulk(10)
+        return [e.generate_event()[0] for _ in range(10)]
+
+    assert generate(0) == generate(0)
+    assert generate(0) != generate(1)
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"record_raw_event_size": True},
+    {"daily_logging_volume": "10kB", "client_count": 1, "number_of_days": 3, "index": "logs-<yyyy><mm><dd>"},
+    {"raw_message": True},
+    {"raw_message": True, "record_raw_event_size": True},
+])
+def test_generate_bulk_is_equivalent_to_generate_event(params):
+    def random_event():
+        p = {
+            "index": "logs",
+            "starting_point": "2019-01-05 15:00:00",
+            "seed": 7,
+            "client_id": 0,
+            "__utc_now": lambda: datetime(year=2019, month=6, day=17)
+        }
+        p.update(params)
+        return RandomEvent(params=p)
+
+    single = random_event()
+    bulk = random_event()
+    for _ in range(8):
+        single.start_bulk(20)
+        expected = []
+        for _ in range(20):
+            try:
+                expected.append(single.generate_event())
+            except StopIteration:
+                break
+        if not expected:
+            with pytest.raises(StopIteration):
+                bulk.generate_bulk(20)
+        else:
+            assert bulk.generate_bulk(20) == expected
+
+
+def test_fragment_cache_reports_statistics():
+    # fragment caches are shared per process and cache size
+    for name in ["agent", "clientip", "referrer", "request"]:
+        ebs.global_lookups.pop("_{}_fragments_100".format(name), None)
+
+    e = RandomEvent(params={
+        "index": "logs",
+        "starting_point": "2019-01-05 15:00:00",
+        "seed": 7,
+        "client_id": 0,
+        "fragment_cache_size": 100
+    })
+
+    e.generate_bulk(1000)
+    stats = e.fragment_cache_stats
+    for name in ["agent", "clientip", "referrer", "request"]:
+        assert stats[name].hits + stats[name].misses == 1000
+        assert stats[name].maxsize == 100
+        assert stats[name].currsize <= 100
+    # the most frequent user agents are well within the 100 cached entries
+    assert stats["agent"].hits > 0
+
+    # clients with another cache size get their own cache
+    other = RandomEvent(params={
+        "index": "logs",
+        "starting_point": "2019-01-05 15:00:00",
+        "client_id": 1,
+        "fragment_cache_size": 200
+    })
+    for name in ["agent", "clientip", "referrer", "request"]:
+        assert other.fragment_cache_stats[name].maxsize == 200
+
+
+def test_spreads_timestamps_across_bulk():
+    e = RandomEvent({
+        "index": "logs",
+        "starting_point": "2019-01-05 15:00:00",
+        "seed": 7,
+        "timestamp_spread_millis": 500,
+        "__utc_now": lambda: datetime(year=2019, month=6, day=17)
+    })
+
+    timestamps = [json.loads(line)["@timestamp"] for line, _, _ in e.generate_bulk(100)]
+    assert timestamps[0] == "2019-01-05T15:00:00.000Z"
+    assert timestamps[1] == "2019-01-05T15:00:00.005Z"
+    assert timestamps[-1] == "2019-01-05T15:00:00.495Z"
+
+
+def test_generate_bulk_stays_within_max_bytes():
+    def random_event():
+        return RandomEvent(params={
+            "index": "logs",
+            "starting_point": "2019-01-05 15:00:00",
+            "seed": 7,
+            "client_id": 0,
+            "__utc_now": lambda: datetime(year=2019, month=6, day=17)
+        })
+
+    def size(events):
+        return sum(len(line) + len(index) + 10 for line, index, _ in events)
+
+    unlimited = random_event()
+    limited = random_event()
+    first = limited.generate_bulk(100, max_bytes=4096, line_overhead=10)
+    second = limited.generate_bulk(100, max_bytes=4096, line_overhead=10)
+    assert 0 < size(first) <= 4096
+    assert 0 < size(second) <= 4096
+    # the event that did not fit into the first bulk starts the second one
+    assert second[0] == unlimited.generate_bulk(100)[len(first)]
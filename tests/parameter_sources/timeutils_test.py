@@ -254,3 +254,34 @@ def test_generate_invalid_time_interval():
 
     assert "Invalid time format: now+1w" == str(ex.value)
 
+
+def test_generate_bulk_timestamps():
+    clock = ReproducibleClock(start=datetime.datetime(year=2019, month=1, day=5, hour=15),
+                              delta=datetime.timedelta(seconds=1))
+
+    g = TimestampStructGenerator(starting_point="2018-05-01:00:59:58", utcnow=clock)
+    expected = TimestampStructGenerator(starting_point="2018-05-01:00:59:58",
+                                        utcnow=ReproducibleClock(start=datetime.datetime(year=2019, month=1, day=5, hour=15),
+                                                                 delta=datetime.timedelta(seconds=1)))
+
+    for _ in range(3):
+        expected.next_timestamp()
+        assert g.bulk_timestamps(1000) == [expected.simulate_tick(1 / 1000)["iso"] for _ in range(1000)]
+
+
+def test_generate_bulk_timestamps_with_spread():
+    clock = ReproducibleClock(start=datetime.datetime(year=2019, month=1, day=5, hour=15))
+
+    g = TimestampStructGenerator(starting_point="2018-05-01:00:59:59", utcnow=clock)
+
+    assert g.bulk_timestamps(4, spread_millis=1000) == [
+        "2018-05-01T00:59:59.000Z",
+        "2018-05-01T00:59:59.250Z",
+        "2018-05-01T00:59:59.500Z",
+        "2018-05-01T00:59:59.750Z"
+    ]
+    assert g.current_timestamps(3, spread_millis=10) == [
+        "2018-05-01T00:59:59.000Z",
+        "2018-05-01T00:59:59.003Z",
+        "2018-05-01T00:59:59.006Z"
+    ]
@@ -0,0 +1,90 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from datetime import datetime
+
+import pytest
+
+from eventdata.parameter_sources import volumebudget
+from eventdata.parameter_sources.randomevent import RandomEvent
+
+pytestmark = pytest.mark.skipif(not volumebudget.is_supported(), reason="requires advisory file locks")
+
+
+def test_clients_share_daily_budget(tmp_path):
+    clients = [volumebudget.SharedVolumeBudget("key", client_id, 2, 2000, budget_dir=str(tmp_path))
+               for client_id in range(2)]
+    assert clients[0].lease_size == 10
+
+    leases = [clients[i % 2].lease() for i in range(201)]
+    # the budget of all clients is spent in the first 200 leases
+    assert leases[0] == (0, 10, 10, 2000)
+    assert leases[199] == (0, 10, 2000, 2000)
+    # ... and then both clients continue in the next day
+    assert leases[200] == (1, 10, 10, 2000)
+    assert clients[1].lease()[0] == 1
+
+
+def test_early_client_does_not_roll_over_on_partial_budget(tmp_path):
+    # the other client has not registered yet
+    early = volumebudget.SharedVolumeBudget("key", 0, 2, 2000, budget_dir=str(tmp_path))
+
+    leases = [early.lease() for _ in range(101)]
+    assert leases[99] == (0, 10, 1000, 2000)
+    assert leases[100] == (0, 10, 1010, 2000)
+
+
+def test_registering_again_resets_budget(tmp_path):
+    client = volumebudget.SharedVolumeBudget("key", 0, 1, 100, budget_dir=str(tmp_path))
+    for _ in range(101):
+        client.lease()
+    assert client.lease()[0] == 1
+    client.close()
+
+    # a new benchmark starts over
+    client = volumebudget.SharedVolumeBudget("key", 0, 1, 100, budget_dir=str(tmp_path))
+    assert client.lease() == (0, 1, 1, 100)
+
+
+def test_random_events_roll_over_together(tmp_path):
+    def random_event(client_id):
+        return RandomEvent({
+            "index": "logs-<yyyy><mm><dd>",
+            "starting_point": "2019-01-05 15:00:00",
+            "daily_logging_volume": "100kB",
+            "number_of_days": 2,
+            "shared_daily_volume": True,
+            "seed": 7,
+            "client_id": client_id,
+            "client_count": 2,
+            "__utc_now": lambda: datetime(year=2019, month=6, day=17),
+            "__volume_budget_dir": str(tmp_path)
+        })
+
+    fast, slow = random_event(0), random_event(1)
+    # the fast client spends (almost) the whole budget of the first day on its own
+    fast_indices = [idx for _, idx, _ in fast.generate_bulk(500)]
+    assert fast_indices[0] == "logs-20190105"
+    assert fast_indices[-1] == "logs-20190106"
+    # the slow client joins the next day as soon as its lease is spent
+    slow_indices = [idx for _ in range(2) for _, idx, _ in slow.generate_bulk(10)]
+    assert slow_indices[-1] == "logs-20190106"
+
+    with pytest.raises(StopIteration):
+        for _ in range(1000):
+            fast.generate_bulk(100)
+    assert fast.remaining_days == 0
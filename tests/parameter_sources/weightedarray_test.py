@@ -0,0 +1,63 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import collections
+import gzip
+import json
+import random
+
+import pytest
+
+from eventdata.parameter_sources.weightedarray import WeightedArray
+
+
+@pytest.fixture
+def weighted_array(tmp_path):
+    data_file = tmp_path / "items.json.gz"
+    with gzip.open(str(data_file), "wt") as f:
+        json.dump([[700, ["a"]], [200, ["b"]], [99, ["c"]], [1, ["d"]]], f)
+    return WeightedArray(str(data_file), cache_dir=str(tmp_path / "cache"))
+
+
+def test_alias_table_is_linear_in_number_of_items(weighted_array):
+    assert len(weighted_array._probabilities) == 4
+    assert len(weighted_array._aliases) == 4
+
+
+def test_alias_table_preserves_weights(weighted_array):
+    n = len(weighted_array._choices)
+    # each column is chosen with probability 1/n and then either keeps its own item or yields its alias
+    effective = collections.defaultdict(float)
+    for idx, choice in enumerate(weighted_array._choices):
+        p = weighted_array._probabilities[idx]
+        effective[choice[0]] += p / n
+        effective[weighted_array._choices[weighted_array._aliases[idx]][0]] += (1 - p) / n
+
+    assert effective["a"] == pytest.approx(0.7)
+    assert effective["b"] == pytest.approx(0.2)
+    assert effective["c"] == pytest.approx(0.099)
+    assert effective["d"] == pytest.approx(0.001)
+
+
+def test_samples_follow_weights(weighted_array):
+    random.seed(42)
+    samples = collections.Counter(weighted_array.get_random()[0] for _ in range(100000))
+
+    assert samples["a"] / 100000 == pytest.approx(0.7, abs=0.01)
+    assert samples["b"] / 100000 == pytest.approx(0.2, abs=0.01)
+    assert samples["c"] / 100000 == pytest.approx(0.099, abs=0.01)
+    assert 0 < samples["d"] < 300
@@ -0,0 +1,56 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from unittest import mock
+
+from eventdata.runners.adaptive_bulk_runner import adaptive_bulk
+from eventdata.utils import globals as gs
+
+from tests import run_async, as_future
+
+
+@run_async
+async def test_reports_service_time_to_parameter_source():
+    es = mock.Mock()
+    es.bulk.return_value = as_future({
+        "took": 120,
+        "errors": True,
+        "items": [
+            {"index": {"status": 201}},
+            {"index": {"status": 429}},
+            {"index": {"status": 201}}
+        ]
+    })
+
+    response = await adaptive_bulk(es, params={
+        "body": "{}",
+        "bulk-size": 3,
+        "feedback-key": "client-0",
+        "pipeline": "my-pipeline"
+    })
+
+    es.bulk.assert_called_once_with(body="{}", params={"pipeline": "my-pipeline"})
+    assert gs.global_bulk_took.pop("client-0") == 120
+    assert response == {
+        "weight": 3,
+        "unit": "docs",
+        "bulk-size": 3,
+        "took": 120,
+        "success": False,
+        "success-count": 2,
+        "error-count": 1
+    }
@@ -75,6 +75,56 @@ async def test_msearch_without_hits(es):
     }
 
 
+@mock.patch("elasticsearch.Elasticsearch")
+@run_async
+async def test_msearch_with_bytes_body(es):
+    params = {
+        "body": b'{"index":"elasticlogs-*"}\n{"query":{"match_all":{}},"from":0,"size":10}\n'
+                b'{"index":"elasticlogs-*"}\n{"query":{"match_all":{}},"from":0,"size":10}\n',
+        "params": {},
+        "meta_data": {
+            "debug": True
+        }
+    }
+    es.msearch.return_value = as_future({
+        "responses": [
+            {
+                "took": 3,
+                "timed_out": False,
+                "hits": {
+                    "total": 2,
+                    "hits": []
+                },
+                "status": 200
+            },
+            {
+                "took": 5,
+                "timed_out": False,
+                "hits": {
+                    "total": 1,
+                    "hits": []
+                },
+                "status": 200
+            }
+        ]
+    })
+
+    response = await kibana(es, params=params)
+
+    es.msearch.assert_called_once_with(body=params["body"], params={})
+    assert response == {
+        "debug": True,
+        "success": True,
+        "error-count": 0,
+        "hits": 3,
+        "took": 5,
+        "weight": 1,
+        "unit": "ops",
+        "visualisation_count": 2,
+        "request_params": {}
+    }
+
+
 @mock.patch("elasticsearch.Elasticsearch")
 @run_async
 async def test_msearch_with_hits_as_number(es):
@@ -0,0 +1,85 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from unittest import mock
+
+from eventdata.runners.requestcachestats_runner import requestcachestats
+
+from tests import run_async, as_future
+
+
+def node_stats(*request_caches):
+    return {
+        "nodes": {
+            "node-{}".format(i): {"indices": {"request_cache": request_cache}}
+            for i, request_cache in enumerate(request_caches)
+        }
+    }
+
+
+@mock.patch("asyncio.sleep")
+@mock.patch("elasticsearch.Elasticsearch")
+@run_async
+async def test_reports_hit_ratio_within_measurement_period(es, sleep):
+    sleep.return_value = as_future()
+    es.nodes.stats.side_effect = [
+        as_future(node_stats(
+            {"memory_size_in_bytes": 100, "evictions": 0, "hit_count": 10, "miss_count": 20},
+            {"memory_size_in_bytes": 200, "evictions": 1, "hit_count": 5, "miss_count": 5}
+        )),
+        as_future(node_stats(
+            {"memory_size_in_bytes": 300, "evictions": 0, "hit_count": 40, "miss_count": 30},
+            {"memory_size_in_bytes": 400, "evictions": 3, "hit_count": 35, "miss_count": 15}
+        ))
+    ]
+
+    response = await requestcachestats(es, params={"measurement_period": 1800})
+
+    sleep.assert_called_once_with(1800.0)
+    es.nodes.stats.assert_called_with(metric="indices", index_metric="request_cache")
+    assert response == {
+        "weight": 1,
+        "unit": "ops",
+        "request_cache_hit_count": 75,
+        "request_cache_miss_count": 45,
+        "request_cache_evictions": 3,
+        "request_cache_memory_size_in_bytes": 700,
+        "request_cache_hits": 60,
+        "request_cache_misses": 20,
+        "request_cache_evictions_delta": 2,
+        "request_cache_hit_ratio": 0.75
+    }
+
+
+@mock.patch("elasticsearch.Elasticsearch")
+@run_async
+async def test_reports_only_totals_without_measurement_period(es):
+    es.nodes.stats.return_value = as_future(node_stats(
+        {"memory_size_in_bytes": 100, "evictions": 0, "hit_count": 10, "miss_count": 20}
+    ))
+
+    response = await requestcachestats(es, params={})
+
+    es.nodes.stats.assert_called_once_with(metric="indices", index_metric="request_cache")
+    assert response == {
+        "weight": 1,
+        "unit": "ops",
+        "request_cache_hit_count": 10,
+        "request_cache_miss_count": 20,
+        "request_cache_evictions": 0,
+        "request_cache_memory_size_in_bytes": 100
+    }
@@ -0,0 +1,65 @@
+# Licensed to Elasticsearch B.V. under one or more contributor
+# license agreements. See the NOTICE file distributed with
+# this work for additional information regarding copyright
+# ownership. Elasticsearch B.V. licenses this file to you under
+# the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#	http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import contextvars
+
+from eventdata.schedulers.session_scheduler import SessionScheduler, next_action_due
+
+
+class StaticPerfCounter:
+    def __init__(self, start):
+        self.now = start
+
+    def __call__(self, *args, **kwargs):
+        return self.now
+
+
+def in_new_context(f):
+    def wrapper(*args, **kwargs):
+        return contextvars.copy_context().run(f, *args, **kwargs)
+    return wrapper
+
+
+@in_new_context
+def test_sends_first_request_immediately():
+    s = SessionScheduler(params={}, perf_counter=StaticPerfCounter(100))
+
+    assert s.next(0) == 0
+
+
+@in_new_context
+def test_schedules_relative_to_task_start():
+    perf_counter = StaticPerfCounter(100)
+    s = SessionScheduler(params={}, perf_counter=perf_counter)
+    assert s.next(0) == 0
+
+    next_action_due.set(130)
+    perf_counter.now = 101
+    assert s.next(0) == 30
+
+    # overdue actions keep their schedule so that latency includes the time they have been waiting
+    next_action_due.set(135)
+    perf_counter.now = 140
+    assert s.next(30) == 35
+
+
+@in_new_context
+def test_clients_do_not_share_due_actions():
+    next_action_due.set(130)
+    s = SessionScheduler(params={}, perf_counter=StaticPerfCounter(100))
+
+    assert contextvars.Context().run(s.next, 0) == 0